@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Helpers shared by the YaRSS2 benchmarks.
+
+The benchmarks are run from the repository root with YaRSS2 installed in development mode
+(python setup.py develop), e.g.:
+
+    python benchmarks/bench_http_session.py --repeat 5 --output results.json
+
+Each benchmark writes one JSON document with the YaRSS2 and Python versions and a list of results,
+so the numbers can be compared between versions.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+import yarss2.util.common
+from yarss2 import load_libs
+
+
+def get_argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times each measurement is repeated")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout")
+    return parser
+
+
+def setup():
+    """Make the libraries bundled with YaRSS2 importable"""
+    load_libs()
+
+
+def measure(func, repeat=5, number=1):
+    """Time func and return the timings in seconds for a single call"""
+    times = [t / number for t in timeit.repeat(func, repeat=repeat, number=number)]
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "max": times[-1],
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def report(benchmark, results, output=None):
+    """Write the results as JSON"""
+    document = {
+        "benchmark": benchmark,
+        "yarss2_version": yarss2.util.common.get_version(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    else:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        print()
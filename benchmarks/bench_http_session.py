@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Compares downloading torrent files with a new connection for each request (requests.get)
+with the keep-alive sessions in HTTPSessionPool, against a local HTTP(S) server.
+"""
+import datetime
+import os
+import ssl
+import tempfile
+
+import bench_common
+
+bench_common.setup()
+
+from yarss2.tests.utils.helpers import HTTPTestServer  # noqa: E402 isort:skip
+from yarss2.util import common, http  # noqa: E402 isort:skip
+
+
+def create_ssl_context(directory):
+    """Create a server SSL context with a self signed certificate"""
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u"127.0.0.1")])
+    now = datetime.datetime.utcnow()
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256(), default_backend()))
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    with open(cert_file, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def run(server, scheme, downloads, repeat):
+    import requests
+    import urllib3
+    urllib3.disable_warnings()
+
+    url = server.url("/file.torrent").replace("http://", scheme + "://")
+    results = []
+
+    def bare_requests():
+        for i in range(downloads):
+            requests.get(url, verify=False).content
+
+    def session_pool():
+        pool = http.HTTPSessionPool()
+        for i in range(downloads):
+            pool.get(url, verify=False).content
+        pool.close()
+
+    for name, func in (("requests.get", bare_requests), ("HTTPSessionPool.get", session_pool)):
+        server.connection_count = 0
+        timings = bench_common.measure(func, repeat=repeat)
+        results.append({
+            "name": name,
+            "scheme": scheme,
+            "downloads": downloads,
+            "connections_per_run": server.connection_count // repeat,
+            "seconds_per_run": timings,
+            "seconds_per_download": timings["median"] / downloads,
+        })
+    return results
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--downloads", type=int, default=20, help="Number of torrent files downloaded per run")
+    args = parser.parse_args()
+
+    torrent = common.read_file(common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/"))
+    routes = {"/file.torrent": (200, {"Content-Type": "application/x-bittorrent"}, torrent)}
+    results = []
+
+    with HTTPTestServer(routes=routes) as server:
+        results.extend(run(server, "http", args.downloads, args.repeat))
+
+    tmpdir = tempfile.mkdtemp()
+    server = HTTPTestServer(routes=routes)
+    server.socket = create_ssl_context(tmpdir).wrap_socket(server.socket, server_side=True)
+    with server:
+        results.extend(run(server, "https", args.downloads, args.repeat))
+
+    bench_common.report("http_session", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Compares converting the timestamps stored in the config with dateutil,
+with datetime.fromisoformat, and with the cached isodate_to_datetime.
+"""
+import datetime
+
+import bench_common
+
+bench_common.setup()
+
+from dateutil import parser as dateutil_parser  # noqa: E402 isort:skip
+from dateutil.tz import tzutc  # noqa: E402 isort:skip
+
+from yarss2.util import common  # noqa: E402 isort:skip
+
+
+def create_dates(count):
+    start = datetime.datetime(2019, 10, 14, 3, 10, 26)
+    return [(start + datetime.timedelta(minutes=index)).isoformat() for index in range(count)]
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--dates", type=int, default=1000, help="Number of timestamps converted")
+    args = parser.parse_args()
+
+    dates = create_dates(args.dates)
+
+    def dateutil_parse():
+        for date in dates:
+            dateutil_parser.parse(date).replace(tzinfo=tzutc())
+
+    def fromisoformat():
+        for date in dates:
+            common.isodate_to_datetime.__wrapped__(date)
+
+    def cached():
+        for date in dates:
+            common.isodate_to_datetime(date)
+
+    results = []
+    for name, func in (("dateutil", dateutil_parse), ("fromisoformat", fromisoformat),
+                       ("isodate_to_datetime", cached)):
+        result = {"name": name, "dates": args.dates}
+        result.update(bench_common.measure(func, repeat=args.repeat))
+        results.append(result)
+
+    bench_common.report("isodate", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
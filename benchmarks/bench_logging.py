@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Measures the overhead of the YaRSS2 logger for each item in a loop, with the messages
+formatted by the caller and with the arguments formatted by the logger, when the level
+of the python logger is disabled and when it is enabled.
+"""
+import logging as python_logging
+
+import bench_common
+
+bench_common.setup()
+
+from yarss2.util import logging  # noqa: E402 isort:skip
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--items", type=int, default=10000, help="Number of messages logged")
+    args = parser.parse_args()
+
+    python_logger = python_logging.getLogger("yarss2_bench_logging")
+    python_logger.propagate = False
+    python_logger.addHandler(python_logging.NullHandler())
+    log = logging.Logger(logger=python_logger)
+    items = [{"title": "Torrent %d" % i, "link": "http://example.com/%d.torrent" % i} for i in range(args.items)]
+
+    def preformatted():
+        for item in items:
+            log.debug("Not adding because of old timestamp: '%s' (%s)" % (item["title"], item["link"]), gtkui=False)
+
+    def lazy():
+        for item in items:
+            log.debug("Not adding because of old timestamp: '%s' (%s)", item["title"], item["link"], gtkui=False)
+
+    results = []
+    for level in (python_logging.INFO, python_logging.DEBUG):
+        python_logger.setLevel(level)
+        for name, func in (("preformatted", preformatted), ("lazy", lazy)):
+            result = {"name": name, "items": args.items, "enabled": level == python_logging.DEBUG}
+            result.update(bench_common.measure(func, repeat=args.repeat))
+            results.append(result)
+
+    bench_common.report("logging", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Times each stage of an RSS Feed update: fetch_and_parse_rssfeed_atom,
+RSSFeedHandler.get_rssfeed_parsed, update_rssfeeds_dict_matching and fetch_feed_torrents.
+
+The feeds are scaled up copies of a test feed in yarss2/tests/data/feeds, where the items
+of the test feed are repeated with a unique number added to each title.
+update_rssfeeds_dict_matching is timed for a single subscription, and fetch_feed_torrents
+for the RSS Feed with all the subscriptions, e.g.:
+
+    python benchmarks/bench_pipeline.py --feed t1.rss --items 10,10000 --subscriptions 1,5000
+"""
+import os
+import re
+import shutil
+import tempfile
+
+import bench_common
+
+bench_common.setup()
+
+import yarss2.util.common  # noqa: E402 isort:skip
+from yarss2 import yarss_config  # noqa: E402 isort:skip
+from yarss2.rssfeed_handling import RSSFeedHandler, fetch_and_parse_rssfeed_atom  # noqa: E402 isort:skip
+from yarss2.util import logging  # noqa: E402 isort:skip
+
+ITEM_REGEX = re.compile(r"<item[\s>].*?</item>", re.DOTALL)
+TITLE_REGEX = re.compile(r"<title>\s*(?:<!\[CDATA\[)?(.*?)(?:\]\]>)?\s*</title>", re.DOTALL)
+
+
+def get_int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def read_feed(filename):
+    path = yarss2.util.common.get_resource(filename, path="tests/data/feeds")
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def create_feed(feed, item_count):
+    """Returns the feed with item_count items, and the titles of the items in the original feed"""
+    items = [m for m in ITEM_REGEX.finditer(feed)]
+    head = feed[:items[0].start()]
+    tail = feed[items[-1].end():]
+    templates = [m.group(0) for m in items]
+    titles = [TITLE_REGEX.search(template).group(1) for template in templates]
+    scaled_items = []
+    for index in range(item_count):
+        template = templates[index % len(templates)]
+        # Add the number to the end of the title text
+        scaled_items.append(TITLE_REGEX.sub(lambda m: m.group(0).replace(m.group(1), u"%s #%d" % (m.group(1), index)),
+                                            template, count=1))
+    return head + u"\n".join(scaled_items) + tail, titles
+
+
+def create_config(feed_path, titles, subscription_count):
+    """Subscription N matches item number N in the scaled feed"""
+    config = yarss_config.default_prefs()
+    config["rssfeeds"]["0"] = yarss_config.get_fresh_rssfeed_config(
+        name=u"Benchmark", url=feed_path, site=u"tracker.example.com", key="0")
+    for index in range(subscription_count):
+        word = re.split(r"\W+", titles[index % len(titles)].strip())[0]
+        config["subscriptions"][str(index)] = yarss_config.get_fresh_subscription_config(
+            name=u"Subscription %d" % index, rssfeed_key="0", key=str(index),
+            last_match=yarss2.util.common.get_default_date().isoformat(),
+            regex_include=u"%s.*#%d$" % (re.escape(word), index), regex_exclude=u"\\bsample\\b")
+    return config
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--feed", default="freebsd_rss.xml", help="Test feed in yarss2/tests/data/feeds")
+    parser.add_argument("--items", type=get_int_list, default=[10, 100, 1000],
+                        help="Comma separated list with the number of items in the feed")
+    parser.add_argument("--subscriptions", type=get_int_list, default=[1, 10, 100, 1000],
+                        help="Comma separated list with the number of subscriptions on the feed")
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    handler = RSSFeedHandler(log)
+    feed = read_feed(args.feed)
+    tmp_dir = tempfile.mkdtemp(prefix="yarss2_bench_")
+    results = []
+
+    def add_result(stage, func, **kwargs):
+        result = {"stage": stage, "feed": args.feed}
+        result.update(kwargs)
+        result.update(bench_common.measure(func, repeat=args.repeat))
+        results.append(result)
+
+    try:
+        for item_count in args.items:
+            content, titles = create_feed(feed, item_count)
+            feed_path = os.path.join(tmp_dir, "feed_%d.xml" % item_count)
+            with open(feed_path, "wb") as f:
+                f.write(content.encode("utf-8"))
+
+            config = create_config(feed_path, titles, max(args.subscriptions))
+            rssfeed_data = config["rssfeeds"]["0"]
+            items = handler.get_rssfeed_parsed(rssfeed_data)["items"]
+            options = config["subscriptions"]["0"].copy()
+            del options["custom_text_lines"]
+
+            add_result("fetch_and_parse_rssfeed_atom", lambda: fetch_and_parse_rssfeed_atom(feed_path),
+                       items=item_count, feed_bytes=len(content))
+            add_result("get_rssfeed_parsed", lambda: handler.get_rssfeed_parsed(rssfeed_data),
+                       items=item_count)
+            add_result("update_rssfeeds_dict_matching",
+                       lambda: handler.update_rssfeeds_dict_matching(items, options=options),
+                       items=item_count, subscriptions=1)
+
+            for subscription_count in args.subscriptions:
+                config = create_config(feed_path, titles, subscription_count)
+                matches = len(handler.fetch_feed_torrents(config, "0")["matching_torrents"])
+                add_result("fetch_feed_torrents", lambda: handler.fetch_feed_torrents(config, "0"),
+                           items=item_count, subscriptions=subscription_count, matches=matches)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    bench_common.report("pipeline", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
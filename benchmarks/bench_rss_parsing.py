@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Compares parsing a large RSS feed completely with atoma, with the incremental
+parse_rss_stream that stops at the first item that has already been processed.
+"""
+from io import BytesIO
+
+import bench_common
+
+bench_common.setup()
+
+from yarss2 import rssfeed_handling  # noqa: E402 isort:skip
+
+ITEM = u"""
+    <item>
+      <title>Some.Show.S01E{index:03d}.720p.WEB.H264-GROUP</title>
+      <link>http://tracker.example.com/download/{index}.torrent</link>
+      <guid isPermaLink="false">{index:040x}</guid>
+      <pubDate>Mon, 14 Oct 2019 03:{minute:02d}:26 +0000</pubDate>
+      <description>{description}</description>
+      <enclosure url="http://tracker.example.com/download/{index}.torrent" length="123456789"
+                 type="application/x-bittorrent" />
+    </item>"""
+
+
+def create_feed(item_count, description_size):
+    description = u"Size: 1.2 GB " + u"x" * description_size
+    items = [ITEM.format(index=index, minute=(item_count - index) % 60, description=description)
+             for index in range(item_count, 0, -1)]
+    feed = (u'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+            u"<title>Benchmark feed</title><link>http://tracker.example.com</link>"
+            u"<description>Benchmark feed</description><ttl>15</ttl>%s\n</channel></rss>" % u"".join(items))
+    return feed.encode("utf-8")
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--items", type=int, default=500, help="Number of items in the feed")
+    parser.add_argument("--new-items", type=int, default=5, help="Number of items not processed earlier")
+    parser.add_argument("--description-size", type=int, default=4000, help="Size of each item description")
+    args = parser.parse_args()
+
+    import atoma
+    content = create_feed(args.items, args.description_size)
+    seen_guid = u"%040x" % (args.items - args.new_items)
+
+    def parse_atoma():
+        return rssfeed_handling.atoma_result_to_dict(atoma.parse_rss_bytes(content))
+
+    def parse_stream():
+        return rssfeed_handling.parse_rss_stream(BytesIO(content),
+                                                 stop_item_func=lambda item: item["guid"] == seen_guid)
+
+    results = []
+    for name, func in (("atoma.parse_rss_bytes", parse_atoma), ("parse_rss_stream", parse_stream)):
+        result = {"name": name, "feed_bytes": len(content), "items_parsed": len(func()["items"])}
+        result.update(bench_common.measure(func, repeat=args.repeat))
+        results.append(result)
+
+    bench_common.report("rss_parsing", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Compares matching the items of one RSS Feed against many subscriptions with
+update_rssfeeds_dict_matching for each subscription, and with SubscriptionMatcher.
+"""
+import bench_common
+
+bench_common.setup()
+
+from yarss2 import yarss_config  # noqa: E402 isort:skip
+from yarss2.rssfeed_handling import RSSFeedHandler  # noqa: E402 isort:skip
+from yarss2.subscription_matcher import SubscriptionMatcher  # noqa: E402 isort:skip
+from yarss2.util import logging  # noqa: E402 isort:skip
+
+
+def create_items(count, shows):
+    items = {}
+    for index in range(count):
+        title = u"Show.Number.%d.S%02dE%02d.720p.WEB.H264-GROUP" % (index % shows, index % 10 + 1, index % 24 + 1)
+        items[index] = {"title": title, "link": u"http://tracker.example.com/%d.torrent" % index,
+                        "matches": False, "updated": u"", "item_id": str(index)}
+    return items
+
+
+def create_subscriptions(count):
+    subscriptions = []
+    for index in range(count):
+        subscription = yarss_config.get_fresh_subscription_config(
+            key=str(index), rssfeed_key="0",
+            regex_include=u"Show\\.Number\\.%d\\.S\\d+E\\d+.*720p" % index, regex_exclude=u"HDTV|XviD")
+        subscriptions.append(subscription)
+    return subscriptions
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--items", type=int, default=500, help="Number of items in the feed")
+    parser.add_argument("--subscriptions", type=int, default=800, help="Number of subscriptions on the feed")
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    items = create_items(args.items, args.subscriptions)
+    subscriptions = create_subscriptions(args.subscriptions)
+    handler = RSSFeedHandler(log)
+
+    def match_each_subscription():
+        count = 0
+        for subscription in subscriptions:
+            options = subscription.copy()
+            del options["custom_text_lines"]
+            matches, message = handler.update_rssfeeds_dict_matching(items, options=options)
+            count += len(matches)
+        return count
+
+    def match_all_subscriptions():
+        return sum(len(matches) for matches in SubscriptionMatcher(subscriptions, log).match(items))
+
+    results = []
+    for name, func in (("update_rssfeeds_dict_matching", match_each_subscription),
+                       ("SubscriptionMatcher", match_all_subscriptions)):
+        result = {"name": name, "items": args.items, "subscriptions": args.subscriptions, "matches": func()}
+        result.update(bench_common.measure(func, repeat=args.repeat))
+        results.append(result)
+
+    bench_common.report("subscription_matching", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+"""
+Measures reading the infohash, name, size and file list of a torrent file, when the
+torrent file is decoded at each step (verifying the download, reading the metadata and
+adding the torrent), and when the ParsedTorrent decoded once is reused at each step.
+The FreeBSD torrent from the tests and a generated torrent with many files are used.
+"""
+import hashlib
+
+import bench_common
+
+bench_common.setup()
+
+from deluge import bencode  # noqa: E402 isort:skip
+from deluge._libtorrent import lt  # noqa: E402 isort:skip
+
+import yarss2.util.common  # noqa: E402 isort:skip
+from yarss2.util.torrentinfo import ParsedTorrent  # noqa: E402 isort:skip
+
+# Steps reading the metadata of a downloaded torrent before it is added
+STEPS = 3
+
+
+def create_torrent(num_files, file_size=1024 * 1024, piece_length=256 * 1024):
+    files = [{"length": file_size, "path": [b"Directory %d" % (i // 100), b"File %d.bin" % i]}
+             for i in range(num_files)]
+    num_pieces = (num_files * file_size + piece_length - 1) // piece_length
+    pieces = b"".join(hashlib.sha1(b"%d" % i).digest() for i in range(num_pieces))
+    info = {b"name": b"Generated", b"piece length": piece_length, b"pieces": pieces, b"files": files}
+    return bencode.bencode({b"announce": b"http://example.com/announce", b"info": info})
+
+
+def read_metadata(torrent_info):
+    return (str(torrent_info.info_hash()), torrent_info.name(), torrent_info.total_size(),
+            [torrent_info.files().file_path(i) for i in range(torrent_info.num_files())])
+
+
+def main():
+    parser = bench_common.get_argument_parser(__doc__)
+    parser.add_argument("--files", type=int, default=5000, help="Number of files in the generated torrent")
+    args = parser.parse_args()
+
+    filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+    torrents = (("freebsd", yarss2.util.common.read_file(filename)),
+                ("generated", create_torrent(args.files)))
+
+    results = []
+    for torrent_name, filedump in torrents:
+        num_files = ParsedTorrent(filedump).num_files
+
+        def decode_each_step():
+            for step in range(STEPS):
+                read_metadata(lt.torrent_info(lt.bdecode(filedump)))
+
+        def parsed_once():
+            parsed_torrent = ParsedTorrent(filedump)
+            for step in range(STEPS):
+                (parsed_torrent.infohash, parsed_torrent.name, parsed_torrent.size, parsed_torrent.files)
+
+        for name, func in (("decode_each_step", decode_each_step),
+                           ("parsed_once", parsed_once)):
+            result = {"name": name, "torrent": torrent_name, "files": num_files, "bytes": len(filedump),
+                      "steps": STEPS}
+            result.update(bench_common.measure(func, repeat=args.repeat))
+            results.append(result)
+
+    bench_common.report("torrent_metadata", results, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import time
+
+import deluge.configmanager
+
+from yarss2.util import common
+from yarss2.util.config_saver import DEFAULT_SAVE_DELAY, ConfigSaver
+
+ADAPTIVE_INTERVALS_FILENAME = "yarss2_adaptive_intervals.conf"
+# Weight of the latest update in the item arrival rate
+ARRIVAL_RATE_WEIGHT = 0.3
+
+
+def default_prefs():
+    return {"rssfeeds": {}}
+
+
+class AdaptiveIntervals(object):
+    """Learns the update interval of the RSS Feeds with adaptive update interval enabled.
+
+    The arrival rate of new items (items per minute) is an exponentially weighted
+    moving average of the number of new items found by each update. The update
+    interval is the expected time between two new items, limited by the
+    adaptive_update_interval_min and adaptive_update_interval_max of the RSS Feed.
+    The interval grows while no new items are found, and shrinks after a burst of items.
+
+    The state is stored in a separate config file, so it survives restarts.
+    Must only be modified from the main thread. The changes are written to the
+    file save_delay seconds after the first change (see save_later).
+    """
+
+    def __init__(self, logger, config=None, clock=time.time, save_delay=DEFAULT_SAVE_DELAY):
+        self.log = logger
+        self.config = config
+        self.clock = clock
+
+        # Prividing a config here us used for testing
+        if config is None:
+            self.config = deluge.configmanager.ConfigManager(ADAPTIVE_INTERVALS_FILENAME, default_prefs())
+        self.saver = ConfigSaver(self.config, delay=save_delay)
+
+    def save(self):
+        """Write the state to the file now"""
+        self.saver.save()
+
+    def save_later(self):
+        """Write the state to the file after the delay, once for all the changes in the meantime"""
+        self.saver.save_later()
+
+    def get_interval(self, rssfeed_data):
+        """Returns the update interval (minutes) to use for the RSS Feed"""
+        if not rssfeed_data.get("adaptive_update_interval", False):
+            return rssfeed_data["update_interval"]
+        state = self.config["rssfeeds"].get(rssfeed_data["key"], None)
+        if state is None:
+            return self._limit(rssfeed_data, rssfeed_data["update_interval"])
+        return self._limit(rssfeed_data, state["interval"])
+
+    def update(self, rssfeed_data, item_dates):
+        """Update the arrival rate with the published dates (isoformat) of the items
+        found by an update of the RSS Feed. Returns the new update interval in minutes"""
+        now = self.clock()
+        dates = [common.isodate_to_datetime(date) for date in item_dates if date]
+        newest = max(dates) if dates else None
+
+        state = self.config["rssfeeds"].get(rssfeed_data["key"], None)
+        if state is None:
+            # Nothing to compare with on the first update, so all the items would look new
+            interval = self._limit(rssfeed_data, rssfeed_data["update_interval"])
+            state = {"rate": 1.0 / interval, "interval": interval}
+        else:
+            last_newest = common.isodate_to_datetime(state["newest_item_date"]) \
+                if state["newest_item_date"] else None
+            new_count = len([date for date in dates if last_newest is None or date > last_newest])
+            elapsed = max(now - state["last_update"], 60) / 60.0
+            state["rate"] = ARRIVAL_RATE_WEIGHT * new_count / elapsed + (1 - ARRIVAL_RATE_WEIGHT) * state["rate"]
+            interval = rssfeed_data["adaptive_update_interval_max"]
+            if state["rate"] > 0:
+                interval = self._limit(rssfeed_data, int(round(1.0 / state["rate"])))
+            if interval != state["interval"]:
+                self.log.info("Adaptive update interval of RSS Feed '%s' changed from %d to %d minutes "
+                              "(%d new items)" % (rssfeed_data["name"], state["interval"], interval, new_count))
+            state["interval"] = interval
+            if last_newest is not None and (newest is None or newest < last_newest):
+                newest = last_newest
+
+        state["last_update"] = now
+        state["newest_item_date"] = newest.isoformat() if newest else state.get("newest_item_date", None)
+        self.config["rssfeeds"][rssfeed_data["key"]] = state
+        return state["interval"]
+
+    def reset(self, rssfeed_key):
+        """Forget the learned arrival rate of the RSS Feed"""
+        self.config["rssfeeds"].pop(rssfeed_key, None)
+
+    def _limit(self, rssfeed_data, interval):
+        interval = min(interval, rssfeed_data["adaptive_update_interval_max"])
+        return max(interval, rssfeed_data["adaptive_update_interval_min"], 1)
@@ -12,11 +12,16 @@ from deluge.plugins.pluginbase import CorePluginBase
 
 import yarss2.util.common
 from yarss2.rssfeed_scheduler import RSSFeedScheduler
-from yarss2.torrent_handling import TorrentHandler
+from yarss2.torrent_handling import TorrentHandler, get_session_infohashes
 from yarss2.util import logging
-from yarss2.util.http import get_matching_cookies_dict
+from yarss2.util.async_http import get_http_client
+from yarss2.util.gtkui_log import get_gtkui_log_buffer
+from yarss2.util.http import get_cookie_index, get_rate_limiter, get_session_pool
+from yarss2.util.metrics import MetricsFileWriter, format_metrics
+from yarss2.util.regex_cache import get_regex_cache
+from yarss2.util.stats import get_pipeline_stats
 from yarss2.util.yarss_email import send_torrent_email
-from yarss2.yarss_config import YARSSConfig, get_user_agent
+from yarss2.yarss_config import YARSSConfig, get_fresh_general_config, get_user_agent
 
 log = logging.getLogger(__name__)
 
@@ -42,26 +47,86 @@ class Core(CorePluginBase):
             self.yarss_config = YARSSConfig(self.log)
         else:
             self.yarss_config = config
+        get_session_infohashes().enable()
         self.rssfeed_scheduler = RSSFeedScheduler(self.yarss_config, self.log)
         self.rssfeed_scheduler.enable_timers()
+        self.metrics_writer = None
+        self.update_metrics_writer()
         self.log.info("Enabled YaRSS2 %s" % yarss2.util.common.get_version())
 
     def disable(self):
         self.yarss_config.save()
+        self.rssfeed_scheduler.seen_items.save()
+        self.rssfeed_scheduler.adaptive_intervals.save()
         self.rssfeed_scheduler.disable_timers()
+        get_session_infohashes().disable()
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+            self.metrics_writer.write()
+        get_session_pool().close()
+        get_http_client().close()
+        get_gtkui_log_buffer().flush()
 
     def update(self):
         pass
 
+    def update_metrics_writer(self):
+        """Start or stop writing the metrics file according to the general config"""
+        general = self.yarss_config.get_config().get("general", {})
+        default_general = get_fresh_general_config()
+        metrics_file = general.get("metrics_file", default_general["metrics_file"])
+        interval = general.get("metrics_interval", default_general["metrics_interval"])
+        if self.metrics_writer is not None:
+            if self.metrics_writer.filename == metrics_file and self.metrics_writer.interval == interval:
+                return
+            self.metrics_writer.stop()
+            self.metrics_writer = None
+        if metrics_file:
+            self.metrics_writer = MetricsFileWriter(self.get_metrics, metrics_file, interval=interval)
+            self.metrics_writer.start()
+
     @export
     def initiate_rssfeed_update(self, rssfeed_key, subscription_key=None):
         return self.rssfeed_scheduler.queue_rssfeed_update(rssfeed_key, subscription_key=subscription_key)
 
+    @export
+    def get_rate_limiter_state(self):
+        """Returns the state of the requests to each host, with the number of seconds
+        to wait before a request is sent ("backoff") after HTTP 429/503 responses"""
+        return get_rate_limiter().get_state()
+
+    @export
+    def get_stats(self):
+        """Returns the timings of the stages of the updates of each RSS Feed and the matching of
+        each subscription (see PipelineStats.get_stats), with the counters of the regex cache,
+        the rate limiter, the RSS Feed updates, the config saves and the dropped GUI log messages"""
+        stats = get_pipeline_stats().get_stats()
+        stats["regex_cache"] = get_regex_cache().get_stats()
+        stats["rate_limiter"] = get_rate_limiter().get_state()
+        stats["updates"] = dict(self.rssfeed_scheduler.update_counts)
+        stats["run_queue"] = self.rssfeed_scheduler.run_queue.get_state()
+        download_cache = self.rssfeed_scheduler.download_cache
+        stats["torrent_download_cache"] = {"size": len(download_cache), "hits": download_cache.hits}
+        stats["config_saves"] = self.yarss_config.saver.saves
+        stats["gtkui_log_dropped"] = get_gtkui_log_buffer().dropped_total
+        return stats
+
+    @export
+    def get_metrics(self):
+        """Returns the stats returned by get_stats in the Prometheus text exposition format"""
+        return format_metrics(self.get_stats(), self.yarss_config.get_config())
+
     @export
     def get_config(self):
         "Returns the config dictionary"
         return self.yarss_config.get_config()
 
+    @export
+    def get_config_changes(self, since_version=None):
+        """Returns the changes of the config after since_version, or the complete
+        config if since_version is None or too old (see YARSSConfig.get_config_changes)"""
+        return self.yarss_config.get_config_changes(since_version)
+
     @export
     def save_general_config(self, conf):
         conf = {"general": conf}
@@ -69,6 +134,9 @@ class Core(CorePluginBase):
             self.yarss_config.set_config(conf)
         except ValueError as v:
             self.log.error("Failed to save general configurations:" + str(v))
+        else:
+            self.rssfeed_scheduler.update_run_queue_limits()
+            self.update_metrics_writer()
 
     @export
     def save_email_configurations(self, email_configurations):
@@ -89,6 +157,11 @@ class Core(CorePluginBase):
             else:
                 self.log.info("Deleting Subscription '%s'" %
                               self.yarss_config.get_config()["subscriptions"][dict_key]["name"])
+                get_pipeline_stats().reset(subscription_key=dict_key)
+        elif subscription_data is not None:
+            # The subscription must be matched against all the items in the feed on next update
+            self.yarss_config.reset_rssfeed_validators(subscription_data.get("rssfeed_key", None))
+            self.rssfeed_scheduler.seen_items.reset(subscription_data.get("rssfeed_key", None))
         try:
             return self.yarss_config.generic_save_config("subscriptions", dict_key=dict_key,
                                                          data_dict=subscription_data, delete=delete)
@@ -108,17 +181,25 @@ class Core(CorePluginBase):
                 else:
                     self.log.info("Stopping and deleting RSS Feed '%s'" %
                                   self.yarss_config.get_config()["rssfeeds"][dict_key]["name"])
+            elif rssfeed_data is not None:
+                # The URL or cookies may have changed, so do not use conditional GET on next update
+                rssfeed_data["etag"] = u""
+                rssfeed_data["modified"] = u""
+                if "key" in rssfeed_data:
+                    self.rssfeed_scheduler.seen_items.reset(rssfeed_data["key"])
 
             config = self.yarss_config.generic_save_config("rssfeeds", dict_key=dict_key,
                                                            data_dict=rssfeed_data, delete=delete)
             if delete is True:
                 self.rssfeed_scheduler.delete_timer(dict_key)
+                self.rssfeed_scheduler.seen_items.reset(dict_key)
+                self.rssfeed_scheduler.adaptive_intervals.reset(dict_key)
+                get_pipeline_stats().reset(rssfeed_key=dict_key)
             # Successfully saved rssfeed, check if timer was changed
             elif config:
-                if self.rssfeed_scheduler.set_timer(rssfeed_data["key"], rssfeed_data["update_interval"],
-                                                    rssfeed_data["update_on_startup"]):
-                    self.log.info("Scheduled RSS Feed '%s' with interval %s" %
-                                  (rssfeed_data["name"], rssfeed_data["update_interval"]))
+                interval = self.rssfeed_scheduler.get_update_interval(config["rssfeeds"][rssfeed_data["key"]])
+                if self.rssfeed_scheduler.set_timer(rssfeed_data["key"], interval, rssfeed_data["update_on_startup"]):
+                    self.log.info("Scheduled RSS Feed '%s' with interval %s" % (rssfeed_data["name"], interval))
             return config
         except ValueError as v:
             self.log.error("Failed to save rssfeed:" + str(v))
@@ -163,8 +244,8 @@ class Core(CorePluginBase):
 
     @export
     def add_torrent(self, torrent_info):
-        site_cookies_dict = get_matching_cookies_dict(self.yarss_config.get_config()["cookies"], torrent_info["link"])
-        torrent_info["site_cookies_dict"] = site_cookies_dict
+        cookie_index = get_cookie_index(self.yarss_config.get_config()["cookies"])
+        torrent_info["site_cookies_dict"] = cookie_index.get_cookies_dict(torrent_info["link"])
         if "rssfeed_key" in torrent_info:
             rssfeed_data = self.yarss_config.get_config()["rssfeeds"][torrent_info["rssfeed_key"]]
             torrent_info["user_agent"] = get_user_agent(rssfeed_data=rssfeed_data)
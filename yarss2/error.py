@@ -3,3 +3,8 @@ from deluge.error import DelugeError
 
 class FetchAndFeedparsingError(DelugeError):
     pass
+
+
+class RateLimitError(DelugeError):
+    """Raised when a request is not sent because the host has asked us to wait"""
+    pass
@@ -741,7 +741,7 @@ class DialogSubscription(DialogSubscriptionGUI):
             torrent_download = TorrentDownload(torrent_download)
             if torrent_download.success:
                 return True
-            if torrent_download.filedump is None:
+            if torrent_download.filedump is None or torrent_download.duplicate:
                 return
 
             readable_body = http.clean_html_body(torrent_download.filedump)
@@ -37,10 +37,12 @@ from .common import show_message_dialog
 class GtkUI(Gtk3PluginBase):
 
     def enable(self):
+        # The version of the config shown, None until the config has been received
+        self.config_version = None
         self.create_ui()
         self.on_show_prefs()  # Necessary for the first time when the plugin is installed
-        client.register_event_handler("YARSSConfigChangedEvent", self.cb_on_config_changed_event)
-        client.register_event_handler("GtkUILogMessageEvent", self.cb_on_log_message_arrived_event)
+        client.register_event_handler("YARSSConfigChangesEvent", self.cb_on_config_changes_event)
+        client.register_event_handler("GtkUILogMessagesEvent", self.cb_on_log_messages_arrived_event)
         client.register_event_handler("PluginEnabledEvent", self.plugins_enabled_changed)
         client.register_event_handler("PluginDisabledEvent", self.plugins_enabled_changed)
         self.plugins_enabled_changed("Label")
@@ -187,20 +189,56 @@ class GtkUI(Gtk3PluginBase):
 
     def on_show_prefs(self):
         """Called when showing preferences window"""
-        client.yarss2.get_config().addCallback(self.cb_get_config)
+        client.yarss2.get_config_changes(self.config_version).addCallback(self.cb_get_config_changes)
 
-    def cb_on_config_changed_event(self, config):
-        """Callback function called on YARSSConfigChangedEvent events"""
-        # Tried to fix error where glade.get_object("label_status") in dialog_subscription returns None. (Why??)
-        # DeferToThread actually works, but it seems to add a new error, where Deluge crashes, probably
-        # caused by the GUI being updated in another thread than the main thread.
-        # from twisted.internet import threads
-        # d = threads.deferToThread(self.cb_get_config, config)
-        self.cb_get_config(config)
+    def cb_on_config_changes_event(self, changes):
+        """Callback function called on YARSSConfigChangesEvent events"""
+        if self.config_version is None or changes["since"] > self.config_version:
+            # Events have been missed, so the changes since the version shown are fetched
+            client.yarss2.get_config_changes(self.config_version).addCallback(self.cb_get_config_changes)
+        else:
+            self.cb_get_config_changes(changes)
+
+    def cb_get_config_changes(self, changes):
+        """Callback function called with the changes of the config from core"""
+        if changes is None:
+            self.log.error("An error has occured. Cannot load data from config")
+            return
+        if "config" in changes:
+            self.update_data_from_config(changes["config"])
+        elif changes["sections"]:
+            # Changes to the settings are shown by updating the complete GUI
+            config = self.get_config_shown()
+            config.update(changes["sections"])
+            self.apply_element_changes(config, changes["changes"])
+            self.update_data_from_config(config)
+        elif changes["changes"]:
+            self.apply_element_changes(self.get_config_shown(), changes["changes"])
+            self.update_lists(changes["changes"].keys())
+        self.config_version = changes["version"]
+
+    def get_config_shown(self):
+        return {"subscriptions": self.subscriptions,
+                "rssfeeds": self.rssfeeds,
+                "cookies": self.cookies,
+                "email_messages": self.email_messages,
+                "email_configurations": self.email_config,
+                "default_values": self.default_values,
+                "general": self.general_config}
+
+    def apply_element_changes(self, config, element_changes):
+        """Apply the changes to the elements, like subscriptions, in the config.
+        An element changed to None has been deleted"""
+        for section, elements in element_changes.items():
+            for key, element in elements.items():
+                if element is None:
+                    config[section].pop(key, None)
+                else:
+                    config[section][key] = element
 
-    def cb_on_log_message_arrived_event(self, message):
-        """Callback function called on GtkUILogMessageEvent events"""
-        self.gtkui_log.gtkui_log_message(message)
+    def cb_on_log_messages_arrived_event(self, messages):
+        """Callback function called on GtkUILogMessagesEvent events"""
+        self.gtkui_log.gtkui_log_messages(messages)
 
     def on_checkbutton_show_log_messages_gui_toggled(self, widget):
         show_log_in_gui = self.glade.get_object("checkbutton_show_log_messages_gui").get_active()
@@ -230,23 +268,7 @@ class GtkUI(Gtk3PluginBase):
             self.glade = Gtk.Builder.new_from_file(get_resource("yarss_main.ui"))
 
         # Update GUI
-        self.update_subscription_list(self.subscriptions_store)
-        self.update_rssfeeds_list(self.rssfeeds_store)
-        self.update_cookies_list(self.cookies_store)
-        self.update_email_messages_list(self.email_messages_store)
-
-        # Set selection for each treeview
-        if self.selected_path_subscriptions and self.subscriptions_treeview.get_selection():
-            self.subscriptions_treeview.get_selection().select_path(self.selected_path_subscriptions)
-
-        if self.selected_path_rssfeeds and self.rssfeeds_treeview.get_selection():
-            self.rssfeeds_treeview.get_selection().select_path(self.selected_path_rssfeeds)
-
-        if self.selected_path_email_message and self.email_messages_treeview.get_selection():
-            self.email_messages_treeview.get_selection().select_path(self.selected_path_email_message)
-
-        if self.selected_path_cookies and self.cookies_treeview.get_selection():
-            self.cookies_treeview.get_selection().select_path(self.selected_path_cookies)
+        self.update_lists(["subscriptions", "rssfeeds", "cookies", "email_messages"])
 
         # Email configurations
         send_email_checkbox = self.glade.get_object("checkbutton_send_email_on_torrent_events")
@@ -282,6 +304,27 @@ class GtkUI(Gtk3PluginBase):
         self.gtkui_log.show_log_in_gui = show_log_in_gui
         self.glade.get_object("checkbutton_show_log_messages_gui").set_active(show_log_in_gui)
 
+    def update_lists(self, sections):
+        """Update the lists showing the config sections, and restore the selection"""
+        # The subscriptions list shows the RSS Feed names, and the RSS Feeds list the subscription counts
+        if "subscriptions" in sections or "rssfeeds" in sections:
+            self.update_subscription_list(self.subscriptions_store)
+            self.update_rssfeeds_list(self.rssfeeds_store)
+            if self.selected_path_subscriptions and self.subscriptions_treeview.get_selection():
+                self.subscriptions_treeview.get_selection().select_path(self.selected_path_subscriptions)
+            if self.selected_path_rssfeeds and self.rssfeeds_treeview.get_selection():
+                self.rssfeeds_treeview.get_selection().select_path(self.selected_path_rssfeeds)
+
+        if "email_messages" in sections:
+            self.update_email_messages_list(self.email_messages_store)
+            if self.selected_path_email_message and self.email_messages_treeview.get_selection():
+                self.email_messages_treeview.get_selection().select_path(self.selected_path_email_message)
+
+        if "cookies" in sections:
+            self.update_cookies_list(self.cookies_store)
+            if self.selected_path_cookies and self.cookies_treeview.get_selection():
+                self.cookies_treeview.get_selection().select_path(self.selected_path_cookies)
+
     def update_subscription_list(self, subscriptions_store):
         subscriptions_store.clear()
 
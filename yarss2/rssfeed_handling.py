@@ -6,12 +6,17 @@
 # the additional special exception to link portions of this program with the OpenSSL library.
 # See LICENSE for more details.
 #
+import hashlib
 import re
+from io import BytesIO
 
 import attr
 
-from yarss2.error import FetchAndFeedparsingError
+from yarss2.error import FetchAndFeedparsingError, RateLimitError
+from yarss2.subscription_matcher import SubscriptionMatcher
 from yarss2.util import common, http
+from yarss2.util.regex_cache import compile_regex
+from yarss2.util.stats import timed
 from yarss2.yarss_config import get_user_agent
 
 
@@ -68,21 +73,51 @@ def get_download_size(item):
     return _get_size(item)
 
 
-def atoma_result_to_dict(atoma_result):
-
-    def item_to_dict(item):
-        d = attr.asdict(item)
-        if d['pub_date'] is not None:
-            dt = d['pub_date']
-            if dt.tzinfo is None:
-                dt = common.datetime_add_timezone(dt)
-            d['published_date'] = dt.isoformat()
-            # We must remove datetime.datetime to make the dict encodable by rencode
-            del d['pub_date']
+def get_magnet_infohash(magnet):
+    match = re.search(r"xt=urn:btih:(?P<infohash>[0-9a-zA-Z]+)", magnet)
+    if match:
+        return match.group("infohash").lower()
+    return None
+
+
+def get_item_infohash(item, magnet=None):
+    """Returns the infohash of the item from the torrent namespace of the
+    RSS Feed, or from the magnet link. None if not available"""
+    infohash = (item.get('torrent', None) or {}).get('infohash', None)
+    if infohash:
+        return infohash.lower()
+    if magnet:
+        return get_magnet_infohash(magnet)
+    return None
+
+
+def get_item_id(item, link=None, magnet=None):
+    """Returns the ID used to recognize an item in the feed.
+    This is the GUID if available, else the infohash of the magnet link, or the link"""
+    guid = item.get("guid", None) or item.get("id", None)
+    if guid:
+        return guid
+    if magnet:
+        infohash = get_magnet_infohash(magnet)
+        if infohash:
+            return infohash
+    return link
+
+
+def atoma_item_to_dict(item):
+    d = attr.asdict(item)
+    if d['pub_date'] is not None:
+        dt = d['pub_date']
+        if dt.tzinfo is None:
+            dt = common.datetime_add_timezone(dt)
+        d['published_date'] = dt.isoformat()
+        # We must remove datetime.datetime to make the dict encodable by rencode
+        del d['pub_date']
+    return d
 
-        return d
 
-    items = [item_to_dict(item) for item in atoma_result.items if item.title is not None]
+def atoma_result_to_dict(atoma_result):
+    items = [atoma_item_to_dict(item) for item in atoma_result.items if item.title is not None]
     result = {
         'items': items, 'bozo': 0,
         'feed': {
@@ -98,17 +133,124 @@ def atoma_result_to_dict(atoma_result):
     return result
 
 
+def parse_rss_stream(stream, stop_item_func=None):
+    """Parse the RSS feed in stream incrementally instead of building the complete
+    element tree. Each item is converted when its end tag is parsed, and the parsing
+    stops at the first item for which stop_item_func(item) returns True.
+    The XML is parsed with defusedxml, like atoma does.
+
+    Returns a dictionary in the format returned by atoma_result_to_dict, with
+    "stopped_early" set to True if the parsing was stopped by stop_item_func.
+    """
+    from atoma import rss as atoma_rss
+    from atoma.exceptions import FeedParseError, FeedXMLError
+    from atoma.utils import get_int, get_text
+    from defusedxml.ElementTree import ParseError, iterparse
+
+    root = channel = None
+    items = []
+    stopped_early = False
+    depth = 0
+    try:
+        for event, element in iterparse(stream, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    root = element
+                elif depth == 2 and element.tag == "channel":
+                    channel = element
+                continue
+            depth -= 1
+            # Only the item elements in the channel
+            if depth != 2 or channel is None or element.tag != "item":
+                continue
+            item = atoma_item_to_dict(atoma_rss._get_item(element))
+            # The item has been converted, so free the memory used by the element
+            channel.remove(element)
+            if item["title"] is None:
+                continue
+            if stop_item_func is not None and stop_item_func(item):
+                stopped_early = True
+                break
+            items.append(item)
+    except ParseError:
+        raise FeedXMLError('Not a valid XML document')
+
+    if channel is None:
+        raise FeedParseError('RSS does not have a channel')
+
+    return {
+        'items': items, 'bozo': 0, 'stopped_early': stopped_early,
+        'feed': {
+            'ttl': get_int(channel, 'ttl'),
+            'encoded': get_text(channel, 'content:encoded'),
+            'link': get_text(channel, 'link'),
+            'title': get_text(channel, 'title'),
+            'subtitle': get_text(channel, 'description'),
+            'language': get_text(channel, 'language'),
+            'version': root.get('version'),
+        }
+    }
+
+
+def get_content_hash(content):
+    """Returns the hash of the content of a RSS Feed, used to recognize unchanged RSS Feeds"""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
 def fetch_and_parse_rssfeed_atom(url_file_stream_or_string, site_cookies_dict=None,
-                                 user_agent=None, request_headers=None, timeout=10):
-    result = http.download_file(url_file_stream_or_string, site_cookies_dict=site_cookies_dict,
-                                user_agent=user_agent, request_headers=request_headers, timeout=timeout)
+                                 user_agent=None, request_headers=None, timeout=10, etag=None, modified=None,
+                                 stop_item_func=None, download_result=None, content_hash=None):
+    """If stop_item_func is given, the feed is parsed with parse_rss_stream.
+    If download_result is given, the feed has already been downloaded, and download_result is
+    the dictionary returned by the download (or the exception raised by it, which is raised here).
+    The hash of the content is returned in "content_hash". If it is equal to content_hash,
+    the hash of an earlier download, the feed is not parsed, and "unchanged" is returned.
+    The seconds spent in each stage are returned in the "timings" dictionary"""
+    if download_result is None:
+        result = http.download_file(url_file_stream_or_string, site_cookies_dict=site_cookies_dict,
+                                    etag=etag, modified=modified, user_agent=user_agent,
+                                    request_headers=request_headers, timeout=timeout)
+    elif isinstance(download_result, Exception):
+        raise download_result
+    else:
+        result = download_result
+    parsed_feeds = {'timings': dict(result.get('timings', {})), 'content_length': len(result.get('content') or b'')}
+    timings = parsed_feeds['timings']
+    # The validators to be used for conditional GET on the next fetch
+    for key in ("etag", "modified"):
+        if key in result:
+            parsed_feeds[key] = result[key]
+
+    # Server responded with 304 Not Modified, so there is nothing to parse
+    if result.get('status') == 304:
+        parsed_feeds.update({'bozo': 0, 'feed': {}, 'items': [], 'not_modified': True, 'parser': "atoma"})
+        return parsed_feeds
+
+    # Server responded with 429 Too Many Requests or 503 Service Unavailable
+    if result.get('status') in http.THROTTLED_STATUS_CODES:
+        error = RateLimitError("Server responded with HTTP status %d" % result['status'])
+        parsed_feeds.update({'bozo': 1, 'feed': {}, 'items': [], 'bozo_exception': error, 'parser': "atoma"})
+        return parsed_feeds
+
+    parsed_feeds['content_hash'] = get_content_hash(result['content'])
+    # Servers not supporting conditional GET often return the same content
+    if content_hash is not None and parsed_feeds['content_hash'] == content_hash:
+        parsed_feeds.update({'bozo': 0, 'feed': {}, 'items': [], 'unchanged': True, 'parser': "atoma"})
+        return parsed_feeds
+
     import atoma
     atoma.rss.supported_rss_versions = []
-    parsed_feeds = {}
 
     try:
-        atoma_result = atoma.parse_rss_bytes(result['content'])
-        parsed_feeds = atoma_result_to_dict(atoma_result)
+        if stop_item_func is None:
+            with timed(timings, "parse"):
+                atoma_result = atoma.parse_rss_bytes(result['content'])
+            with timed(timings, "to_dict"):
+                parsed_feeds.update(atoma_result_to_dict(atoma_result))
+        else:
+            with timed(timings, "parse"):
+                parsed_feeds.update(parse_rss_stream(BytesIO(result['content']), stop_item_func=stop_item_func))
     except atoma.FeedXMLError as err:
         readable_body = http.clean_html_body(result['content'])
         parsed_feeds["raw_result"] = readable_body
@@ -122,11 +264,18 @@ def fetch_and_parse_rssfeed_atom(url_file_stream_or_string, site_cookies_dict=No
 
 
 def fetch_and_parse_rssfeed_feedparser(url_file_stream_or_string, site_cookies_dict=None,
-                                       user_agent=None, request_headers=None, timeout=10):
+                                       user_agent=None, request_headers=None, timeout=10, etag=None, modified=None,
+                                       stop_item_func=None, download_result=None, content_hash=None):
+    """Feedparser always parses the complete feed, so stop_item_func and content_hash are ignored"""
     from yarss2.lib.feedparser import api as feedparser
 
+    if isinstance(download_result, Exception):
+        raise download_result
+    elif download_result is not None:
+        url_file_stream_or_string = download_result["content"]
+
     parsed_feed = feedparser.parse(url_file_stream_or_string, request_headers=request_headers,
-                                   agent=user_agent, timeout=10)
+                                   agent=user_agent, etag=etag, modified=modified, timeout=10)
     parsed_feed['parser'] = "feedparser"
     return parsed_feed
 
@@ -136,8 +285,10 @@ fetch_and_parse_rssfeed = fetch_and_parse_rssfeed_atom
 
 class RSSFeedHandler(object):
 
-    def __init__(self, log):
+    def __init__(self, log, seen_items=None):
         self.log = log
+        # Index of the items already processed by the timer updates (yarss2.seen_items.SeenItems)
+        self.seen_items = seen_items
 
     def get_link(self, item):
         link = None
@@ -162,10 +313,42 @@ class RSSFeedHandler(object):
     def get_size(self, item):
         return _get_size(item)
 
-    def get_rssfeed_parsed(self, rssfeed_data, site_cookies_dict=None, user_agent=None):
+    def get_item_links(self, item, rssfeed_data):
+        """Returns the link to use for the item, and the torrent and magnet links"""
+        torrent = None
+        link = self.get_link(item)
+        magnet = self.get_magnet_link(item)
+
+        # link or enclosures url is magnet
+        if link is not None and link.startswith("magnet:"):
+            magnet = link
+        else:
+            torrent = link
+
+        if rssfeed_data.get("prefer_magnet", None) and magnet:
+            link = magnet
+        return link, torrent, magnet
+
+    def get_rssfeed_parsed(self, rssfeed_data, site_cookies_dict=None, user_agent=None, conditional=False,
+                           stop_at_item=None, download_result=None, content_hash=None):
         """
         rssfeed_data: A dictionary containing rss feed data as stored in the YaRSS2 config.
         site_cookies_dict: A dictionary of cookie values to be used for this rssfeed.
+        conditional: If True, the ETag and Last-Modified values stored in rssfeed_data
+                     are sent with the request. If the server responds with 304 Not Modified,
+                     the returned dictionary contains "not_modified" and no items.
+        stop_at_item: A function taking the item_id and the published date of an item.
+                      If given, the feed is parsed incrementally, and the parsing stops at the
+                      first item for which the function returns True. The returned dictionary
+                      then contains "stopped_early", and "items" even if there are no items.
+        download_result: The result of downloading the RSS Feed before this call (see
+                         get_rssfeed_request), which is parsed instead of fetching the RSS Feed.
+        content_hash: The hash of the content of an earlier fetch. If the content has the same hash,
+                      the feed is not parsed, and the returned dictionary contains "unchanged" and no items.
+                      The hash of the content is returned in "content_hash".
+
+        The seconds spent downloading and parsing the feed are returned in "timings",
+        and the size of the downloaded feed in "content_length".
         """
         return_dict = {}
         rssfeeds_dict = {}
@@ -176,25 +359,58 @@ class RSSFeedHandler(object):
             cookie_header = http.get_cookie_header(site_cookies_dict)
             return_dict["cookie_header"] = cookie_header
 
-        self.log.info("Fetching RSS Feed: '%s' with Cookie: '%s' and User-agent: '%s'." %
-                      (rssfeed_data["name"], http.get_cookie_header(cookie_header), user_agent))
+        self.log.info("Fetching RSS Feed: '%s' with Cookie: '%s' and User-agent: '%s'.",
+                      rssfeed_data["name"], http.get_cookie_header(cookie_header), user_agent)
+
+        etag = modified = None
+        if conditional:
+            etag = rssfeed_data.get("etag") or None
+            modified = rssfeed_data.get("modified") or None
+
+        def stop_item_func(item):
+            link, torrent, magnet = self.get_item_links(item, rssfeed_data)
+            return stop_at_item(get_item_id(item, link=link, magnet=magnet), item.get('published_date', None))
 
         # Will abort after 10 seconds if server doesn't answer
         try:
             parsed_feed = fetch_and_parse_rssfeed(rssfeed_data["url"], user_agent=user_agent,
-                                                  request_headers=cookie_header, timeout=10)
+                                                  request_headers=cookie_header, timeout=10,
+                                                  etag=etag, modified=modified,
+                                                  stop_item_func=stop_item_func if stop_at_item else None,
+                                                  download_result=download_result, content_hash=content_hash)
+        except RateLimitError as e:
+            self.log.warning("Not fetching RSS Feed '%s': %s", rssfeed_data["name"], e)
+            return_dict["bozo_exception"] = e
+            return_dict["rate_limited"] = True
+            return return_dict
         except Exception as e:
             self.log.warning("Exception occured in feedparser: " + str(e))
-            self.log.warning("Feedparser was called with url: '%s' using cookies: '%s' and User-agent: '%s'" %
-                             (rssfeed_data["url"], http.get_cookie_header(cookie_header), user_agent))
+            self.log.warning("Feedparser was called with url: '%s' using cookies: '%s' and User-agent: '%s'",
+                             rssfeed_data["url"], http.get_cookie_header(cookie_header), user_agent)
             self.log.warning("Stacktrace:\n" + common.get_exception_string())
             raise FetchAndFeedparsingError("Exception occured in feedparser: " + str(e))
 
         return_dict["raw_result"] = parsed_feed
 
+        for key in ("etag", "modified", "content_hash", "timings", "content_length"):
+            if key in parsed_feed:
+                return_dict[key] = parsed_feed[key]
+
+        if parsed_feed.get("not_modified", False):
+            self.log.info("RSS Feed '%s' has not been modified since the last update.", rssfeed_data["name"])
+            return_dict["not_modified"] = True
+            return return_dict
+
+        if parsed_feed.get("unchanged", False):
+            self.log.info("RSS Feed '%s' has the same content as on the last update.", rssfeed_data["name"])
+            return_dict["unchanged"] = True
+            return return_dict
+
         # Error parsing
         if parsed_feed["bozo"] == 1:
             return_dict["bozo_exception"] = parsed_feed["bozo_exception"]
+            if isinstance(parsed_feed["bozo_exception"], RateLimitError):
+                return_dict["rate_limited"] = True
 
         # Store ttl value if present
         if "ttl" in parsed_feed["feed"]:
@@ -203,10 +419,6 @@ class RSSFeedHandler(object):
         no_publish_time = False
 
         for item in parsed_feed['items']:
-            # Some RSS feeds do not have a proper timestamp
-            magnet = None
-            torrent = None
-
             # Empty item if feed is empty
             if not item:
                 continue
@@ -217,35 +429,34 @@ class RSSFeedHandler(object):
                 return_dict["warning"] = "Published time not available!"
 
             # Find the link
-            link = self.get_link(item)
-            magnet = self.get_magnet_link(item)
-
-            # link or enclosures url is magnet
-            if link is not None and link.startswith("magnet:"):
-                magnet = link
-            else:
-                torrent = link
-
-            if rssfeed_data.get("prefer_magnet", None) and magnet:
-                link = magnet
-
+            link, torrent, magnet = self.get_item_links(item, rssfeed_data)
+            item_id = get_item_id(item, link=link, magnet=magnet)
             rssfeeds_dict[key] = self._new_rssfeeds_dict_item(item['title'], link=link,
                                                               torrent=torrent, magnet=magnet,
-                                                              published_date=published_date)
+                                                              published_date=published_date,
+                                                              item_id=item_id,
+                                                              infohash=get_item_infohash(item, magnet=magnet))
 
             key += 1
 
         if no_publish_time:
             self.log.warning("Published time is not available!")
-        if key > 0:
+        if parsed_feed.get("stopped_early", False):
+            self.log.info("Stopped parsing RSS Feed '%s' at the first processed item, after %d new items.",
+                          rssfeed_data["name"], key)
+            return_dict["stopped_early"] = True
+            return_dict["items"] = rssfeeds_dict
+        elif key > 0:
             return_dict["items"] = rssfeeds_dict
         return return_dict
 
     def _new_rssfeeds_dict_item(self, title, link=None, torrent=None, magnet=None,
-                                published_date=None, key=None):
+                                published_date=None, key=None, item_id=None, infohash=None):
         d = {}
         d["title"] = title
         d["link"] = link
+        d["item_id"] = item_id
+        d["infohash"] = infohash
         d["matches"] = False
         d["updated"] = ""
         d["magnet"] = magnet
@@ -294,7 +505,7 @@ class RSSFeedHandler(object):
             flags = re.IGNORECASE if options["regex_include_ignorecase"] else 0
             try:
                 regex = options["regex_include"].encode("utf-8")
-                p_include = re.compile(regex, flags)
+                p_include = compile_regex(regex, flags)
             except Exception as e:
                 self.log.warning("Regex compile error:" + str(e))
                 message = "Regex: %s" % e
@@ -304,7 +515,7 @@ class RSSFeedHandler(object):
             flags = re.IGNORECASE if options["regex_exclude_ignorecase"] else 0
             try:
                 regex = options["regex_exclude"].encode("utf-8")
-                p_exclude = re.compile(regex, flags)
+                p_exclude = compile_regex(regex, flags)
             except Exception as e:
                 self.log.warning("Regex compile error:" + str(e))
                 message = "Regex: %s" % e
@@ -335,16 +546,56 @@ class RSSFeedHandler(object):
 
         return matching_items, message
 
-    def fetch_feed_torrents(self, config, rssfeed_key, subscription_key=None):
+    def get_active_subscriptions(self, config, rssfeed_key, subscription_key=None):
+        """Returns the active subscriptions of the RSS Feed. If subscription_key
+        is given, only that subscription is returned"""
+        subscriptions = []
+        for key in config["subscriptions"].keys():
+            # subscription_key is given, only that subscription will be run
+            if subscription_key is not None and subscription_key != key:
+                continue
+            subscription_data = config["subscriptions"][key]
+            if subscription_data["rssfeed_key"] == rssfeed_key and subscription_data["active"] is True:
+                subscriptions.append(subscription_data)
+        return subscriptions
+
+    def get_rssfeed_request(self, config, rssfeed_key, subscription_key=None):
+        """Returns the keyword arguments for downloading the RSS Feed like fetch_feed_torrents
+        would, including the "url", or None if fetch_feed_torrents will not download the RSS Feed.
+        Used to download the RSS Feed before calling fetch_feed_torrents with download_result"""
+        if rssfeed_key is None:
+            if subscription_key is None:
+                return None
+            rssfeed_key = config["subscriptions"][subscription_key]["rssfeed_key"]
+        elif config["rssfeeds"][rssfeed_key]["active"] is False:
+            return None
+        if not self.get_active_subscriptions(config, rssfeed_key, subscription_key=subscription_key):
+            return None
+
+        rssfeed_data = config["rssfeeds"][rssfeed_key]
+        request = {"url": rssfeed_data["url"], "user_agent": get_user_agent(rssfeed_data=rssfeed_data)}
+        cookie_header = http.get_cookie_index(config["cookies"]).get_cookie_header(rssfeed_data["site"])
+        if cookie_header and rssfeed_data["use_cookies"]:
+            request["request_headers"] = dict(cookie_header)
+        # Conditional GET is used only when the rssfeed is run by the timer
+        if subscription_key is None:
+            request["etag"] = rssfeed_data.get("etag") or None
+            request["modified"] = rssfeed_data.get("modified") or None
+        return request
+
+    def fetch_feed_torrents(self, config, rssfeed_key, subscription_key=None, download_result=None):
         """Called to fetch torrents for a feed
         If rssfeed_key is not None, all subscriptions linked to that RSS Feed
         will be run.
         If rssfeed_key is None, only the subscription with key == subscription_key
         will be run
+        If download_result is given, it is parsed instead of fetching the RSS Feed (see get_rssfeed_parsed)
         """
         fetch_data = {}
         fetch_data["matching_torrents"] = []
         fetch_data["rssfeed_items"] = None
+        fetch_data["not_modified"] = False
+        fetch_data["unchanged"] = False
 
         if rssfeed_key is None:
             if subscription_key is None:
@@ -357,19 +608,25 @@ class RSSFeedHandler(object):
                 return fetch_data
 
         rssfeed_data = config["rssfeeds"][rssfeed_key]
-        fetch_data["site_cookies_dict"] = http.get_matching_cookies_dict(config["cookies"], rssfeed_data["site"])
+        fetch_data["download_result"] = download_result
+        # Use conditional GET only when the rssfeed is run by the timer. A subscription
+        # run manually by the user must be matched against the items in the feed.
+        fetch_data["conditional"] = subscription_key is None
+        fetch_data["ignore_timestamp"] = any(subscription["ignore_timestamp"] for subscription in
+                                             config["subscriptions"].values()
+                                             if subscription["rssfeed_key"] == rssfeed_key and subscription["active"])
+        cookie_index = http.get_cookie_index(config["cookies"])
+        fetch_data["site_cookies_dict"] = cookie_index.get_cookies_dict(rssfeed_data["site"])
         fetch_data["user_agent"] = get_user_agent(rssfeed_data=rssfeed_data)
 
-        self.log.info("Update handler executed on RSS Feed '%s (%s)' (Update interval %d min)" %
-                      (rssfeed_data["name"], rssfeed_data["site"], rssfeed_data["update_interval"]))
+        self.log.info("Update handler executed on RSS Feed '%s (%s)' (Update interval %d min)",
+                      rssfeed_data["name"], rssfeed_data["site"], rssfeed_data["update_interval"])
 
-        for key in config["subscriptions"].keys():
-            # subscription_key is given, only that subscription will be run
-            if subscription_key is not None and subscription_key != key:
-                continue
-            subscription_data = config["subscriptions"][key]
-            if subscription_data["rssfeed_key"] == rssfeed_key and subscription_data["active"] is True:
-                self.fetch_feed(subscription_data, rssfeed_data, fetch_data)
+        subscriptions = self.get_active_subscriptions(config, rssfeed_key, subscription_key=subscription_key)
+        if subscriptions:
+            self.fetch_feed_subscriptions(subscriptions, rssfeed_data, fetch_data)
+        # The content of the feed is not needed after parsing
+        fetch_data.pop("download_result", None)
 
         if subscription_key is None:
             # Update last_update value of the rssfeed only when rssfeed is run by the timer,
@@ -393,40 +650,158 @@ class RSSFeedHandler(object):
                 if ttl > 0 and ttl < 524160:
                     fetch_data["ttl"] = ttl
                 else:
-                    self.log.warning("TTL value is invalid: %d" % ttl)
+                    self.log.warning("TTL value is invalid: %d", ttl)
             except (ValueError, TypeError):
-                self.log.warning("Failed to convert TTL value '%s' to int!" % rssfeed_parsed["ttl"])
+                self.log.warning("Failed to convert TTL value '%s' to int!", rssfeed_parsed["ttl"])
         else:
-            self.log.warning("RSS Feed '%s' should obey TTL, but feed has no TTL value." %
-                             rssfeed_data["name"])
+            self.log.warning("RSS Feed '%s' should obey TTL, but feed has no TTL value.", rssfeed_data["name"])
             self.log.info("Obey TTL option set to False")
             rssfeed_data["obey_ttl"] = False
 
+    def update_conditional_get_validators(self, rssfeed_data, rssfeed_parsed):
+        """Store the ETag and Last-Modified values of the response in rssfeed_data"""
+        # Server doesn't necessarily repeat the validators in a 304 response,
+        # and the feed has not been fetched if the host asked us to wait
+        if rssfeed_parsed.get("not_modified", False) or rssfeed_parsed.get("rate_limited", False):
+            return
+        # Do not store validators of error pages
+        if "bozo_exception" in rssfeed_parsed:
+            rssfeed_data["etag"] = u""
+            rssfeed_data["modified"] = u""
+            return
+        rssfeed_data["etag"] = rssfeed_parsed.get("etag", u"")
+        rssfeed_data["modified"] = rssfeed_parsed.get("modified", u"")
+
+    def get_unseen_items(self, rssfeed_data, items, fetch_data):
+        """Returns the items that have not been processed by an earlier update.
+        Only the timer updates use the seen items index. The IDs of all the items
+        in the feed are stored in fetch_data["rssfeed_item_ids"], to be marked
+        as seen when the torrents have been added."""
+        if self.seen_items is None or not fetch_data.get("conditional", False):
+            return items
+        fetch_data["rssfeed_item_ids"] = [item["item_id"] for item in items.values()]
+        dates = [common.isodate_to_datetime(item["updated"]) for item in items.values() if item["updated"]]
+        fetch_data["rssfeed_newest_date"] = max(dates).isoformat() if dates else None
+        unseen_items = self.seen_items.get_unseen_items(rssfeed_data["key"], items)
+        if len(unseen_items) < len(items):
+            self.log.info("Skipping %d items in RSS Feed '%s' that have already been processed.",
+                          len(items) - len(unseen_items), rssfeed_data["name"])
+        return unseen_items
+
+    def get_stop_at_item_func(self, rssfeed_data, fetch_data):
+        """Returns the function used to stop parsing the feed at the first item that has
+        been processed by an earlier update, or None if the complete feed must be parsed.
+
+        The feed is parsed until an item is found in the seen items index, or an item
+        is older than the high-water mark (the newest item in the earlier updates).
+        The timestamp is not used if a subscription has the ignore timestamp option enabled.
+        As the items after the stop item are assumed to be older, the parsing only stops
+        while the items parsed so far are ordered newest first. Feeds listing the oldest
+        items first, or items without a date, are parsed completely.
+        """
+        if self.seen_items is None or not fetch_data.get("conditional", False):
+            return None
+        rssfeed_key = rssfeed_data["key"]
+        high_water_mark = self.seen_items.get_high_water_mark(rssfeed_key)
+        # The previous update did not complete, so parse all the items
+        if high_water_mark is None:
+            return None
+        high_water_mark_dt = None
+        if high_water_mark and not fetch_data.get("ignore_timestamp", False):
+            high_water_mark_dt = common.isodate_to_datetime(high_water_mark)
+
+        # The date of the previous item, and if the items so far are ordered newest first
+        order = {"previous": None, "newest_first": True}
+
+        def stop_at_item(item_id, published_date):
+            item_dt = common.isodate_to_datetime(published_date) if published_date else None
+            previous_dt = order["previous"]
+            order["previous"] = item_dt
+            if item_dt is None or (previous_dt is not None and item_dt > previous_dt):
+                order["newest_first"] = False
+            # The order is not known before the second item
+            if previous_dt is None or not order["newest_first"]:
+                return False
+            if self.seen_items.is_seen(rssfeed_key, item_id):
+                return True
+            if high_water_mark_dt:
+                return item_dt < high_water_mark_dt
+            return False
+        return stop_at_item
+
+    def get_content_hash(self, rssfeed_data, fetch_data):
+        """Returns the hash of the content of the RSS Feed when all the items were last
+        processed, or None if the feed must be parsed also if the content is unchanged.
+        Like the seen items, the hash is only used by the timer updates"""
+        if self.seen_items is None or not fetch_data.get("conditional", False):
+            return None
+        return self.seen_items.get_content_hash(rssfeed_data["key"])
+
     def fetch_feed(self, subscription_data, rssfeed_data, fetch_data):
         """Search a feed with config 'subscription_data'"""
-        self.log.info("Fetching subscription '%s'." % subscription_data["name"])
+        self.fetch_feed_subscriptions([subscription_data], rssfeed_data, fetch_data)
 
+    def fetch_feed_subscriptions(self, subscriptions, rssfeed_data, fetch_data):
+        """Search a feed with all the subscriptions in the list 'subscriptions'.
+        The feed is fetched only once, and all the subscriptions are matched in one pass"""
+        for subscription_data in subscriptions:
+            self.log.info("Fetching subscription '%s'.", subscription_data["name"])
+
+        if not self.fetch_rssfeed_items(rssfeed_data, fetch_data):
+            return
+        matcher = SubscriptionMatcher(subscriptions, self.log)
+        with timed(fetch_data.setdefault("timings", {}), "match"):
+            matches = matcher.match(fetch_data["rssfeed_items"])
+        subscription_timings = fetch_data.setdefault("subscription_timings", {})
+        subscription_matches = fetch_data.setdefault("subscription_matches", {})
+        for subscription_data, seconds, subscription_matched in zip(subscriptions, matcher.match_times, matches):
+            subscription_timings[subscription_data["key"]] = {"match": seconds}
+            subscription_matches[subscription_data["key"]] = len(subscription_matched)
+        for subscription_data, subscription_matches in zip(subscriptions, matches):
+            self.add_matching_torrents(subscription_data, rssfeed_data, fetch_data, subscription_matches)
+
+    def fetch_rssfeed_items(self, rssfeed_data, fetch_data):
+        """Fetch the feed and store the items in fetch_data["rssfeed_items"].
+        Returns True if the items are available"""
         # Feed has not yet been fetched.
         if fetch_data["rssfeed_items"] is None:
+            # Feed has already been fetched, and was not modified
+            if fetch_data["not_modified"] or fetch_data.get("unchanged", False):
+                return False
             rssfeed_parsed = self.get_rssfeed_parsed(rssfeed_data, site_cookies_dict=fetch_data["site_cookies_dict"],
-                                                     user_agent=fetch_data["user_agent"])
+                                                     user_agent=fetch_data["user_agent"],
+                                                     conditional=fetch_data.get("conditional", False),
+                                                     stop_at_item=self.get_stop_at_item_func(rssfeed_data, fetch_data),
+                                                     download_result=fetch_data.pop("download_result", None),
+                                                     content_hash=self.get_content_hash(rssfeed_data, fetch_data))
             if rssfeed_parsed is None:
-                return
+                return False
+            if fetch_data.get("conditional", False):
+                self.update_conditional_get_validators(rssfeed_data, rssfeed_parsed)
+            fetch_data["rssfeed_content_hash"] = rssfeed_parsed.get("content_hash", None)
+            fetch_data.setdefault("timings", {}).update(rssfeed_parsed.get("timings", {}))
+            fetch_data["rssfeed_content_length"] = rssfeed_parsed.get("content_length", 0)
+            fetch_data["rssfeed_items_parsed"] = len(rssfeed_parsed.get("items", {}))
+            if rssfeed_parsed.get("not_modified", False):
+                fetch_data["not_modified"] = True
+                return False
+            if rssfeed_parsed.get("unchanged", False):
+                fetch_data["unchanged"] = True
+                return False
             if "bozo_exception" in rssfeed_parsed:
-                self.log.warning("bozo_exception when parsing rssfeed: %s" % str(rssfeed_parsed["bozo_exception"]))
+                self.log.warning("bozo_exception when parsing rssfeed: %s", rssfeed_parsed["bozo_exception"])
             if "items" in rssfeed_parsed:
-                fetch_data["rssfeed_items"] = rssfeed_parsed["items"]
+                fetch_data["rssfeed_items"] = self.get_unseen_items(rssfeed_data, rssfeed_parsed["items"], fetch_data)
                 self.handle_ttl(rssfeed_data, rssfeed_parsed, fetch_data)
             else:
                 self.log.warning("No items retrieved")
-                return
-        # Remove the custom text lines before matching (not strictly necessary though,
-        # but they are only for testing in the DialogSubscription)
-        options = subscription_data.copy()
-        del options["custom_text_lines"]
-        matches, message = self.update_rssfeeds_dict_matching(fetch_data["rssfeed_items"], options=options)
-        self.log.info("%d items in feed, %d matches the filter." %
-                      (len(fetch_data["rssfeed_items"]), len(matches.keys())))
+                return False
+        return True
+
+    def add_matching_torrents(self, subscription_data, rssfeed_data, fetch_data, matches):
+        """Add the items in 'matches' to fetch_data["matching_torrents"], unless
+        they are older than the last match of the subscription"""
+        self.log.info("%d items in feed, %d matches the filter.", len(fetch_data["rssfeed_items"]), len(matches))
         last_match_dt = common.isodate_to_datetime(subscription_data["last_match"])
 
         for key in list(matches.keys()):
@@ -435,14 +810,16 @@ class RSSFeedHandler(object):
             matched_updated = common.isodate_to_datetime(matches[key]["updated"])
             if matched_updated and last_match_dt >= matched_updated:
                 if subscription_data["ignore_timestamp"] is True:
-                    self.log.info("Old timestamp: '%s', but ignore option is enabled so add torrent anyways."
-                                  % matches[key]["title"])
+                    self.log.info("Old timestamp: '%s', but ignore option is enabled so add torrent anyways.",
+                                  matches[key]["title"])
                 else:
-                    self.log.info("Not adding because of old timestamp: '%s'" % matches[key]["title"])
+                    self.log.info("Not adding because of old timestamp: '%s'", matches[key]["title"])
                     del matches[key]
                     continue
             fetch_data["matching_torrents"].append({"title": matches[key]["title"],
                                                     "link": matches[key]["link"],
+                                                    "item_id": matches[key].get("item_id", None),
+                                                    "infohash": matches[key].get("infohash", None),
                                                     "updated_datetime": matched_updated,
                                                     "site_cookies_dict": fetch_data["site_cookies_dict"],
                                                     "user_agent": fetch_data["user_agent"],
@@ -7,95 +7,156 @@
 # See LICENSE for more details.
 #
 
+import time
 import traceback
 
 import twisted.internet.defer as defer
 from twisted.internet import threads
-from twisted.internet.task import LoopingCall
 from twisted.python.failure import Failure
 
-import deluge.component as component
-
+from yarss2.adaptive_interval import AdaptiveIntervals
 from yarss2.rssfeed_handling import RSSFeedHandler
-from yarss2.torrent_handling import TorrentHandler
-from yarss2.yarss_config import YARSSConfigChangedEvent
+from yarss2.seen_items import SeenItems
+from yarss2.torrent_handling import TorrentDownloadCache, TorrentHandler
+from yarss2.util import http
+from yarss2.util.async_http import get_http_client
+from yarss2.util.stats import RollingHistogram, get_pipeline_stats
+from yarss2.util.timer_queue import TimerQueue
+from yarss2.yarss_config import get_fresh_general_config
 
 
 class RSSFeedScheduler(object):
     """Handles scheduling the RSS Feed fetches."""
 
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, seen_items=None, timer_queue=None, adaptive_intervals=None,
+                 http_client=None):
         self.yarss_config = config
-        self.rssfeed_timers = {}
+        # One timer for each RSS Feed, keyed by the rssfeed key
+        self.timer_queue = timer_queue if timer_queue is not None else TimerQueue()
         self.run_queue = RSSFeedRunQueue()
         self.log = logger
-        self.rssfeedhandler = RSSFeedHandler(logger)
+        self.update_run_queue_limits()
+        self.seen_items = seen_items if seen_items is not None else SeenItems(logger)
+        self.adaptive_intervals = adaptive_intervals if adaptive_intervals is not None \
+            else AdaptiveIntervals(logger)
+        self.rssfeedhandler = RSSFeedHandler(logger, seen_items=self.seen_items)
         self.torrent_handler = TorrentHandler(logger)
+        # The RSS Feeds and torrent files are downloaded from the reactor, without
+        # a thread for each request. RSS Feeds that are not fetched with HTTP(S) are
+        # updated in a thread by rssfeed_update_async.
+        self.http_client = http_client if http_client is not None else get_http_client()
+        # The torrent downloads shared by the RSS Feed updates
+        self.download_cache = TorrentDownloadCache()
         # To make it possible to disable adding torrents in testing
         self.add_torrents_func = self.torrent_handler.add_torrents
+        # Number of RSS Feed updates, and of the updates where the feed was not
+        # modified (HTTP 304) or had the same content as on the last update
+        self.update_counts = {"updates": 0, "not_modified": 0, "unchanged": 0}
+
+    def update_run_queue_limits(self):
+        """Set the number of concurrent RSS Feed updates from the general config"""
+        default_general = get_fresh_general_config()
+        general = self.yarss_config.get_config().get("general", {})
+        concurrent_max = general.get("max_concurrent_feed_updates",
+                                     default_general["max_concurrent_feed_updates"])
+        concurrent_max_per_host = general.get("max_concurrent_feed_updates_per_host",
+                                              default_general["max_concurrent_feed_updates_per_host"])
+        self.run_queue.set_concurrent_max(concurrent_max, concurrent_max_per_host=concurrent_max_per_host)
+
+    def get_torrent_download_cache(self):
+        """Returns the TorrentDownloadCache for an update of an RSS Feed. This is the cache
+        shared by the updates, unless torrent_download_cache_ttl is 0 in the general config"""
+        general = self.yarss_config.get_config().get("general", {})
+        ttl = general.get("torrent_download_cache_ttl", get_fresh_general_config()["torrent_download_cache_ttl"])
+        if not ttl:
+            return TorrentDownloadCache()
+        self.download_cache.ttl = ttl
+        return self.download_cache
+
+    def get_max_concurrent_torrent_downloads(self):
+        """Returns the number of torrent files to download at the same time from the general config"""
+        general = self.yarss_config.get_config().get("general", {})
+        return general.get("max_concurrent_torrent_downloads",
+                           get_fresh_general_config()["max_concurrent_torrent_downloads"])
+
+    def get_rssfeed_host(self, rssfeed_key=None, subscription_key=None):
+        """Returns the hostname of the RSS Feed, used to limit the concurrent updates per host"""
+        config = self.yarss_config.get_config()
+        try:
+            if rssfeed_key is None:
+                rssfeed_key = config["subscriptions"][subscription_key]["rssfeed_key"]
+            return http.get_hostname(config["rssfeeds"][rssfeed_key]["url"])
+        except KeyError:
+            return None
 
     def enable_timers(self):
-        """Creates the LoopingCall timers, one for each RSS Feed"""
+        """Schedules the timers, one for each RSS Feed. The RSS Feeds
+        with update on startup are run one after the other"""
         config = self.yarss_config.get_config()
         for key in config["rssfeeds"]:
             rssfeed = config["rssfeeds"][key]
-            self.set_timer(rssfeed["key"], rssfeed['update_interval'], rssfeed["update_on_startup"])
-            self.log.info("Scheduled RSS Feed '%s' with interval %s" %
-                          (rssfeed["name"], rssfeed["update_interval"]))
+            interval = self.get_update_interval(rssfeed)
+            self.set_timer(rssfeed["key"], interval, rssfeed["update_on_startup"])
+            self.log.info("Scheduled RSS Feed '%s' with interval %s" % (rssfeed["name"], interval))
 
     def disable_timers(self):
-        for key in list(self.rssfeed_timers.keys()):
-            self.rssfeed_timers[key]["timer"].stop()
-            del self.rssfeed_timers[key]
+        self.timer_queue.clear()
 
     def set_timer(self, key, interval, update_on_startup=False):
-        """Schedule a timer for the specified interval."""
+        """Schedule a timer for the specified interval (in minutes).
+        An existing timer for the RSS Feed is rescheduled."""
         try:
             interval = int(interval)
         except ValueError:
             self.log.error("Failed to convert interval '%s' to int!" % str(interval))
             return False
-        # Already exists, so reschedule
-        if key in self.rssfeed_timers:
-            try:
-                self.rssfeed_timers[key]["timer"].stop()
-            except AssertionError as e:
-                self.log.warning("AssertionError:", e)
-                return False
-            self.rssfeed_timers[key]["update_interval"] = interval
-        else:
-            # New timer
-            # Second argument, the rssfeedkey is passed as argument to the callback method
-            timer = LoopingCall(self.queue_rssfeed_update, key)
-            self.rssfeed_timers[key] = {"timer": timer, "update_interval": interval}
-        self.rssfeed_timers[key]["timer"].start(interval * 60, now=update_on_startup)  # Multiply to get seconds
+        # Multiply to get seconds
+        self.timer_queue.add(key, interval * 60, self.queue_rssfeed_update, now=update_on_startup)
         return True
 
+    def reschedule_timer(self, key, interval):
+        """Change the interval (in minutes) of the timer, counted from the last update"""
+        self.timer_queue.set_interval(key, int(interval) * 60)
+
+    def get_update_interval(self, rssfeed):
+        """Returns the update interval of the RSS Feed in minutes,
+        which is learned if adaptive update interval is enabled"""
+        return self.adaptive_intervals.get_interval(rssfeed)
+
     def delete_timer(self, key):
         """Delete timer with the specified key."""
-        if key not in self.rssfeed_timers:
+        if not self.timer_queue.remove(key):
             self.log.warning("Cannot delete timer. No timer with key %s" % key)
             return False
-        self.rssfeed_timers[key]["timer"].stop()
-        del self.rssfeed_timers[key]
         return True
 
-    def rssfeed_update_handler_safe(self, rssfeed_key=None, subscription_key=None):
+    def get_timer_interval(self, key):
+        """Returns the update interval of the RSS Feed timer in minutes, or None"""
+        interval = self.timer_queue.get_interval(key)
+        return interval // 60 if interval is not None else None
+
+    def get_next_update_time(self, key):
+        """Returns the time (seconds since the epoch) of the next timer update of the RSS Feed, or None"""
+        return self.timer_queue.get_next_due(key)
+
+    def rssfeed_update_handler_safe(self, rssfeed_key=None, subscription_key=None, **kwargs):
         """
-        This function is called by the LoopingCall, and should avoid passing any
-        raised exceptions back to the loopingcall. This is to make sure the loopingcall
-        doesn't stop.
+        This function is called by the RSS Feed timers and the run queue, and should avoid
+        passing any raised exceptions back to the caller.
         """
         try:
-            return self.rssfeed_update_handler(rssfeed_key=rssfeed_key, subscription_key=subscription_key)
+            return self.rssfeed_update_handler(rssfeed_key=rssfeed_key, subscription_key=subscription_key, **kwargs)
         except:  # noqa: E722 do not use bare 'except'
             traceback.print_exc()
             exc_str = traceback.format_exc()
             self.log.warning("An exception was thrown by the RSS update handler. Please report this bug!\n%s" % exc_str)
 
-    def rssfeed_update_handler(self, rssfeed_key=None, subscription_key=None):
+    def rssfeed_update_handler(self, rssfeed_key=None, subscription_key=None, download_result=None,
+                               download_torrents=True):
         """Goes through all the feeds and runs the active ones.
         Multiple subscriptions on one RSS Feed will download the RSS feed page only once
+        download_result: The RSS Feed downloaded by rssfeed_update_async
+        download_torrents: If False, the matching torrent files are not downloaded
         """
         if subscription_key:
             self.log.info("Manually running Subscription '%s'" %
@@ -105,36 +166,147 @@ class RSSFeedScheduler(object):
                 return
 
         fetch_result = self.rssfeedhandler.fetch_feed_torrents(self.yarss_config.get_config(), rssfeed_key,
-                                                               subscription_key=subscription_key)
-        matching_torrents = fetch_result["matching_torrents"]
-        # Fetching the torrent files. Do this slow task in non-main thread.
-        for torrent in matching_torrents:
-            torrent["torrent_download"] = self.torrent_handler.get_torrent(torrent)
-
-        # Update TTL value?
-        if "ttl" in fetch_result:
-            # Subscription is run directly. Get RSS Feed key
-            if not rssfeed_key:
-                rssfeed_key = self.yarss_config.get_config()["subscriptions"][subscription_key]["rssfeed_key"]
-            self.log.info("Rescheduling RSS Feed '%s' with interval '%s' according to TTL." %
-                          (self.yarss_config.get_config()["rssfeeds"][rssfeed_key]["name"], fetch_result["ttl"]))
-            rssfeed = self.yarss_config.get_config()["rssfeeds"][rssfeed_key]
-            # Set new interval in config
-            rssfeed["update_interval"] = fetch_result["ttl"]
-            # Reschedule timer
-            self.set_timer(rssfeed_key, fetch_result["ttl"], rssfeed["update_on_startup"])
-        # Send YARSSConfigChangedEvent to GUI with updated config.
-        try:
-            # Tests throws KeyError for EventManager when running this method, so wrap this in try/except
-            component.get("EventManager").emit(YARSSConfigChangedEvent(self.yarss_config.get_config()))
-        except KeyError:
-            pass
+                                                               subscription_key=subscription_key,
+                                                               download_result=download_result)
+        if download_torrents:
+            matching_torrents = fetch_result["matching_torrents"]
+            # Fetching the torrent files. Do this slow task in non-main thread.
+            downloads = self.torrent_handler.get_torrents(matching_torrents,
+                                                          max_workers=self.get_max_concurrent_torrent_downloads(),
+                                                          cache=self.get_torrent_download_cache())
+            self.set_torrent_downloads(matching_torrents, downloads)
 
         def save_subscription_func(subscription_data):
             self.yarss_config.generic_save_config("subscriptions", data_dict=subscription_data)
 
+        def update_rssfeed_state_func(timings=None):
+            """timings: The seconds spent in the stages run on the main thread, like adding the torrents"""
+            changed_key = rssfeed_key
+            if changed_key is None:
+                changed_key = self.yarss_config.get_config()["subscriptions"][subscription_key]["rssfeed_key"]
+            # Update TTL value? The timer queue is only changed on the main thread
+            if "ttl" in fetch_result:
+                rssfeed = self.yarss_config.get_config()["rssfeeds"][changed_key]
+                self.log.info("Rescheduling RSS Feed '%s' with interval '%s' according to TTL." %
+                              (rssfeed["name"], fetch_result["ttl"]))
+                # Set new interval in config
+                rssfeed["update_interval"] = fetch_result["ttl"]
+                # Reschedule timer
+                self.reschedule_timer(changed_key, fetch_result["ttl"])
+            # The last update time and etag only are not worth an event to the GUI on every run,
+            # but a changed update interval or a manual run of a subscription is
+            self.yarss_config.mark_changed("rssfeeds", changed_key,
+                                           notify="ttl" in fetch_result or subscription_key is not None)
+            self.update_counts["updates"] += 1
+            for result in ("not_modified", "unchanged"):
+                if fetch_result.get(result, False):
+                    self.update_counts[result] += 1
+            fetch_result.setdefault("timings", {}).update(timings or {})
+            self.update_pipeline_stats(changed_key, fetch_result)
+            self.update_seen_items(rssfeed_key, fetch_result)
+            # Only the timer updates are used to learn the update interval
+            if subscription_key is None:
+                self.update_adaptive_interval(rssfeed_key, fetch_result)
+
         return (self.add_torrents_func, save_subscription_func,
-                fetch_result["matching_torrents"], self.yarss_config.get_config())
+                fetch_result["matching_torrents"], self.yarss_config.get_config(), update_rssfeed_state_func)
+
+    def set_torrent_downloads(self, matching_torrents, downloads):
+        for torrent, download in zip(matching_torrents, downloads):
+            torrent["torrent_download"] = download
+
+    def rssfeed_update_async(self, rssfeed_key=None, subscription_key=None):
+        """Runs the update like rssfeed_update_handler_safe, but the RSS Feed and the torrent
+        files are downloaded from the reactor by the http_client. Only parsing and matching the
+        RSS Feed is run in a thread. RSS Feeds that are not fetched with HTTP(S), e.g. local
+        files, are updated in a thread by rssfeed_update_handler_safe.
+        Must be called on the main thread. Returns a Deferred"""
+        request = self.rssfeedhandler.get_rssfeed_request(self.yarss_config.get_config(), rssfeed_key,
+                                                          subscription_key=subscription_key)
+        if request is None or not http.is_http_url(request["url"]):
+            return threads.deferToThread(self.rssfeed_update_handler_safe, rssfeed_key=rssfeed_key,
+                                         subscription_key=subscription_key)
+
+        def parse(download_result):
+            return threads.deferToThread(self.rssfeed_update_handler_safe, rssfeed_key=rssfeed_key,
+                                         subscription_key=subscription_key, download_result=download_result,
+                                         download_torrents=False)
+
+        def download_torrents(args):
+            if args is None:
+                return None
+            matching_torrents = args[2]
+            d = self.torrent_handler.get_torrents_async(
+                matching_torrents, self.http_client, max_concurrent=self.get_max_concurrent_torrent_downloads(),
+                cache=self.get_torrent_download_cache())
+            d.addCallback(lambda downloads: self.set_torrent_downloads(matching_torrents, downloads))
+            d.addCallback(lambda result: args)
+            return d
+
+        d = self.http_client.download_file(request.pop("url"), **request)
+        # The exception is handled when parsing, like when the RSS Feed is fetched in the thread
+        d.addErrback(lambda failure: failure.value)
+        d.addCallback(parse)
+        d.addCallback(download_torrents)
+        return d
+
+    def update_seen_items(self, rssfeed_key, fetch_result):
+        """Mark the items in the RSS Feed as seen, except the matching
+        torrents that failed, so they are tried again on the next update.
+        The content hash of the RSS Feed is stored when all the torrents were added.
+        Must be called on the main thread after the torrents have been added"""
+        item_ids = fetch_result.get("rssfeed_item_ids", None)
+        if not item_ids:
+            return
+        failed_ids = set(torrent["item_id"] for torrent in fetch_result["matching_torrents"]
+                         if not torrent["torrent_download"].success)
+        self.seen_items.add(rssfeed_key, [item_id for item_id in item_ids if item_id not in failed_ids])
+        if failed_ids:
+            # Parse the complete feed on the next update to find the failed torrents
+            self.seen_items.clear_high_water_mark(rssfeed_key)
+        else:
+            self.seen_items.update_high_water_mark(rssfeed_key, fetch_result.get("rssfeed_newest_date", None))
+            self.seen_items.set_content_hash(rssfeed_key, fetch_result.get("rssfeed_content_hash", None))
+        self.seen_items.save_later()
+
+    def update_pipeline_stats(self, rssfeed_key, fetch_result):
+        """Add the timings and counters of the stages of the update to the pipeline stats"""
+        stats = get_pipeline_stats()
+        stats.add_rssfeed_timings(rssfeed_key, fetch_result.get("timings", {}))
+        for subscription_key, timings in fetch_result.get("subscription_timings", {}).items():
+            stats.add_subscription_timings(subscription_key, timings)
+        for subscription_key, matches in fetch_result.get("subscription_matches", {}).items():
+            stats.add_subscription_counts(subscription_key, {"runs": 1, "matches": matches})
+        counts = {"updates": 1,
+                  "not_modified": int(fetch_result.get("not_modified", False)),
+                  "unchanged": int(fetch_result.get("unchanged", False)),
+                  "bytes": fetch_result.get("rssfeed_content_length", 0),
+                  "items_parsed": fetch_result.get("rssfeed_items_parsed", 0),
+                  "torrent_downloads": 0, "torrent_download_failures": 0}
+        for torrent in fetch_result.get("matching_torrents", []):
+            download = torrent.get("torrent_download", None)
+            if download is None:
+                continue
+            counts["torrent_downloads"] += 1
+            if not download.success:
+                counts["torrent_download_failures"] += 1
+            if download.get("download_time", None) is not None:
+                stats.add_rssfeed_timings(rssfeed_key, {"torrent_download": download["download_time"]})
+        stats.add_rssfeed_counts(rssfeed_key, counts)
+
+    def update_adaptive_interval(self, rssfeed_key, fetch_result):
+        """Learn the update interval from the items found by a timer update of the RSS Feed,
+        and reschedule the timer if the interval changed. The TTL value of the RSS Feed
+        takes precedence when obey_ttl is enabled.
+        Must be called on the main thread"""
+        rssfeed = self.yarss_config.get_config()["rssfeeds"].get(rssfeed_key, None)
+        if rssfeed is None or not rssfeed["adaptive_update_interval"] or rssfeed["obey_ttl"]:
+            return
+        items = fetch_result.get("rssfeed_items", None) or {}
+        interval = self.adaptive_intervals.update(rssfeed, [item["updated"] for item in items.values()])
+        if rssfeed_key in self.timer_queue and interval != self.get_timer_interval(rssfeed_key):
+            self.reschedule_timer(rssfeed_key, interval)
+        self.adaptive_intervals.save_later()
 
     def add_torrents_callback(self, args):
         """
@@ -144,45 +316,112 @@ class RSSFeedScheduler(object):
         """
         if args is None:
             return
-        add_torrents_func, save_subscription_func, matching_torrents, config = args
+        add_torrents_func, save_subscription_func, matching_torrents, config, update_rssfeed_state_func = args
+        start = time.perf_counter()
         add_torrents_func(save_subscription_func, matching_torrents, config)
+        update_rssfeed_state_func(timings={"add_torrents": time.perf_counter() - start})
+        # Send the changes of this run to the GUI. Nothing is sent if nothing worth showing changed
+        self.yarss_config.emit_config_changes()
 
-    def queue_rssfeed_update(self, *args, **kwargs):
-        d = self.run_queue.push(self.rssfeed_update_handler_safe, *args, **kwargs)
+    def queue_rssfeed_update(self, rssfeed_key=None, subscription_key=None):
+        host = self.get_rssfeed_host(rssfeed_key=rssfeed_key, subscription_key=subscription_key)
+        d = self.run_queue.push_host_deferred(host, self.rssfeed_update_async,
+                                              rssfeed_key=rssfeed_key, subscription_key=subscription_key)
         d.addCallback(self.add_torrents_callback)
         return d
 
 
 class RSSFeedRunQueue(object):
-    """Runs functions in separate threads. If a job is already running,
-    jobs pushed are queued until the running job has finished"""
-    def __init__(self, concurrent_max=1):
+    """Runs functions in separate threads, or on the main thread for functions
+    returning a Deferred (push_host_deferred). At most concurrent_max jobs are running
+    at the same time, and at most concurrent_max_per_host jobs for the same host.
+    Jobs pushed when no slot is available are queued until a running job has finished.
+    Queued jobs are started in the order they were pushed, skipping jobs for hosts
+    that are already running the maximum number of jobs."""
+    def __init__(self, concurrent_max=1, concurrent_max_per_host=None):
         self.concurrentMax = concurrent_max
+        self.concurrent_max_per_host = concurrent_max_per_host
         self._running = 0
+        self._running_per_host = {}
         self._queued = []
+        # Seconds the jobs waited in the queue before they were started
+        self.wait_times = RollingHistogram()
+
+    def set_concurrent_max(self, concurrent_max, concurrent_max_per_host=None):
+        """Change the limits. Queued jobs are started if the new limits allow it"""
+        self.concurrentMax = max(1, int(concurrent_max))
+        self.concurrent_max_per_host = None
+        if concurrent_max_per_host:
+            self.concurrent_max_per_host = max(1, int(concurrent_max_per_host))
+        self._run_queued()
+
+    def get_state(self):
+        """Returns the number of running and queued jobs, and the summary
+        of the wait times (see RollingHistogram.get_summary)"""
+        return {"running": self._running, "queued": len(self._queued), "wait": self.wait_times.get_summary()}
 
     def push(self, f, *args, **kwargs):
         """Push job to queue"""
-        if self._running < self.concurrentMax:
-            return self._run(f, args, kwargs)
+        return self.push_host(None, f, *args, **kwargs)
+
+    def push_host(self, host, f, *args, **kwargs):
+        """Push job for host to queue. Jobs with host None are
+        only limited by the total number of concurrent jobs"""
+        return self._push(host, f, args, kwargs, True)
+
+    def push_host_deferred(self, host, f, *args, **kwargs):
+        """Like push_host, but f is called on the main thread and returns a Deferred.
+        The job is running until the Deferred has fired"""
+        return self._push(host, f, args, kwargs, False)
+
+    def _push(self, host, f, args, kwargs, in_thread):
+        if self._has_free_slot(host):
+            self.wait_times.add(0)
+            return self._run(host, f, args, kwargs, in_thread)
         d = defer.Deferred()
-        self._queued.append((f, args, kwargs, d))
+        self._queued.append((host, f, args, kwargs, in_thread, d, time.monotonic()))
         return d
 
-    def _run(self, f, args, kwargs):
-        """Run function in separate thread"""
+    def _has_free_slot(self, host):
+        if self._running >= self.concurrentMax:
+            return False
+        if host is None or self.concurrent_max_per_host is None:
+            return True
+        return self._running_per_host.get(host, 0) < self.concurrent_max_per_host
+
+    def _run(self, host, f, args, kwargs, in_thread):
+        """Run function in separate thread, or on the main thread"""
         self._running += 1
-        deferred = threads.deferToThread(f, *args, **kwargs)
-        deferred.addBoth(self._try_queued)
+        if host is not None:
+            self._running_per_host[host] = self._running_per_host.get(host, 0) + 1
+        if in_thread:
+            deferred = threads.deferToThread(f, *args, **kwargs)
+        else:
+            deferred = defer.maybeDeferred(f, *args, **kwargs)
+        deferred.addBoth(self._try_queued, host)
         return deferred
 
-    def _try_queued(self, r):
-        """Execute next job in queue if it exists"""
-        self._running -= 1
-        if self._running < self.concurrentMax and self._queued:
-            f, args, kwargs, d = self._queued.pop(0)
-            new_d = self._run(f, args, kwargs)
+    def _run_queued(self):
+        """Start queued jobs while there are free slots"""
+        index = 0
+        while index < len(self._queued) and self._running < self.concurrentMax:
+            host, f, args, kwargs, in_thread, d, queued_time = self._queued[index]
+            if not self._has_free_slot(host):
+                index += 1
+                continue
+            del self._queued[index]
+            self.wait_times.add(time.monotonic() - queued_time)
+            new_d = self._run(host, f, args, kwargs, in_thread)
             new_d.chainDeferred(d)
+
+    def _try_queued(self, r, host):
+        """Execute next jobs in queue if they exist"""
+        self._running -= 1
+        if host is not None:
+            self._running_per_host[host] -= 1
+            if self._running_per_host[host] == 0:
+                del self._running_per_host[host]
+        self._run_queued()
         if isinstance(r, Failure):
             r.trap()
         return r
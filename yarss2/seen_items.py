@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import time
+
+import deluge.configmanager
+
+from yarss2.util import common
+from yarss2.util.config_saver import DEFAULT_SAVE_DELAY, ConfigSaver
+
+SEEN_ITEMS_FILENAME = "yarss2_seen_items.conf"
+# Number of item IDs stored for each RSS Feed
+DEFAULT_SEEN_ITEMS_MAX_ITEMS = 1000
+# Item IDs not seen in the RSS Feed for 30 days are removed
+DEFAULT_SEEN_ITEMS_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def default_prefs():
+    return {"rssfeeds": {}, "high_water_marks": {}, "content_hashes": {}}
+
+
+class SeenItems(object):
+    """Persistent index of the RSS Feed items that have already been processed.
+
+    The items are identified by their item_id (GUID, infohash or link).
+    For each RSS Feed the item IDs are stored in the order they were last seen,
+    and the least recently seen items are evicted when there are more than max_items,
+    or when they have not been seen in the RSS Feed for max_age seconds.
+
+    The index must only be modified from the main thread. The changes are written
+    to the file save_delay seconds after the first change (see save_later).
+    """
+
+    def __init__(self, logger, config=None, max_items=DEFAULT_SEEN_ITEMS_MAX_ITEMS,
+                 max_age=DEFAULT_SEEN_ITEMS_MAX_AGE, clock=time.time, save_delay=DEFAULT_SAVE_DELAY):
+        self.log = logger
+        self.config = config
+        self.max_items = max_items
+        self.max_age = max_age
+        self.clock = clock
+
+        # Prividing a config here us used for testing
+        if config is None:
+            self.config = deluge.configmanager.ConfigManager(SEEN_ITEMS_FILENAME, default_prefs())
+        self.saver = ConfigSaver(self.config, delay=save_delay)
+
+    def save(self):
+        """Write the index to the file now"""
+        self.saver.save()
+
+    def save_later(self):
+        """Write the index to the file after the delay, once for all the changes in the meantime"""
+        self.saver.save_later()
+
+    def get_item_ids(self, rssfeed_key):
+        """Returns the seen item IDs of the RSS Feed, least recently seen first"""
+        return list(self.config["rssfeeds"].get(rssfeed_key, {}).keys())
+
+    def is_seen(self, rssfeed_key, item_id):
+        return item_id in self.config["rssfeeds"].get(rssfeed_key, {})
+
+    def get_unseen_items(self, rssfeed_key, items):
+        """items: A dictionary of items as returned by RSSFeedHandler.get_rssfeed_parsed
+        Returns a dictionary with the items that have not been seen"""
+        return dict((key, item) for key, item in items.items()
+                    if not self.is_seen(rssfeed_key, item.get("item_id", None)))
+
+    def add(self, rssfeed_key, item_ids):
+        """Mark the items as seen now, and evict the old items of the RSS Feed"""
+        now = self.clock()
+        seen = self.config["rssfeeds"].setdefault(rssfeed_key, {})
+        count = 0
+        for item_id in item_ids:
+            if item_id is None:
+                continue
+            # Move to the end to keep the items ordered by when they were last seen
+            seen.pop(item_id, None)
+            seen[item_id] = now
+            count += 1
+        # Never evict the items in the current feed
+        self._evict(seen, now, max(self.max_items, count))
+
+    def get_high_water_mark(self, rssfeed_key):
+        """Returns the timestamp (in isoformat) of the newest item in the RSS Feed when
+        all the items were last processed, u"" if the items have no timestamp,
+        or None if the next update must process all the items in the feed"""
+        return self.config["high_water_marks"].get(rssfeed_key, None)
+
+    def update_high_water_mark(self, rssfeed_key, newest_date):
+        """Set the high-water mark to newest_date if it is newer than the current"""
+        high_water_mark = self.get_high_water_mark(rssfeed_key) or u""
+        if newest_date:
+            if not high_water_mark or \
+               common.isodate_to_datetime(newest_date) > common.isodate_to_datetime(high_water_mark):
+                high_water_mark = newest_date
+        self.config["high_water_marks"][rssfeed_key] = high_water_mark
+
+    def clear_high_water_mark(self, rssfeed_key):
+        """Make the next update process all the items in the feed"""
+        self.config["high_water_marks"].pop(rssfeed_key, None)
+        self.config["content_hashes"].pop(rssfeed_key, None)
+
+    def get_content_hash(self, rssfeed_key):
+        """Returns the hash of the content of the RSS Feed when all the items were last
+        processed, or None. If the content is unchanged, there are no new items to process"""
+        return self.config["content_hashes"].get(rssfeed_key, None)
+
+    def set_content_hash(self, rssfeed_key, content_hash):
+        if content_hash:
+            self.config["content_hashes"][rssfeed_key] = content_hash
+        else:
+            self.config["content_hashes"].pop(rssfeed_key, None)
+
+    def reset(self, rssfeed_key):
+        """Forget the seen items of the RSS Feed, which makes the next update
+        match all the items in the feed"""
+        self.clear_high_water_mark(rssfeed_key)
+        if self.config["rssfeeds"].pop(rssfeed_key, None) is not None:
+            self.log.info("Cleared the seen items of RSS Feed with key '%s'" % rssfeed_key)
+
+    def _evict(self, seen, now, max_items):
+        for item_id in list(seen.keys()):
+            if len(seen) <= max_items and now - seen[item_id] <= self.max_age:
+                break
+            del seen[item_id]
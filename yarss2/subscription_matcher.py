@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import re
+import time
+from bisect import bisect_right
+from functools import lru_cache
+
+from yarss2.util.regex_cache import DEFAULT_REGEX_CACHE_MAX_SIZE, compile_regex
+
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL
+except ImportError:
+    import sre_parse
+    from sre_constants import LITERAL
+
+
+@lru_cache(maxsize=DEFAULT_REGEX_CACHE_MAX_SIZE)
+def get_required_literal(pattern, flags=0):
+    """Returns the longest literal substring that must be present in the text for the
+    regex pattern (bytes) to match, or None if there is none.
+
+    Only the top-level sequence of the pattern is used, so patterns with alternation
+    at the top level have no required literal. If the pattern is case insensitive,
+    the literal is lowercased.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (re.error, TypeError):
+        return None
+    state = getattr(parsed, "state", None) or getattr(parsed, "pattern", None)
+    if state is not None:
+        flags |= state.flags
+
+    longest = current = []
+    for op, value in parsed:
+        if op == LITERAL:
+            current = current + [value]
+            if len(current) > len(longest):
+                longest = current
+        else:
+            current = []
+    if not longest:
+        return None
+    literal = bytes(bytearray(longest))
+    # The titles are separated by newline when searching for the literal
+    if b"\n" in literal:
+        return None
+    if flags & re.IGNORECASE:
+        literal = literal.lower()
+    return literal
+
+
+class CompiledSubscription(object):
+    """The compiled include and exclude patterns of a subscription"""
+
+    def __init__(self, subscription_data, log):
+        self.subscription_data = subscription_data
+        self.message = None
+        self.include = self.include_literal = self.include_ignorecase = None
+        self.exclude = self.exclude_literal = self.exclude_ignorecase = None
+
+        if subscription_data["regex_include"]:
+            self.include, self.include_literal, self.include_ignorecase = self._compile(
+                subscription_data["regex_include"], subscription_data["regex_include_ignorecase"], log)
+        if subscription_data["regex_exclude"]:
+            self.exclude, self.exclude_literal, self.exclude_ignorecase = self._compile(
+                subscription_data["regex_exclude"], subscription_data["regex_exclude_ignorecase"], log)
+
+    def _compile(self, regex, ignorecase, log):
+        """Returns the compiled pattern, the required literal, and if the pattern is case insensitive"""
+        flags = re.IGNORECASE if ignorecase else 0
+        regex = regex.encode("utf-8")
+        try:
+            compiled = compile_regex(regex, flags)
+        except Exception as e:
+            log.warning("Regex compile error:" + str(e))
+            self.message = "Regex: %s" % e
+            return None, None, None
+        # The flags of the compiled pattern include the inline flags, e.g. (?i)
+        return compiled, get_required_literal(regex, compiled.flags), bool(compiled.flags & re.IGNORECASE)
+
+
+class SubscriptionMatcher(object):
+    """
+    Matches the items of an RSS Feed against all the subscriptions of the feed in one pass.
+
+    The titles are encoded once, and joined into one string that is searched for the
+    literal text required by each include pattern (e.g. "FreeBSD" in "FreeBSD.*amd64"),
+    so the full regex is only run on the titles containing the literal.
+    """
+
+    def __init__(self, subscriptions, log):
+        """subscriptions: A list of subscription dictionaries"""
+        self.log = log
+        self.subscriptions = [CompiledSubscription(subscription_data, log) for subscription_data in subscriptions]
+        # The seconds spent matching each subscription on the last call to match
+        self.match_times = []
+
+    def match(self, items):
+        """items: A dictionary of items as returned by RSSFeedHandler.get_rssfeed_parsed
+
+        Returns a list with a dictionary of the matching items for each subscription,
+        in the same order as the subscriptions. The items are in the same order as in items.
+        The seconds spent matching each subscription are stored in self.match_times.
+        """
+        # Items without link are the custom text lines of the subscription dialog
+        keys = [key for key in items.keys() if items[key]["link"] is not None]
+        titles = [items[key]["title"].encode("utf-8") for key in keys]
+        titles_text = TitlesText(titles)
+
+        matches = []
+        self.match_times = []
+        for subscription in self.subscriptions:
+            start = time.perf_counter()
+            subscription_matches = {}
+            if subscription.include is not None:
+                for index in titles_text.find(subscription.include_literal, subscription.include_ignorecase):
+                    title = titles[index]
+                    if not subscription.include.search(title):
+                        continue
+                    if subscription.exclude is not None and \
+                       titles_text.contains(index, subscription.exclude_literal, subscription.exclude_ignorecase) and \
+                       subscription.exclude.search(title):
+                        continue
+                    subscription_matches[keys[index]] = items[keys[index]]
+            matches.append(subscription_matches)
+            self.match_times.append(time.perf_counter() - start)
+        return matches
+
+
+class TitlesText(object):
+    """The titles joined by newline, to find the titles containing a literal string"""
+
+    def __init__(self, titles):
+        self.titles = titles
+        self.text = b"\n".join(titles)
+        self._text_lower = None
+        self.offsets = []
+        offset = 0
+        for title in titles:
+            self.offsets.append(offset)
+            offset += len(title) + 1
+
+    @property
+    def text_lower(self):
+        if self._text_lower is None:
+            self._text_lower = self.text.lower()
+        return self._text_lower
+
+    def find(self, literal, ignorecase=False):
+        """Returns the indexes of the titles containing literal, or all the indexes if literal is None"""
+        if literal is None:
+            return range(len(self.titles))
+        text = self.text_lower if ignorecase else self.text
+        indexes = []
+        pos = text.find(literal)
+        while pos != -1:
+            index = bisect_right(self.offsets, pos) - 1
+            indexes.append(index)
+            if index + 1 >= len(self.offsets):
+                break
+            # Continue searching in the next title
+            pos = text.find(literal, self.offsets[index + 1])
+        return indexes
+
+    def contains(self, index, literal, ignorecase=False):
+        """Returns False if title at index does not contain literal"""
+        if literal is None:
+            return True
+        title = self.titles[index]
+        if ignorecase:
+            title = title.lower()
+        return literal in title
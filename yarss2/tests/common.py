@@ -51,8 +51,9 @@ def get_default_rssfeeds(count):
     return d
 
 
-def get_test_config(config_filename="yarss_test.conf", config_dir=None, verify_config=True):
-    """Creates a YaRSS2 config with a reference to a proper deluge config"""
+def get_test_config(config_filename="yarss_test.conf", config_dir=None, verify_config=True, save_delay=0):
+    """Creates a YaRSS2 config with a reference to a proper deluge config.
+    By default, the changes are saved immediately"""
     if config_dir is None:
         config_dir = set_tmp_config_dir()
     deluge_config = deluge.config.Config(config_filename,
@@ -60,7 +61,7 @@ def get_test_config(config_filename="yarss_test.conf", config_dir=None, verify_c
     core_config = deluge.config.Config("core.conf", defaults=deluge.core.preferencesmanager.DEFAULT_PREFS,
                                        config_dir=config_dir)
     config = yarss2.yarss_config.YARSSConfig(log, config=deluge_config, core_config=core_config,
-                                             verify_config=verify_config)
+                                             verify_config=verify_config, save_delay=save_delay)
     return config
 
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import datetime
+import os
+
+from twisted.trial import unittest
+
+import deluge.config
+
+from yarss2 import adaptive_interval, yarss_config
+from yarss2.util import logging
+
+from . import common as test_common
+from .utils.log_utils import plugin_tests_logger_name
+
+log = logging.getLogger(plugin_tests_logger_name)
+
+
+def get_test_adaptive_intervals(**kwargs):
+    # By default, the changes are saved immediately
+    kwargs.setdefault("save_delay", 0)
+    config_dir = test_common.set_tmp_config_dir()
+    config = deluge.config.Config(adaptive_interval.ADAPTIVE_INTERVALS_FILENAME, adaptive_interval.default_prefs(),
+                                  config_dir=config_dir)
+    return adaptive_interval.AdaptiveIntervals(log, config=config, **kwargs)
+
+
+def get_dates(start, count, minutes=1):
+    return [(start + datetime.timedelta(minutes=minutes * i)).isoformat() for i in range(count)]
+
+
+class AdaptiveIntervalsTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.now = 0
+        self.intervals = get_test_adaptive_intervals(clock=lambda: self.now)
+        self.rssfeed = yarss_config.get_fresh_rssfeed_config(name=u"Test", update_interval=60, key="0")
+        self.rssfeed["adaptive_update_interval"] = True
+        self.rssfeed["adaptive_update_interval_min"] = 10
+        self.rssfeed["adaptive_update_interval_max"] = 240
+        self.start = datetime.datetime(2019, 10, 14, 3, 10, 26)
+
+    def update(self, minutes, dates):
+        self.now += minutes * 60
+        return self.intervals.update(self.rssfeed, dates)
+
+    def test_get_interval(self):
+        self.assertEquals(self.intervals.get_interval(self.rssfeed), 60)
+        self.rssfeed["update_interval"] = 5
+        self.assertEquals(self.intervals.get_interval(self.rssfeed), 10)
+        # Not enabled
+        self.rssfeed["adaptive_update_interval"] = False
+        self.assertEquals(self.intervals.get_interval(self.rssfeed), 5)
+
+    def test_quiet_feed_interval_grows(self):
+        dates = get_dates(self.start, 10)
+        # First update only records the newest item
+        self.assertEquals(self.update(0, dates), 60)
+        intervals = [self.update(60, dates) for i in range(10)]
+        self.assertEquals(intervals, sorted(intervals))
+        self.assertTrue(intervals[0] > 60)
+        self.assertEquals(intervals[-1], 240)
+
+    def test_burst_shortens_interval(self):
+        self.update(0, get_dates(self.start, 1))
+        # 30 new items in one hour
+        interval = self.update(60, get_dates(self.start + datetime.timedelta(hours=1), 30))
+        self.assertTrue(interval < 10 + 1, interval)
+        self.assertEquals(self.intervals.get_interval(self.rssfeed), interval)
+        # The items are not counted again
+        self.assertTrue(self.update(10, get_dates(self.start + datetime.timedelta(hours=1), 30)) >= interval)
+
+    def test_no_dates(self):
+        self.assertEquals(self.update(0, ["", ""]), 60)
+        self.assertTrue(self.update(60, []) > 60)
+
+    def test_persisted(self):
+        self.update(0, get_dates(self.start, 1))
+        interval = self.update(60, [])
+        self.intervals.save()
+        config = deluge.config.Config(adaptive_interval.ADAPTIVE_INTERVALS_FILENAME,
+                                      config_dir=os.path.dirname(self.intervals.config.config_file))
+        intervals = adaptive_interval.AdaptiveIntervals(log, config=config, save_delay=0)
+        self.assertEquals(intervals.get_interval(self.rssfeed), interval)
+
+    def test_reset(self):
+        self.update(0, [])
+        self.update(60, [])
+        self.intervals.reset("0")
+        self.assertEquals(self.intervals.get_interval(self.rssfeed), 60)
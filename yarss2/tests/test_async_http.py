@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import gzip
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from yarss2.error import RateLimitError
+from yarss2.util import http
+from yarss2.util.async_http import AsyncHTTPClient
+
+from .utils.helpers import HTTPTestServer
+
+RSS_BODY = b'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Test</title></channel></rss>'
+
+
+class AsyncHTTPClientTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.server = HTTPTestServer().start()
+        self.addCleanup(self.server.stop)
+        self.rate_limiter = http.HostRateLimiter(rate=100, burst=100)
+        self.client = AsyncHTTPClient(rate_limiter=self.rate_limiter)
+        # Runs before stopping the server
+        self.addCleanup(self.client.close)
+
+    @defer.inlineCallbacks
+    def test_get(self):
+        self.server.routes["/rss.xml"] = (200, {"Content-Type": "application/rss+xml"}, RSS_BODY)
+        result = yield self.client.get(self.server.url("/rss.xml"), headers={"User-Agent": "YaRSS2 test"})
+        self.assertEquals(result["status"], 200)
+        self.assertEquals(result["content"], RSS_BODY)
+        self.assertEquals(result["headers"]["content-type"], "application/rss+xml")
+        self.assertEquals(self.server.requests[0][1]["User-Agent"], "YaRSS2 test")
+        # The connection is kept alive
+        yield self.client.get(self.server.url("/rss.xml"))
+        self.assertEquals(self.server.connection_count, 1)
+        self.assertEquals(self.rate_limiter.get_state()["127.0.0.1"]["requests"], 2)
+
+    @defer.inlineCallbacks
+    def test_get_redirect_gzip(self):
+        self.server.routes["/old.xml"] = (301, {"Location": self.server.url("/rss.xml")}, b"")
+        self.server.routes["/rss.xml"] = (200, {"Content-Encoding": "gzip"}, gzip.compress(RSS_BODY))
+        result = yield self.client.get(self.server.url("/old.xml"))
+        self.assertEquals(result["content"], RSS_BODY)
+        self.assertEquals(result["href"], self.server.url("/rss.xml"))
+
+    @defer.inlineCallbacks
+    def test_download_file_conditional(self):
+        headers = {"Content-Type": "application/rss+xml", "ETag": '"abc"',
+                   "Last-Modified": "Sun, 06 Nov 1994 08:49:37 GMT"}
+        self.server.routes["/rss.xml"] = (200, headers, RSS_BODY)
+        result = yield self.client.download_file(self.server.url("/rss.xml"), site_cookies_dict={"key": "value"})
+        self.assertEquals(result["etag"], '"abc"')
+        self.assertEquals(result["modified"], "Sun, 06 Nov 1994 08:49:37 GMT")
+        self.assertTrue(b"<title>Test</title>" in result["content"])
+        self.assertEquals(self.server.requests[0][1]["Cookie"], "key=value")
+
+        self.server.routes["/rss.xml"] = (304, {}, b"")
+        result = yield self.client.download_file(self.server.url("/rss.xml"), etag=result["etag"],
+                                                 modified=result["modified"])
+        self.assertEquals(result["status"], 304)
+        self.assertEquals(self.server.requests[1][1]["If-None-Match"], '"abc"')
+        self.assertEquals(self.server.requests[1][1]["If-Modified-Since"], "Sun, 06 Nov 1994 08:49:37 GMT")
+
+    @defer.inlineCallbacks
+    def test_get_throttled(self):
+        self.server.routes["/rss.xml"] = (429, {"Retry-After": "3600"}, b"Too many requests")
+        result = yield self.client.get(self.server.url("/rss.xml"))
+        self.assertEquals(result["status"], 429)
+        self.assertEquals(self.rate_limiter.get_state()["127.0.0.1"]["throttled"], 1)
+        # The host is not requested again before the backoff has ended
+        yield self.assertFailure(self.client.get(self.server.url("/rss.xml")), RateLimitError)
+        self.assertEquals(len(self.server.requests), 1)
+
+    @defer.inlineCallbacks
+    def test_get_url_sent_as_given(self):
+        # Search and passkey feeds with escapes, '+' and ',' in the query
+        path = "/rss?q=a+b&f=x%20y&c=1,2"
+        self.server.routes[path] = (200, {}, RSS_BODY)
+        result = yield self.client.download_file(self.server.url(path))
+        self.assertEquals(result["status"], 200)
+        self.assertEquals(self.server.requests[0][0], path)
+        # Only the characters not allowed in a URL are encoded
+        self.server.routes["/Elf%20(Begriffskl%C3%A4rung)"] = (200, {}, RSS_BODY)
+        result = yield self.client.get(self.server.url(u"/Elf (Begriffsklärung)"))
+        self.assertEquals(result["status"], 200)
+
+    @defer.inlineCallbacks
+    def test_get_url_credentials(self):
+        self.server.routes["/rss.xml"] = (200, {}, RSS_BODY)
+        url = self.server.url("/rss.xml").replace("http://", "http://user:pass@")
+        result = yield self.client.download_file(url)
+        self.assertEquals(result["status"], 200)
+        path, headers = self.server.requests[0]
+        self.assertEquals(path, "/rss.xml")
+        self.assertEquals(headers["Authorization"], "Basic dXNlcjpwYXNz")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import datetime
+
+from dateutil import parser as dateutil_parser
+from dateutil.tz import tzutc
+from twisted.trial import unittest
+
+from yarss2.util import common
+
+
+class CommonTestCase(unittest.TestCase):
+
+    def test_isodate_to_datetime(self):
+        dates = ["2012-03-30T15:13:54", "2012-03-30T15:13:54.123456", "2019-09-27T08:12:48-04:00",
+                 "2019-10-14T03:10:26+00:00", "2019-10-14", "0001-01-01T00:00:00+00:00",
+                 # Not in the format created by isoformat()
+                 "Mon, 14 Oct 2019 03:10:26 +0000", "20191014T031026"]
+        for date in dates:
+            expected = dateutil_parser.parse(date).replace(tzinfo=tzutc())
+            self.assertEquals(common.isodate_to_datetime(date), expected)
+            self.assertTrue(common.isodate_to_datetime(date).tzinfo is common.get_tzutc())
+
+    def test_isodate_to_datetime_invalid(self):
+        self.assertEquals(common.isodate_to_datetime(""), common.get_default_date())
+        self.assertEquals(common.isodate_to_datetime("not a date"), common.get_default_date())
+
+    def test_isodate_to_datetime_cached(self):
+        date = datetime.datetime(2020, 1, 2, 3, 4, 5).isoformat()
+        self.assertTrue(common.isodate_to_datetime(date) is common.isodate_to_datetime(date))
+
+    def test_datetime_add_timezone(self):
+        dt = common.datetime_add_timezone(datetime.datetime(2020, 1, 2))
+        self.assertTrue(dt.tzinfo is common.get_tzutc())
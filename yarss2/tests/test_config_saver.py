@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import os
+import tempfile
+from unittest import mock
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+import deluge.config
+
+from yarss2.util.config_saver import ConfigSaver, save_config_atomic
+
+
+class ConfigSaverTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.config_dir = tempfile.mkdtemp()
+        self.config = deluge.config.Config("test.conf", {"values": {}}, config_dir=self.config_dir,
+                                           file_version=3)
+        self.filename = os.path.join(self.config_dir, "test.conf")
+        self.clock = task.Clock()
+        self.saver = ConfigSaver(self.config, delay=5, clock=self.clock)
+
+    def load_config(self):
+        return deluge.config.Config("test.conf", {}, config_dir=self.config_dir)
+
+    def test_save_later(self):
+        for i in range(40):
+            self.config["values"][str(i)] = i
+            self.saver.save_later()
+        self.assertFalse(os.path.exists(self.filename))
+        self.clock.advance(5)
+        # All the changes are written at once
+        self.assertEquals(self.saver.saves, 1)
+        self.assertFalse(self.saver.dirty)
+        self.assertEquals(len(self.load_config()["values"]), 40)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_flush(self):
+        # Setting a top level key schedules the save of deluge.config.Config, which is cancelled
+        self.config["values"] = {"key": "value"}
+        self.saver.save_later()
+        self.assertEquals(self.config._save_timer.active(), False)
+        self.assertTrue(self.saver.flush())
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.assertEquals(self.load_config()["values"], {"key": "value"})
+        # Nothing to write
+        self.assertTrue(self.saver.flush())
+        self.assertEquals(self.saver.saves, 1)
+
+    def test_save_immediately(self):
+        saver = ConfigSaver(self.config, delay=0, clock=self.clock)
+        saver.save_later()
+        self.assertEquals(saver.saves, 1)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_save_config_atomic(self):
+        self.config["values"]["key"] = u"välue"
+        self.assertTrue(save_config_atomic(self.config))
+        loaded = self.load_config()
+        self.assertEquals(loaded["values"], {"key": u"välue"})
+        self.assertEquals(loaded._Config__version["file"], 3)
+
+        # The config file is unchanged if writing fails, and the temporary file is removed
+        self.config["values"]["key"] = object()
+        self.assertFalse(save_config_atomic(self.config))
+        self.assertEquals(self.load_config()["values"], {"key": u"välue"})
+        self.assertEquals(os.listdir(self.config_dir), ["test.conf"])
+
+    def test_save_config_atomic_without_version(self):
+        # A deluge version without the private version attribute
+        config = mock.Mock(config_file=self.filename, spec=["config_file", "config", "save"])
+        config.save.return_value = True
+        self.assertTrue(save_config_atomic(config))
+        config.save.assert_called_once_with(self.filename)
+
+    def test_flush_failed(self):
+        self.config["values"]["key"] = object()
+        self.saver.save_later()
+        self.assertFalse(self.saver.flush())
+        self.assertTrue(self.saver.dirty)
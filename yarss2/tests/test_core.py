@@ -21,6 +21,7 @@ import yarss2.yarss_config
 from yarss2.core import Core
 from yarss2.torrent_handling import TorrentDownload, TorrentHandler
 from yarss2.util import logging
+from yarss2.util.stats import get_pipeline_stats
 from yarss2.yarss_config import get_user_agent
 
 from . import common as test_common
@@ -55,7 +56,7 @@ class CoreTestCase(unittest.TestCase):
         self.core.torrent_handler = self.torrent_handler
 
     def tearDown(self):  # NOQA
-        # Must stop loopingcalls or test fails
+        # Must stop the timers or test fails
         self.core.disable()
 
 #    def test_save_rssfeed(self):
@@ -291,3 +292,20 @@ class RPCServerTestCase(BaseTestCase, TestCaseDebug):
             'published_date': '2019-09-27T08:12:48-04:00'
         }
         self.assertEqual(items[0], expected_item0)
+
+    def test_core_get_stats(self):
+        get_pipeline_stats().add_rssfeed_timings("0", {"download": 0.5})
+        self.protocol.dispatch(self.request_id, "core.get_stats", [], {})
+        msg_bytes = self.protocol.transport.messages_written[0]
+
+        self.protocol.transport.dataReceived(msg_bytes)
+        msg_received = self.protocol.transport.messages_received[0]
+
+        self.assertEqual(msg_received[0], rpcserver.RPC_RESPONSE, str(msg_received))
+        stats = msg_received[2]
+        self.assertEqual(stats["rssfeeds"]["0"]["download"]["last"], 0.5)
+        self.assertEqual(stats["updates"], {"updates": 0, "not_modified": 0, "unchanged": 0})
+        for key in ("subscriptions", "regex_cache", "rate_limiter", "run_queue", "config_saves",
+                    "gtkui_log_dropped"):
+            self.assertTrue(key in stats)
+        get_pipeline_stats().reset()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import threading
+from unittest import mock
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from yarss2.util.gtkui_log import GtkUILogBuffer
+
+
+class GtkUILogBufferTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.events = []
+        event_manager = mock.Mock()
+        event_manager.emit.side_effect = self.events.append
+        patcher = mock.patch("deluge.component.get", return_value=event_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock = task.Clock()
+        self.buffer = GtkUILogBuffer(flush_interval=1, max_messages=10, clock=self.clock)
+
+    def get_messages(self, event):
+        return [message for time, message in event._args[0]]
+
+    def test_batched(self):
+        for i in range(5):
+            self.assertTrue(self.buffer.add("Message %d" % i))
+        self.assertEquals(self.events, [])
+        self.clock.advance(1)
+        # All the messages in one event
+        self.assertEquals(len(self.events), 1)
+        self.assertEquals(self.get_messages(self.events[0]), ["Message %d" % i for i in range(5)])
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.buffer.add("Message")
+        self.clock.advance(1)
+        self.assertEquals(len(self.events), 2)
+
+    def test_flood(self):
+        for i in range(100):
+            self.buffer.add("Message %d" % i)
+        self.clock.advance(1)
+        messages = self.get_messages(self.events[0])
+        self.assertEquals(len(messages), 11)
+        self.assertEquals(messages[9], "Message 9")
+        self.assertEquals(messages[10], "90 log messages were not shown, see the deluge log for all the messages")
+        self.assertEquals(self.buffer.dropped_total, 90)
+
+    def test_add_from_thread(self):
+        self.clock.callFromThread = mock.Mock()
+        thread = threading.Thread(target=self.buffer.add, args=("Message",))
+        thread.start()
+        thread.join()
+        # The event is scheduled on the main thread
+        self.clock.callFromThread.assert_called_once_with(self.buffer._schedule_flush)
+        self.buffer.flush()
+        self.assertEquals(self.get_messages(self.events[0]), ["Message"])
+
+    def test_no_event_manager(self):
+        with mock.patch("deluge.component.get", side_effect=KeyError):
+            self.assertFalse(self.buffer.add("Message"))
+        self.assertEquals(self.clock.getDelayedCalls(), [])
@@ -7,11 +7,16 @@
 # See LICENSE for more details.
 #
 
+from unittest import mock
+
 from twisted.trial import unittest
 
 import yarss2.yarss_config
+from yarss2.error import RateLimitError
 from yarss2.util import common, http
 
+from .utils.helpers import HTTPTestServer
+
 
 class HTTPTestCase(unittest.TestCase):
 
@@ -58,6 +63,30 @@ class HTTPTestCase(unittest.TestCase):
         self.assertEquals(matching_cookies["key2"], cookies["0"]["value"]["key2"])
         self.assertFalse("key3" in matching_cookies)
 
+    def test_cookie_index(self):
+        cookies = {}
+        for key, site in enumerate(["example.com", "www.example.com", "other.com", "example.com/private", "ample.com"]):
+            cookies[str(key)] = yarss2.yarss_config.get_fresh_cookie_config()
+            cookies[str(key)]["site"] = site
+            cookies[str(key)]["value"] = {"key": str(key), "key%d" % key: "value"}
+        index = http.CookieIndex(cookies)
+        # The host and its domains match, also when given as a host name without scheme
+        self.assertEquals(index.get_cookies_dict("https://www.example.com/rss"),
+                          {"key": "1", "key0": "value", "key1": "value"})
+        self.assertEquals(index.get_cookies_dict("www.example.com"), index.get_cookies_dict("http://www.example.com"))
+        self.assertEquals(index.get_cookie_header("http://example.com/rss"), {"Cookie": "key=0; key0=value"})
+        # A site with a path matches the URLs containing it
+        self.assertEquals(index.get_cookies_dict("http://example.com/private/1.torrent"),
+                          {"key": "3", "key0": "value", "key3": "value"})
+        self.assertEquals(index.get_cookies_dict("http://example.org/?site=other.com"), {})
+        self.assertEquals(index.get_cookie_header("http://example.org"), {})
+
+        # The index is built again when the cookies are changed
+        self.assertTrue(http.get_cookie_index(cookies) is http.get_cookie_index(cookies))
+        index = http.get_cookie_index(cookies)
+        http.invalidate_cookie_index()
+        self.assertFalse(http.get_cookie_index(cookies) is index)
+
     def test_url_fix(self):
         url = u"http://de.wikipedia.org/wiki/Elf (Begriffsklärung)"
         expected = "http://de.wikipedia.org/wiki/Elf%20(Begriffskl%C3%A4rung)"
@@ -117,3 +146,149 @@ class HTTPTestCase(unittest.TestCase):
         self.assertEquals('The top100 torrents', parsed_feeds.description)
         self.assertEquals('https://therss.so', parsed_feeds.link)
         self.assertEquals(None, parsed_feeds.ttl)
+
+
+class HTTPSessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.now = 1000.0
+        self.pool = http.HTTPSessionPool(max_hosts=2, idle_timeout=60, clock=lambda: self.now)
+        torrent = common.read_file(common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent",
+                                                       path="tests/data/"))
+        self.server = HTTPTestServer(routes={
+            "/file.torrent": (200, {"Set-Cookie": "server_cookie=1"}, torrent),
+        }).start()
+
+    def tearDown(self):  # NOQA
+        self.pool.close()
+        self.server.stop()
+
+    def test_keep_alive(self):
+        for i in range(5):
+            r = self.pool.get(self.server.url("/file.torrent"), cookies={"uid": "1"})
+            self.assertEquals(200, r.status_code)
+        # All the requests used the same connection
+        self.assertEquals(1, self.server.connection_count)
+        self.assertEquals(1, len(self.pool))
+        # Cookies set by the server are not stored in the session
+        for path, headers in self.server.requests:
+            self.assertEquals("uid=1", headers["Cookie"])
+
+    def test_session_per_host(self):
+        url = self.server.url("/file.torrent")
+        session = self.pool.get_session(url)
+        self.assertTrue(session is self.pool.get_session(url.upper().replace("/FILE.TORRENT", "/other")))
+        self.assertFalse(session is self.pool.get_session(url.replace("127.0.0.1", "localhost")))
+        self.assertEquals(2, len(self.pool))
+
+    def test_evict_least_recently_used(self):
+        session1 = self.pool.get_session("http://host1.com/file")
+        self.pool.get_session("http://host2.com/file")
+        self.pool.get_session("http://host1.com/file")
+        # host2 is the least recently used and is closed
+        self.pool.get_session("http://host3.com/file")
+        self.assertEquals(2, len(self.pool))
+        self.assertTrue(session1 is self.pool.get_session("http://host1.com/file"))
+
+    def test_evict_idle(self):
+        session1 = self.pool.get_session("http://host1.com/file")
+        self.now += 30
+        self.pool.get_session("http://host2.com/file")
+        self.now += 40
+        self.assertEquals(1, self.pool.evict_idle())
+        self.assertEquals(1, len(self.pool))
+        # A new session is created for the evicted host
+        self.assertFalse(session1 is self.pool.get_session("http://host1.com/file"))
+
+    def test_evicted_session_in_use(self):
+        # A download in another thread is using the session
+        session1 = self.pool.acquire("http://host1.com/file")
+        session1.close = mock.Mock()
+        self.now += 70
+        self.assertEquals(1, self.pool.evict_idle())
+        self.pool.get_session("http://host2.com/file")
+        self.pool.get_session("http://host3.com/file")
+        self.pool.close()
+        self.assertFalse(session1.close.called)
+        # Closed when the download has finished
+        self.pool.release(session1)
+        self.assertEquals(1, session1.close.call_count)
+
+    def test_session_released_after_request(self):
+        session = self.pool.get_session(self.server.url("/file.torrent"))
+        session.close = mock.Mock()
+        self.pool.get(self.server.url("/file.torrent"))
+        self.pool.close()
+        self.assertEquals(1, session.close.call_count)
+
+
+class HostRateLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.now = 1000.0
+        self.limiter = http.HostRateLimiter(rate=1.0, burst=2, max_wait=30, backoff=60, max_backoff=300,
+                                            clock=lambda: self.now, sleep=self.sleep)
+        self.url = "http://tracker.example.com/rss.xml"
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_token_bucket(self):
+        self.assertEquals(self.limiter.acquire(self.url), 0)
+        self.assertEquals(self.limiter.acquire(self.url), 0)
+        # Must wait for a new token
+        self.assertEquals(self.limiter.acquire(self.url), 1.0)
+        # Other hosts have their own bucket
+        self.assertEquals(self.limiter.acquire("https://other.example.com/file.torrent"), 0)
+        # Local files are not limited
+        self.assertEquals(self.limiter.acquire("/tmp/file.torrent"), 0)
+        self.now += 100
+        self.assertEquals(self.limiter.get_state()["tracker.example.com"]["tokens"], 2)
+        self.assertEquals(self.limiter.get_state()["tracker.example.com"]["requests"], 3)
+
+    def test_reserve(self):
+        # The tokens are taken in advance without waiting
+        self.assertEquals([self.limiter.reserve(self.url) for i in range(4)], [0, 0, 1.0, 2.0])
+        self.assertEquals(self.limiter.get_state()["tracker.example.com"]["tokens"], -2)
+        self.now += 2
+        self.assertEquals(self.limiter.reserve(self.url), 1.0)
+        self.limiter.update(self.url, 429, {"Retry-After": "10"})
+        # The bucket is refilled from the end of the backoff
+        self.assertEquals(self.limiter.reserve(self.url), 11.0)
+
+    def test_retry_after(self):
+        self.limiter.update(self.url, 429, {"Retry-After": "120"})
+        self.assertRaises(RateLimitError, self.limiter.acquire, self.url)
+        state = self.limiter.get_state()["tracker.example.com"]
+        self.assertEquals(state["backoff"], 120)
+        self.assertEquals(state["rejected"], 1)
+        self.now += 100
+        # Less than max_wait left of the backoff
+        self.assertEquals(self.limiter.acquire(self.url), 21.0)
+        self.limiter.update(self.url, 200, {})
+        self.assertEquals(self.limiter.get_state()["tracker.example.com"]["failures"], 0)
+
+    def test_retry_after_date(self):
+        headers = {"retry-after": "Sun, 06 Nov 1994 08:49:37 GMT"}
+        self.assertEquals(http.get_retry_after(headers, 784111717), 60)
+        self.assertEquals(http.get_retry_after({"Retry-After": "invalid"}, 0), None)
+        self.assertEquals(http.get_retry_after({}, 0), None)
+
+    def test_exponential_backoff(self):
+        backoffs = []
+        for i in range(4):
+            self.limiter.update(self.url, 503)
+            backoffs.append(self.limiter.get_state()["tracker.example.com"]["backoff"])
+            self.now += backoffs[-1]
+        self.assertEquals(backoffs, [60, 120, 240, 300])
+
+    def test_download_file_throttled(self):
+        body = b"We have too many requests from your ip"
+        with HTTPTestServer(routes={"/rss.xml": (429, {"Retry-After": "3600"}, body)}) as server:
+            url = server.url("/rss.xml")
+            result = http.download_file(url, timeout=10, rate_limiter=self.limiter)
+            self.assertEquals(result["status"], 429)
+            self.assertEquals(self.limiter.get_state()["127.0.0.1"]["backoff"], 300)
+            # The host is not requested again before the backoff has ended
+            self.assertRaises(RateLimitError, http.download_file, url, timeout=10, rate_limiter=self.limiter)
+            self.assertEquals(len(server.requests), 1)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import logging as python_logging
+from unittest import mock
+
+from twisted.trial import unittest
+
+from yarss2.util import logging
+
+
+class Argument(object):
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "argument"
+
+
+class LoggerTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.python_logger = python_logging.getLogger("yarss2_test_logging")
+        self.python_logger.propagate = False
+        self.python_logger.setLevel(python_logging.INFO)
+        self.records = []
+        handler = python_logging.Handler()
+        handler.emit = self.records.append
+        self.python_logger.addHandler(handler)
+        self.addCleanup(self.python_logger.removeHandler, handler)
+        self.gtkui_logger = mock.Mock()
+        self.log = logging.Logger(gtkui_logger=self.gtkui_logger, logger=self.python_logger)
+
+    def test_lazy_formatting(self):
+        argument = Argument()
+        with mock.patch("yarss2.util.common.filename") as filename:
+            self.log.debug("Not logged: %s", argument, gtkui=False)
+            self.assertEquals(argument.formatted, 0)
+            # The caller is only looked up for the messages that are logged
+            self.assertFalse(filename.called)
+        self.assertEquals(self.records, [])
+
+        self.log.info("Logged: %s", argument)
+        self.assertEquals(argument.formatted, 1)
+        self.gtkui_logger.gtkui_log_message.assert_called_once_with("Logged: argument")
+        self.assertEquals(self.records[0].getMessage().split(": ", 1)[1], "Logged: argument")
+
+    def test_caller(self):
+        self.log.warn("No arguments: 100%")
+        # The file and line of the call to warn
+        line = self.test_caller.__code__.co_firstlineno + 1
+        self.assertEquals(self.records[0].getMessage(), "YaRSS2.test_logging:%d: No arguments: 100%%" % line)
+
+    def test_is_enabled_for(self):
+        self.assertFalse(self.log.is_enabled_for(python_logging.DEBUG))
+        self.assertTrue(self.log.is_enabled_for(python_logging.DEBUG, gtkui=True))
+        self.assertTrue(self.log.is_enabled_for(python_logging.WARNING))
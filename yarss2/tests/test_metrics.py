@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import os
+import tempfile
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from yarss2.rssfeed_scheduler import RSSFeedRunQueue
+from yarss2.util.metrics import MetricsFileWriter, format_metrics
+from yarss2.util.stats import PipelineStats
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def get_stats(self):
+        pipeline_stats = PipelineStats()
+        pipeline_stats.add_rssfeed_timings("0", {"download": 0.5})
+        pipeline_stats.add_rssfeed_counts("0", {"updates": 2, "not_modified": 1, "bytes": 1024})
+        pipeline_stats.add_subscription_timings("1", {"match": 0.25})
+        pipeline_stats.add_subscription_counts("1", {"runs": 2, "matches": 3})
+        stats = pipeline_stats.get_stats()
+        stats["run_queue"] = RSSFeedRunQueue().get_state()
+        stats["rate_limiter"] = {"example.com": {"requests": 4, "throttled": 1},
+                                 "example.org": {"requests": 2, "throttled": 0}}
+        stats["regex_cache"] = {"hits": 5, "misses": 2}
+        stats["config_saves"] = 3
+        stats["torrent_download_cache"] = {"size": 1, "hits": 2}
+        return stats
+
+    def test_format_metrics(self):
+        config = {"rssfeeds": {"0": {"name": 'My "feed"'}},
+                  "subscriptions": {"1": {"name": "Sub", "rssfeed_key": "0"}}}
+        lines = format_metrics(self.get_stats(), config).splitlines()
+        self.assertTrue("# TYPE yarss2_rssfeed_updates_total counter" in lines)
+        self.assertTrue('yarss2_rssfeed_updates_total{rssfeed="0",name="My \\"feed\\""} 2' in lines)
+        self.assertTrue('yarss2_rssfeed_not_modified_total{rssfeed="0",name="My \\"feed\\""} 1' in lines)
+        self.assertTrue('yarss2_rssfeed_downloaded_bytes_total{rssfeed="0",name="My \\"feed\\""} 1024' in lines)
+        self.assertTrue('yarss2_rssfeed_stage_seconds{rssfeed="0",name="My \\"feed\\"",stage="download",'
+                        'quantile="0.5"} 0.5' in lines)
+        self.assertTrue('yarss2_rssfeed_stage_seconds_count{rssfeed="0",name="My \\"feed\\"",stage="download"} 1'
+                        in lines)
+        self.assertTrue('yarss2_subscription_matches_total{subscription="1",name="Sub",rssfeed="0"} 3' in lines)
+        self.assertTrue('yarss2_subscription_match_seconds_sum{subscription="1",name="Sub",rssfeed="0"} 0.25'
+                        in lines)
+        self.assertTrue("yarss2_run_queue_queued 0" in lines)
+        self.assertTrue("yarss2_run_queue_wait_seconds_count 0" in lines)
+        self.assertTrue('yarss2_host_throttled_total{host="example.com"} 1' in lines)
+        self.assertTrue("yarss2_regex_cache_misses_total 2" in lines)
+        self.assertTrue("yarss2_config_saves_total 3" in lines)
+        self.assertTrue("yarss2_torrent_download_cache_hits_total 2" in lines)
+        # Each metric is described once
+        self.assertEquals(lines.count("# TYPE yarss2_host_requests_total counter"), 1)
+
+    def test_format_metrics_grouped_by_metric(self):
+        lines = format_metrics(self.get_stats(), {}).splitlines()
+        host_lines = [line for line in lines if "yarss2_host_" in line]
+        self.assertEquals(host_lines, [
+            "# HELP yarss2_host_requests_total Number of requests to the host",
+            "# TYPE yarss2_host_requests_total counter",
+            'yarss2_host_requests_total{host="example.com"} 4',
+            'yarss2_host_requests_total{host="example.org"} 2',
+            "# HELP yarss2_host_throttled_total Number of HTTP 429 and 503 responses from the host",
+            "# TYPE yarss2_host_throttled_total counter",
+            'yarss2_host_throttled_total{host="example.com"} 1',
+            'yarss2_host_throttled_total{host="example.org"} 0',
+        ])
+
+    def test_metrics_file_writer(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "yarss2.prom")
+        clock = task.Clock()
+        texts = ["first\n", "second\n"]
+        writer = MetricsFileWriter(lambda: texts.pop(0), filename, interval=60, clock=clock)
+        writer.start()
+        with open(filename) as f:
+            self.assertEquals(f.read(), "first\n")
+        clock.advance(60)
+        with open(filename) as f:
+            self.assertEquals(f.read(), "second\n")
+        writer.stop()
+        self.assertEquals(clock.getDelayedCalls(), [])
+        self.assertEquals(os.listdir(directory), ["yarss2.prom"])
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import re
+
+from twisted.trial import unittest
+
+from yarss2.util import regex_cache
+from yarss2.util.regex_cache import RegexCache
+
+
+class RegexCacheTestCase(unittest.TestCase):
+
+    def test_compile(self):
+        cache = RegexCache()
+        p1 = cache.compile(b"FreeBSD", re.IGNORECASE)
+        p2 = cache.compile(b"FreeBSD", re.IGNORECASE)
+        self.assertTrue(p1 is p2)
+        self.assertTrue(p1.search(b"freebsd-9.0"))
+        # Different flags is a different pattern
+        p3 = cache.compile(b"FreeBSD")
+        self.assertFalse(p3.search(b"freebsd-9.0"))
+        self.assertEquals(cache.get_stats(), {"hits": 1, "misses": 2, "size": 2, "max_size": 2048})
+
+    def test_compile_error(self):
+        cache = RegexCache()
+        self.assertRaises(re.error, cache.compile, b"[")
+        self.assertEquals(len(cache), 0)
+
+    def test_evict_least_recently_used(self):
+        cache = RegexCache(max_size=2)
+        p1 = cache.compile("a")
+        cache.compile("b")
+        cache.compile("a")
+        cache.compile("c")
+        self.assertEquals(len(cache), 2)
+        self.assertTrue(cache.compile("a") is p1)
+        self.assertEquals(cache.get_stats()["misses"], 3)
+        cache.compile("b")
+        self.assertEquals(cache.get_stats()["misses"], 4)
+
+    def test_compile_regex(self):
+        self.assertTrue(regex_cache.compile_regex("a") is regex_cache.get_regex_cache().compile("a"))
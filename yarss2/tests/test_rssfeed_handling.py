@@ -7,16 +7,21 @@
 # See LICENSE for more details.
 #
 import datetime
+from io import BytesIO
+from unittest import mock
 
 from twisted.trial import unittest
 
 import yarss2.util.common
 from yarss2 import rssfeed_handling
-from yarss2.util import common, logging
+from yarss2.error import FetchAndFeedparsingError, RateLimitError
+from yarss2.util import common, http, logging
 
 from . import common as test_common
 from .base import TestCaseDebug
+from .test_seen_items import get_test_seen_items
 from .utils import assert_equal
+from .utils.helpers import HTTPTestServer
 from .utils.log_utils import plugin_tests_logger_name
 
 log = logging.getLogger(plugin_tests_logger_name)
@@ -85,6 +90,8 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
         stored_items = {
             0: {
                 'title': 'The Show WEB H264 MEMENTO',
+                'item_id': '4e30c9aa8545c5b2910702abbbfa4c7d49bbd5af',
+                'infohash': 'ab3c1ad2258201bfd289d886f1062761d8427a40',
                 'link': 'magnet:?xt=urn:btih:AB3C1AD2258201BFD289D886F1062761D8427A40&dn=The+Show+WEB+H264+MEMENTO&tr=udp%3A%2F%2Ftracker.coppersurfer.tk%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.leechers-paradise.org%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337%2Fannounce&tr=http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce',  # noqa: E501
                 'matches': False,
                 'updated': '2019-10-14T03:10:26+00:00',
@@ -114,6 +121,8 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
         stored_items = {
             0: {
                 'title': 'Lolly Tang 2009 09 26 WEB x264-TBS',
+                'item_id': 'https://eztv.io/ep/1369854/lolly-tang-2009-09-26-web-x264-tbs/',
+                'infohash': '4cf874831f61f5db9c3299e503e28a8103047ba0',
                 'link': 'magnet:?xt=urn:btih:4CF874831F61F5DB9C3299E503E28A8103047BA0&dn=Lolly.Tang.2009.09.26.WEB.x264-TBS%5Beztv%5D.mkv&tr=udp%3A%2F%2Ftracker.publicbt.com%2Fannounce&tr=udp%3A%2F%2Fopen.demonii.com%3A1337&tr=http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2Ftracker.coppersurfer.tk%3A6969&tr=udp%3A%2F%2Ftracker.leechers-paradise.org%3A6969&tr=udp%3A%2F%2Fexodus.desync.com%3A6969',  # noqa: E501
                 'matches': False,
                 'updated': '2019-09-27T08:12:48-04:00',
@@ -122,6 +131,8 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
             },
             1: {
                 'title': 'The.Show.WEB.H264-MEMENTO',
+                'item_id': 'https://eztv.io/ep/1369835/jimmy-fallon-2019-09-26-michael-che-web-x264-tbs/',
+                'infohash': '3b4bbdb57e3d83f900ea9844753006a7da62d0b6',
                 'link': 'magnet:?xt=urn:btih:3B4BBDB57E3D83F900EA9844753006A7DA62D0B6&dn=The.Show.WEB.H264-MEMENTO[eztv].mkv&tr=udp%3A%2F%2Ftracker.publicbt.com%2Fannounce&tr=udp%3A%2F%2Fopen.demonii.com%3A1337&tr=http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2Ftracker.coppersurfer.tk%3A6969&tr=udp%3A%2F%2Ftracker.leechers-paradise.org%3A6969&tr=udp%3A%2F%2Fexodus.desync.com%3A6969',  # noqa: E501
                 'matches': False,
                 'updated': '2019-09-27T06:41:36-04:00',
@@ -328,6 +339,8 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
 
             expected_item = {
                 'title': '[TORRENT] Chicago.Fire.S02E18.720p.WEB-DL.DD5.1.H.264-KiNGS [PublicHD]',
+                'item_id': '3aaey42ezcksc54elci35h45hivzf7l5',
+                'infohash': 'd8004c7344c8952177845891be9f9d3a2b92fd7d',
                 'link': 'http://publichd.se/download.php?id=d8004c7344c8952177845891be9f9d3a2b92fd7d&f=Chicago.Fire.S02E18.720p.WEB-DL.DD5.1.H.264-KiNGS-[PublicHD]',  # noqa: E501
                 'matches': False,
                 'updated': '2014-10-04T03:44:14+00:00',
@@ -344,6 +357,190 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
                 self.assertEquals(test_val, updated_datetime)
                 break
 
+    def test_fetch_feed_torrents_conditional_get(self):
+        feed_body = common.read_file(common.get_resource(test_common.testdata_rssfeed_filename, path="tests"))
+        etag = '"feed-etag-1"'
+
+        def feed_response(handler):
+            if handler.headers.get("If-None-Match") == etag:
+                return (304, {"ETag": etag}, b"")
+            return (200, {"ETag": etag, "Content-Type": "application/rss+xml"}, feed_body)
+
+        config = test_common.get_test_config_dict()
+        with HTTPTestServer(routes={"/rss.xml": feed_response}) as server:
+            config["rssfeeds"]["0"]["url"] = server.url("/rss.xml")
+
+            # First update fetches the complete feed and stores the ETag
+            result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+            self.assertEquals(3, len(result["matching_torrents"]))
+            self.assertFalse(result["not_modified"])
+            self.assertEquals(etag, config["rssfeeds"]["0"]["etag"])
+            self.assertFalse("If-None-Match" in server.requests[0][1])
+
+            # Second update sends the ETag, and the server responds with 304
+            result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+            self.assertTrue(result["not_modified"])
+            self.assertEquals(0, len(result["matching_torrents"]))
+            self.assertEquals(etag, server.requests[1][1]["If-None-Match"])
+            # The feed is fetched only once even if multiple subscriptions are active
+            self.assertEquals(2, len(server.requests))
+
+            # Running a subscription manually does not use conditional GET
+            result = self.rssfeedhandler.fetch_feed_torrents(config, None, subscription_key="0")
+            self.assertEquals(3, len(result["matching_torrents"]))
+            self.assertFalse("If-None-Match" in server.requests[2][1])
+
+    def test_get_rssfeed_request(self):
+        config = test_common.get_test_config_dict()
+        config["rssfeeds"]["0"]["etag"] = '"feed-etag-1"'
+        request = self.rssfeedhandler.get_rssfeed_request(config, "0")
+        self.assertEquals(request["url"], config["rssfeeds"]["0"]["url"])
+        self.assertEquals(request["etag"], '"feed-etag-1"')
+        self.assertEquals(request["modified"], None)
+        # Running a subscription manually does not use conditional GET
+        request = self.rssfeedhandler.get_rssfeed_request(config, None, subscription_key="0")
+        self.assertFalse("etag" in request)
+        # Inactive RSS Feed
+        self.assertEquals(self.rssfeedhandler.get_rssfeed_request(config, "1"), None)
+        # No active subscriptions
+        self.assertEquals(self.rssfeedhandler.get_rssfeed_request(config, "2"), None)
+
+    def test_fetch_feed_torrents_download_result(self):
+        config = test_common.get_test_config_dict()
+        content = common.read_file(config["rssfeeds"]["0"]["url"])
+        config["rssfeeds"]["0"]["url"] = "http://127.0.0.1:1/rss.xml"
+        download_result = {"status": 200, "headers": {}, "content": content, "etag": '"feed-etag-1"'}
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0", download_result=download_result)
+        self.assertEquals(3, len(result["matching_torrents"]))
+        self.assertEquals('"feed-etag-1"', config["rssfeeds"]["0"]["etag"])
+        self.assertFalse("download_result" in result)
+
+        # The exception raised by the download
+        self.assertRaises(FetchAndFeedparsingError, self.rssfeedhandler.fetch_feed_torrents, config, "0",
+                          download_result=IOError("Connection refused"))
+
+    def test_fetch_feed_torrents_seen_items(self):
+        config = test_common.get_test_config_dict()
+        self.rssfeedhandler.seen_items = get_test_seen_items()
+
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(3, len(result["matching_torrents"]))
+        self.assertEquals(25, len(result["rssfeed_item_ids"]))
+        failed_id = result["matching_torrents"][0]["item_id"]
+        self.assertEquals(failed_id, "244eccb32d7f070669bb0cce7b2ee1ef5161fee2")
+
+        # All items except the first matching torrent have been processed
+        self.rssfeedhandler.seen_items.add("0", [item_id for item_id in result["rssfeed_item_ids"]
+                                                 if item_id != failed_id])
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(1, len(result["matching_torrents"]))
+        self.assertEquals(failed_id, result["matching_torrents"][0]["item_id"])
+
+        # Running a subscription manually does not skip the seen items
+        result = self.rssfeedhandler.fetch_feed_torrents(config, None, subscription_key="0")
+        self.assertEquals(3, len(result["matching_torrents"]))
+        self.assertFalse("rssfeed_item_ids" in result)
+
+    def test_parse_rss_stream(self):
+        import atoma
+        content = common.read_file(common.get_resource(test_common.testdata_rssfeed_filename, path="tests"))
+        expected = rssfeed_handling.atoma_result_to_dict(atoma.parse_rss_bytes(content))
+
+        result = rssfeed_handling.parse_rss_stream(BytesIO(content))
+        self.assertEquals(expected["items"], result["items"])
+        self.assertEquals(expected["feed"], result["feed"])
+        self.assertFalse(result["stopped_early"])
+
+        # Stop at the third item
+        stop_guid = expected["items"][2]["guid"]
+        result = rssfeed_handling.parse_rss_stream(BytesIO(content),
+                                                   stop_item_func=lambda item: item["guid"] == stop_guid)
+        self.assertEquals(expected["items"][:2], result["items"])
+        self.assertEquals(expected["feed"], result["feed"])
+        self.assertTrue(result["stopped_early"])
+
+    def test_parse_rss_stream_entities_forbidden(self):
+        from defusedxml import EntitiesForbidden
+        content = (b'<?xml version="1.0"?><!DOCTYPE rss [<!ENTITY lol "lol">]>'
+                   b'<rss version="2.0"><channel><title>&lol;</title></channel></rss>')
+        self.assertRaises(EntitiesForbidden, rssfeed_handling.parse_rss_stream, BytesIO(content))
+
+    def test_fetch_feed_torrents_stop_at_seen_item(self):
+        config = test_common.get_test_config_dict()
+        seen_items = get_test_seen_items()
+        self.rssfeedhandler.seen_items = seen_items
+
+        # Without high-water mark the complete feed is parsed
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(25, len(result["rssfeed_item_ids"]))
+        self.assertEquals(3, len(result["matching_torrents"]))
+
+        # The two newest items have not been processed
+        seen_items.add("0", result["rssfeed_item_ids"][2:])
+        seen_items.update_high_water_mark("0", result["rssfeed_newest_date"])
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(result["rssfeed_item_ids"], [u"6d53e2f47a8462899639a697942384f4b133deaa",
+                                                       u"dbabaf65f09ade1e3da7010794f9a32c58fab77d"])
+        self.assertEquals(0, len(result["matching_torrents"]))
+
+        # The update stops at the second item when nothing is new, the order is not known before
+        seen_items.add("0", result["rssfeed_item_ids"])
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(result["rssfeed_item_ids"], [u"6d53e2f47a8462899639a697942384f4b133deaa"])
+        self.assertEquals(0, len(result["matching_torrents"]))
+
+        # After failed torrents the complete feed is parsed again
+        seen_items.clear_high_water_mark("0")
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertEquals(25, len(result["rssfeed_item_ids"]))
+
+    def test_fetch_feed_torrents_oldest_first(self):
+        config = test_common.get_test_config_dict()
+        config["rssfeeds"]["0"]["url"] = yarss2.util.common.get_resource("rss_oldest_first.rss",
+                                                                         path="tests/data/feeds/")
+        config["subscriptions"]["0"]["regex_include"] = "S01E04"
+        seen_items = get_test_seen_items()
+        self.rssfeedhandler.seen_items = seen_items
+
+        # The earlier update processed the three oldest items
+        seen_items.add("0", ["item-1", "item-2", "item-3"])
+        seen_items.update_high_water_mark("0", "2019-10-14T03:00:00+00:00")
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        # The first item is older than the high-water mark and seen, but the newest item is last
+        self.assertEquals(result["rssfeed_item_ids"], ["item-1", "item-2", "item-3", "item-4"])
+        self.assertEquals(1, len(result["matching_torrents"]))
+        self.assertEquals(result["matching_torrents"][0]["title"], "Show S01E04")
+
+    def test_fetch_feed_torrents_unchanged_content(self):
+        config = test_common.get_test_config_dict()
+        seen_items = get_test_seen_items()
+        self.rssfeedhandler.seen_items = seen_items
+
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertFalse(result["unchanged"])
+        self.assertEquals(3, len(result["matching_torrents"]))
+        content_hash = result["rssfeed_content_hash"]
+        self.assertTrue(content_hash)
+
+        # All the items were processed, so the same content is not parsed again
+        seen_items.set_content_hash("0", content_hash)
+        with mock.patch("atoma.parse_rss_bytes") as parse_rss_bytes:
+            result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+            self.assertFalse(parse_rss_bytes.called)
+        self.assertTrue(result["unchanged"])
+        self.assertEquals(0, len(result["matching_torrents"]))
+        self.assertEquals(result["rssfeed_content_hash"], content_hash)
+
+        # Running a subscription manually parses the feed
+        result = self.rssfeedhandler.fetch_feed_torrents(config, None, subscription_key="0")
+        self.assertFalse(result["unchanged"])
+        self.assertEquals(3, len(result["matching_torrents"]))
+
+        # After failed torrents the feed is parsed again
+        seen_items.clear_high_water_mark("0")
+        result = self.rssfeedhandler.fetch_feed_torrents(config, "0")
+        self.assertFalse(result["unchanged"])
+
     def test_get_rssfeed_parsed_no_items(self):
         file_url = yarss2.util.common.get_resource("feed_no_items_issue15.rss", path="tests/data/feeds/")
         rssfeed_data = {"name": "Test", "url": file_url}
@@ -362,6 +559,24 @@ class RSSFeedHandlingTestCase(unittest.TestCase, TestCaseDebug):
         parsed_feed = self.rssfeedhandler.get_rssfeed_parsed(rssfeed_data)
         self.assertTrue("items" not in parsed_feed)
 
+    def test_get_rssfeed_parsed_too_many_requests(self):
+        self.patch(http, "_rate_limiter", http.HostRateLimiter())
+        body = common.read_file(common.get_resource("rarbg.to.rss.too_many_requests.html", path="tests/data/feeds/"))
+        with HTTPTestServer(routes={"/rss.xml": (429, {"Retry-After": "7200"}, body)}) as server:
+            rssfeed_data = {"name": "Test", "url": server.url("/rss.xml"), "etag": u"etag", "modified": u""}
+            parsed_feed = self.rssfeedhandler.get_rssfeed_parsed(rssfeed_data)
+            self.assertTrue("items" not in parsed_feed)
+            self.assertTrue(parsed_feed["rate_limited"])
+            self.assertTrue(isinstance(parsed_feed["bozo_exception"], RateLimitError))
+            # The ETag is kept, as the feed was not fetched
+            self.rssfeedhandler.update_conditional_get_validators(rssfeed_data, parsed_feed)
+            self.assertEquals(rssfeed_data["etag"], u"etag")
+
+            # The host is not requested again before Retry-After has passed
+            parsed_feed = self.rssfeedhandler.get_rssfeed_parsed(rssfeed_data)
+            self.assertTrue(parsed_feed["rate_limited"])
+            self.assertEquals(1, len(server.requests))
+
     # def test_test_feedparser_parse(self):
     #     #file_url = yarss2.util.common.get_resource(test_common.testdata_rssfeed_filename, path="tests/")
     #     from yarss2.lib.feedparser import feedparser
@@ -7,18 +7,31 @@
 # See LICENSE for more details.
 #
 
+import os
+import re
 import threading
+import time
+from unittest import mock
 
+from twisted.internet import task
 from twisted.internet.defer import Deferred, DeferredList
 from twisted.trial import unittest
 
 import yarss2.util.common
 import yarss2.yarss_config
 from yarss2.rssfeed_scheduler import RSSFeedRunQueue, RSSFeedScheduler
-from yarss2.util import logging
+from yarss2.util import http, logging
+from yarss2.util.async_http import AsyncHTTPClient
+from yarss2.util.common import TorrentDownload
+from yarss2.util.config_saver import ConfigSaver
+from yarss2.util.stats import PipelineStats
+from yarss2.util.timer_queue import TimerQueue
 
 from . import common as test_common
+from .test_adaptive_interval import get_test_adaptive_intervals
+from .test_seen_items import get_test_seen_items
 from .test_torrent_handling import TestComponent
+from .utils.helpers import HTTPTestServer
 from .utils.log_utils import plugin_tests_logger_name
 
 log = logging.getLogger(plugin_tests_logger_name)
@@ -38,62 +51,91 @@ class RSSFeedSchedulerTestCase(unittest.TestCase):
         self.config.set_config({"rssfeeds": self.rssfeeds,
                                 "email_configurations": {"send_email_on_torrent_events": False}})
 
-        self.scheduler = RSSFeedScheduler(self.config, log)
+        self.clock = task.Clock()
+        self.scheduler = RSSFeedScheduler(self.config, log, timer_queue=TimerQueue(clock=self.clock, jitter=0),
+                                          seen_items=get_test_seen_items(),
+                                          adaptive_intervals=get_test_adaptive_intervals())
         test_component = TestComponent()
         self.scheduler.torrent_handler.download_torrent_file = test_component.download_torrent_file
         self.scheduler.enable_timers()
 
     def tearDown(self):  # NOQA
-        # Must stop loopingcalls or test fails
         self.scheduler.disable_timers()
 
     def test_enable_timers(self):
         # Now verify the timers
-        for key in self.scheduler.rssfeed_timers.keys():
-            # Is the timer running?
-            self.assertTrue(self.scheduler.rssfeed_timers[key]["timer"].running)
-
+        self.assertEquals(len(self.scheduler.timer_queue), 5)
+        for key in self.rssfeeds:
             # Does the timer have the correct interval?
-            interval = self.scheduler.rssfeed_timers[key]["timer"].interval
-            self.assertEquals(self.rssfeeds[key]["update_interval"] * 60, interval)
-            self.assertEquals(self.rssfeeds[key]["update_interval"],
-                              self.scheduler.rssfeed_timers[key]["update_interval"])
+            self.assertEquals(self.rssfeeds[key]["update_interval"] * 60, self.scheduler.timer_queue.get_interval(key))
+            self.assertEquals(self.rssfeeds[key]["update_interval"], self.scheduler.get_timer_interval(key))
+            # The first update is within the interval
+            self.assertTrue(0 < self.scheduler.get_next_update_time(key) <= self.rssfeeds[key]["update_interval"] * 60)
 
     def test_disable_timers(self):
         self.scheduler.disable_timers()
 
         # Now verify that the timers have been stopped
-        for key in self.scheduler.rssfeed_timers.keys():
-            # Is the timer running?
-            self.assertFalse(self.scheduler.rssfeed_timers[key]["timer"].running)
+        self.assertEquals(len(self.scheduler.timer_queue), 0)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
 
     def test_delete_timer(self):
         # Delete timer
         self.assertTrue(self.scheduler.delete_timer("0"))
         self.assertFalse(self.scheduler.delete_timer("-1"))
 
-        self.assertEquals(len(self.scheduler.rssfeed_timers.keys()), 4)
-        self.assertFalse("0" in self.scheduler.rssfeed_timers)
+        self.assertEquals(len(self.scheduler.timer_queue), 4)
+        self.assertFalse("0" in self.scheduler.timer_queue)
+        self.assertEquals(self.scheduler.get_next_update_time("0"), None)
 
     def test_reschedule_timer(self):
         # Change interval to 60 minutes
         self.assertTrue(self.scheduler.set_timer("0", 60))
 
-        interval = self.scheduler.rssfeed_timers["0"]["timer"].interval
-        self.assertEquals(60 * 60, interval)
-        self.assertEquals(self.scheduler.rssfeed_timers["0"]["update_interval"], 60)
+        self.assertEquals(self.scheduler.timer_queue.get_interval("0"), 60 * 60)
+        self.assertEquals(self.scheduler.get_timer_interval("0"), 60)
 
     def test_schedule_timer(self):
         # Add new timer (with key "5") with interval 60 minutes
         self.assertTrue(self.scheduler.set_timer("5", 60))
 
         # Verify timer values
-        interval = self.scheduler.rssfeed_timers["5"]["timer"].interval
-        self.assertEquals(60 * 60, interval)
-        self.assertEquals(self.scheduler.rssfeed_timers["5"]["update_interval"], 60)
+        self.assertEquals(self.scheduler.timer_queue.get_interval("5"), 60 * 60)
+        self.assertEquals(self.scheduler.get_timer_interval("5"), 60)
 
         # Should now be 6 timers
-        self.assertEquals(len(self.scheduler.rssfeed_timers.keys()), 6)
+        self.assertEquals(len(self.scheduler.timer_queue), 6)
+
+    def test_timer_queues_rssfeed_update(self):
+        updates = []
+        self.scheduler.queue_rssfeed_update = updates.append
+        self.scheduler.disable_timers()
+        self.rssfeeds["0"]["update_on_startup"] = True
+        self.rssfeeds["1"]["update_on_startup"] = True
+        self.scheduler.enable_timers()
+        # The RSS Feeds updated on startup are run one after the other
+        self.clock.advance(0)
+        self.assertEquals(updates, ["0"])
+        self.clock.advance(self.scheduler.timer_queue.startup_spacing)
+        self.assertEquals(updates, ["0", "1"])
+        self.clock.advance(60)
+        self.assertEquals(updates, ["0", "1", "0"])
+
+    def test_update_run_queue_limits(self):
+        general = self.config.get_config()["general"]
+        general["max_concurrent_feed_updates"] = 7
+        general["max_concurrent_feed_updates_per_host"] = 2
+        self.scheduler.update_run_queue_limits()
+        self.assertEquals(self.scheduler.run_queue.concurrentMax, 7)
+        self.assertEquals(self.scheduler.run_queue.concurrent_max_per_host, 2)
+
+    def test_get_rssfeed_host(self):
+        self.rssfeeds["0"]["url"] = "http://Feeds.Example.com:8080/rss.xml"
+        subscription = yarss2.yarss_config.get_fresh_subscription_config(rssfeed_key="0", key="0")
+        self.config.set_config({"subscriptions": {"0": subscription}})
+        self.assertEquals(self.scheduler.get_rssfeed_host(rssfeed_key="0"), "feeds.example.com")
+        self.assertEquals(self.scheduler.get_rssfeed_host(subscription_key="0"), "feeds.example.com")
+        self.assertEquals(self.scheduler.get_rssfeed_host(rssfeed_key="1"), None)
 
     def test_rssfeed_update_handler(self):
         subscription = yarss2.yarss_config.get_fresh_subscription_config(rssfeed_key="0", key="0")
@@ -114,6 +156,43 @@ class RSSFeedSchedulerTestCase(unittest.TestCase):
         # last_update should not have changed
         self.assertEquals(old_last_update, self.rssfeeds["0"]["last_update"])
 
+    def test_rssfeed_update_config_changes(self):
+        subscription = yarss2.yarss_config.get_fresh_subscription_config(rssfeed_key="0", key="0")
+        self.config.set_config({"subscriptions": {"0": subscription}})
+        self.config.emit_config_changes()
+        self.scheduler.add_torrents_func = lambda *args: None
+        version = self.config.version
+
+        with mock.patch.object(self.config, "emit_config_changes",
+                               wraps=self.config.emit_config_changes) as emit_config_changes:
+            # A timer run without changes worth showing does not send an event
+            self.scheduler.add_torrents_callback(self.scheduler.rssfeed_update_handler("0"))
+            self.assertEquals(emit_config_changes.call_count, 1)
+            self.assertEquals(self.config._emitted_version, version)
+            # The last update time is sent with the next event
+            self.assertEquals(self.config.get_config_changes(version)["changes"],
+                              {"rssfeeds": {"0": self.rssfeeds["0"]}})
+
+            # A manual run of a subscription sends an event
+            self.scheduler.add_torrents_callback(self.scheduler.rssfeed_update_handler(None, "0"))
+            self.assertEquals(self.config._emitted_version, self.config.version)
+
+    def test_rssfeed_update_pipeline_stats(self):
+        subscription = yarss2.yarss_config.get_fresh_subscription_config(rssfeed_key="0", key="0")
+        subscription["regex_include"] = "FreeBSD"
+        self.rssfeeds["0"]["url"] = yarss2.util.common.get_resource(test_common.testdata_rssfeed_filename,
+                                                                    path="tests")
+        self.config.set_config({"rssfeeds": self.rssfeeds, "subscriptions": {"0": subscription}})
+        self.scheduler.add_torrents_func = lambda *args: None
+        stats = PipelineStats()
+
+        with mock.patch("yarss2.rssfeed_scheduler.get_pipeline_stats", return_value=stats):
+            self.scheduler.add_torrents_callback(self.scheduler.rssfeed_update_handler("0"))
+        result = stats.get_stats()
+        for stage in ("download", "decode", "parse", "match", "add_torrents"):
+            self.assertEquals(result["rssfeeds"]["0"][stage]["count"], 1)
+        self.assertEquals(result["subscriptions"]["0"]["match"]["count"], 1)
+
     def test_rssfeed_update_handler_exception(self):
         subscription = yarss2.yarss_config.get_fresh_subscription_config(rssfeed_key="0", key="0")
         self.config.set_config({"subscriptions": {"0": subscription}})
@@ -143,20 +222,90 @@ class RSSFeedSchedulerTestCase(unittest.TestCase):
         self.scheduler.add_torrents_func = add_torrents_pass
 
         # Run the rssfeed with key 0
-        self.scheduler.rssfeed_update_handler("0")
+        args = self.scheduler.rssfeed_update_handler("0")
+        # The timer is rescheduled on the main thread, after the torrents are added
+        self.assertEquals(self.scheduler.get_timer_interval("0"), 30)
+        update_rssfeed_state_func = args[4]
+        update_rssfeed_state_func()
 
         # Verify that update_interval of rssfeed in config was updated
         self.assertEquals(yarss_config.get_config()["rssfeeds"]["0"]["update_interval"], 60)
 
         # Verify that update_interval of the timer was updated
-        self.assertEquals(self.scheduler.rssfeed_timers["0"]["update_interval"], 60)
+        self.assertEquals(self.scheduler.get_timer_interval("0"), 60)
         self.scheduler.disable_timers()
 
+    def test_update_seen_items(self):
+        self.scheduler.seen_items = get_test_seen_items()
+        fetch_result = {"rssfeed_item_ids": ["a", "b", "c"], "rssfeed_newest_date": "2019-10-14T03:10:26+00:00",
+                        "rssfeed_content_hash": "abc",
+                        "matching_torrents": [{"item_id": "a", "torrent_download": TorrentDownload()},
+                                              {"item_id": "b", "torrent_download": TorrentDownload()}]}
+        self.scheduler.update_seen_items("0", fetch_result)
+        self.assertEquals(self.scheduler.seen_items.get_high_water_mark("0"), "2019-10-14T03:10:26+00:00")
+        self.assertEquals(self.scheduler.seen_items.get_content_hash("0"), "abc")
+
+        self.scheduler.seen_items.reset("0")
+        fetch_result["matching_torrents"][1]["torrent_download"].set_error("Failed to add torrent")
+        self.scheduler.update_seen_items("0", fetch_result)
+        # The failed torrent must be tried again on next update
+        self.assertEquals(self.scheduler.seen_items.get_item_ids("0"), ["a", "c"])
+        self.assertEquals(self.scheduler.seen_items.get_high_water_mark("0"), None)
+        self.assertEquals(self.scheduler.seen_items.get_content_hash("0"), None)
+
+    def test_update_seen_items_save_later(self):
+        seen_items = get_test_seen_items()
+        seen_items.saver = ConfigSaver(seen_items.config, delay=5, clock=self.clock)
+        self.scheduler.seen_items = seen_items
+        fetch_result = {"rssfeed_item_ids": ["a"], "matching_torrents": []}
+        for rssfeed_key in ("0", "1"):
+            self.scheduler.update_seen_items(rssfeed_key, fetch_result)
+        # Written once for all the updates, after the delay
+        self.assertTrue(seen_items.saver.dirty)
+        self.assertFalse(os.path.exists(seen_items.config.config_file))
+        self.clock.advance(5)
+        self.assertEquals(seen_items.saver.saves, 1)
+        self.assertTrue(os.path.exists(seen_items.config.config_file))
+
+    def test_update_adaptive_interval(self):
+        self.scheduler.adaptive_intervals = get_test_adaptive_intervals()
+        rssfeed = self.rssfeeds["2"]
+        fetch_result = {"rssfeed_items": {0: {"updated": "2019-10-14T03:10:26+00:00"}}, "matching_torrents": []}
+        # Not enabled
+        self.scheduler.update_adaptive_interval("2", fetch_result)
+        self.assertEquals(self.scheduler.adaptive_intervals.config["rssfeeds"], {})
+
+        rssfeed["adaptive_update_interval"] = True
+        rssfeed["adaptive_update_interval_min"] = 5
+        self.scheduler.update_adaptive_interval("2", fetch_result)
+        self.scheduler.adaptive_intervals.config["rssfeeds"]["2"]["last_update"] -= 60 * 60
+        # Many new items since the last update
+        fetch_result["rssfeed_items"] = dict((i, {"updated": "2019-10-14T04:%02d:00+00:00" % i}) for i in range(60))
+        self.scheduler.update_adaptive_interval("2", fetch_result)
+        self.assertEquals(self.scheduler.get_timer_interval("2"), 5)
+        self.assertEquals(self.scheduler.get_update_interval(rssfeed), 5)
+        self.assertEquals(rssfeed["update_interval"], 10)
+
+    def test_update_adaptive_interval_save_later(self):
+        adaptive_intervals = get_test_adaptive_intervals()
+        adaptive_intervals.saver = ConfigSaver(adaptive_intervals.config, delay=5, clock=self.clock)
+        self.scheduler.adaptive_intervals = adaptive_intervals
+        fetch_result = {"rssfeed_items": {0: {"updated": "2019-10-14T03:10:26+00:00"}}, "matching_torrents": []}
+        for rssfeed_key in ("0", "1"):
+            self.rssfeeds[rssfeed_key]["adaptive_update_interval"] = True
+            self.scheduler.update_adaptive_interval(rssfeed_key, fetch_result)
+        # Written once for all the updates, after the delay
+        self.assertTrue(adaptive_intervals.saver.dirty)
+        self.assertFalse(os.path.exists(adaptive_intervals.config.config_file))
+        self.clock.advance(5)
+        self.assertEquals(adaptive_intervals.saver.saves, 1)
+        self.assertTrue(os.path.exists(adaptive_intervals.config.config_file))
+
     def test_rssfeed_update_queue(self):
         """Tests that the add_torrents_func is called the correct number of times,
         and that add_torrents_func is running in the main thread.
         """
-        # Don't use the loopingcall, so disable just to avoid any trouble
+        # Don't use the timers, so disable just to avoid any trouble
         self.scheduler.disable_timers()
         self.config.set_config(test_common.get_test_config_dict())
 
@@ -169,14 +318,53 @@ class RSSFeedSchedulerTestCase(unittest.TestCase):
             add_torrents_count.append(0)
         self.scheduler.add_torrents_func = add_torrents_cb
 
-        d_first = self.scheduler.queue_rssfeed_update(rssfeed_key="0")
-        self.scheduler.queue_rssfeed_update(subscription_key="1")
-        self.scheduler.queue_rssfeed_update(rssfeed_key="1")
-        d_last = self.scheduler.queue_rssfeed_update(rssfeed_key="2")
+        # The updates may run concurrently, so wait for all of them
+        deferreds = [self.scheduler.queue_rssfeed_update(rssfeed_key="0"),
+                     self.scheduler.queue_rssfeed_update(subscription_key="1"),
+                     self.scheduler.queue_rssfeed_update(rssfeed_key="1"),
+                     self.scheduler.queue_rssfeed_update(rssfeed_key="2")]
 
         def verify_callback_count(args):
             self.assertEquals(len(add_torrents_count), 3)
-        return DeferredList([d_first, d_last]).addBoth(verify_callback_count)
+        return DeferredList(deferreds).addBoth(verify_callback_count)
+
+    def test_rssfeed_update_async(self):
+        """Tests that the RSS Feed and the torrent files are downloaded by the http_client"""
+        self.scheduler.disable_timers()
+        config = test_common.get_test_config_dict()
+        with open(yarss2.util.common.get_resource(test_common.testdata_rssfeed_filename, path="tests"), "rb") as f:
+            feed = f.read()
+        with open(yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent",
+                                                  path="tests/data/"), "rb") as f:
+            filedump = f.read()
+
+        server = HTTPTestServer().start()
+        self.addCleanup(server.stop)
+        self.scheduler.http_client = AsyncHTTPClient(rate_limiter=http.HostRateLimiter(rate=100, burst=100))
+        self.addCleanup(self.scheduler.http_client.close)
+        feed = feed.replace(b"http://torrents.FreeBSD.org:8080/torrents/", server.url("/torrents/").encode())
+        server.routes["/rss.xml"] = (200, {"Content-Type": "application/rss+xml"}, feed)
+        for path in re.findall(br"/torrents/\w+\.torrent", feed):
+            server.routes[path.decode()] = (200, {}, filedump)
+        config["rssfeeds"]["0"]["url"] = server.url("/rss.xml")
+        self.config.set_config(config)
+
+        main_thread = threading.current_thread()
+        added = []
+
+        def add_torrents_cb(save_subscription_func, torrent_list, config):
+            self.assertEquals(main_thread, threading.current_thread())
+            added.extend(torrent_list)
+        self.scheduler.add_torrents_func = add_torrents_cb
+
+        def verify(result):
+            # The subscription matches three items
+            self.assertEquals(len(added), 3)
+            for torrent in added:
+                self.assertTrue(torrent["torrent_download"].success)
+                self.assertEquals(torrent["torrent_download"].filedump, filedump)
+            self.assertEquals(len(server.requests), 4)
+        return self.scheduler.queue_rssfeed_update(rssfeed_key="0").addCallback(verify)
 
 
 class RSSFeedRunQueueTestCase(unittest.TestCase):
@@ -231,3 +419,81 @@ class RSSFeedRunQueueTestCase(unittest.TestCase):
         # Add verify_callback_results to the deferred chain
         d_verify.chainDeferred(d_verify_callback)
         return d_verify
+
+    def test_task_queue_concurrent_max_per_host(self):
+        """Test that RSSFeedRunQueue never runs more jobs than allowed,
+        in total and for each host"""
+        lock = threading.Lock()
+        running = {"total": 0, "max_total": 0}
+        running_hosts = {}
+        max_running_hosts = {}
+
+        def test_run(host):
+            with lock:
+                running["total"] += 1
+                running["max_total"] = max(running["max_total"], running["total"])
+                running_hosts[host] = running_hosts.get(host, 0) + 1
+                max_running_hosts[host] = max(max_running_hosts.get(host, 0), running_hosts[host])
+            time.sleep(0.05)
+            with lock:
+                running["total"] -= 1
+                running_hosts[host] -= 1
+            return host
+
+        taskq = RSSFeedRunQueue(concurrent_max=3, concurrent_max_per_host=1)
+        hosts = ["host1", "host1", "host1", "host2", "host2", "host3", "host4", None, None]
+        deferreds = [taskq.push_host(host, test_run, host) for host in hosts]
+
+        def verify(results):
+            self.assertEquals(hosts, [result for success, result in results])
+            self.assertTrue(running["max_total"] <= 3)
+            self.assertTrue(running["max_total"] > 1)
+            for host in ["host1", "host2", "host3", "host4"]:
+                self.assertEquals(max_running_hosts[host], 1)
+            self.assertEquals(taskq._running, 0)
+            self.assertEquals(taskq._running_per_host, {})
+        return DeferredList(deferreds).addCallback(verify)
+
+    def test_set_concurrent_max_starts_queued_jobs(self):
+        taskq = RSSFeedRunQueue()
+        event = threading.Event()
+        first = taskq.push(event.wait, 5)
+        second = taskq.push(lambda: "second")
+        self.assertEquals(len(taskq._queued), 1)
+        self.assertEquals(taskq.get_state()["queued"], 1)
+
+        # Increasing the limit starts the queued job while the first is still running
+        taskq.set_concurrent_max(2)
+        self.assertEquals(len(taskq._queued), 0)
+        state = taskq.get_state()
+        self.assertEquals(state["running"], 2)
+        # The wait time of the queued job is recorded
+        self.assertEquals(state["wait"]["count"], 2)
+
+        def verify(result):
+            self.assertEquals(result, "second")
+            event.set()
+            return first
+        return second.addCallback(verify)
+
+    def test_push_host_deferred(self):
+        """Jobs returning a Deferred are run on the main thread, and
+        keep the slot of the host until the Deferred has fired"""
+        main_thread = threading.current_thread()
+        taskq = RSSFeedRunQueue(concurrent_max=2, concurrent_max_per_host=1)
+        first = Deferred()
+
+        def job():
+            self.assertEquals(main_thread, threading.current_thread())
+            return first
+        d1 = taskq.push_host_deferred("host1", job)
+        d2 = taskq.push_host_deferred("host1", lambda: "second")
+        d3 = taskq.push_host("host2", lambda: "third")
+        self.assertEquals(len(taskq._queued), 1)
+        first.callback("first")
+        self.assertEquals(len(taskq._queued), 0)
+
+        def verify(results):
+            self.assertEquals([result for success, result in results], ["first", "second", "third"])
+            self.assertEquals(taskq._running, 0)
+        return DeferredList([d1, d2, d3]).addCallback(verify)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import os
+
+from twisted.trial import unittest
+
+import deluge.config
+
+from yarss2 import seen_items
+from yarss2.util import logging
+
+from . import common as test_common
+from .utils.log_utils import plugin_tests_logger_name
+
+log = logging.getLogger(plugin_tests_logger_name)
+
+
+def get_test_seen_items(**kwargs):
+    config_dir = test_common.set_tmp_config_dir()
+    config = deluge.config.Config(seen_items.SEEN_ITEMS_FILENAME, seen_items.default_prefs(), config_dir=config_dir)
+    # By default, the changes are saved immediately
+    kwargs.setdefault("save_delay", 0)
+    return seen_items.SeenItems(log, config=config, **kwargs)
+
+
+class SeenItemsTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.now = 1000
+        self.seen = get_test_seen_items(max_items=3, max_age=100, clock=lambda: self.now)
+
+    def test_add(self):
+        self.seen.add("0", ["a", "b", None])
+        self.assertTrue(self.seen.is_seen("0", "a"))
+        self.assertTrue(self.seen.is_seen("0", "b"))
+        self.assertFalse(self.seen.is_seen("0", None))
+        self.assertFalse(self.seen.is_seen("1", "a"))
+
+    def test_get_unseen_items(self):
+        self.seen.add("0", ["a"])
+        items = {0: {"item_id": "a"}, 1: {"item_id": "b"}, 2: {"title": "no item_id"}}
+        self.assertEquals(self.seen.get_unseen_items("0", items), {1: {"item_id": "b"}, 2: {"title": "no item_id"}})
+
+    def test_evict_least_recently_seen(self):
+        self.seen.add("0", ["a", "b", "c"])
+        self.now += 1
+        # Seeing "a" again makes "b" the least recently seen
+        self.seen.add("0", ["a", "d"])
+        self.assertEquals(self.seen.get_item_ids("0"), ["c", "a", "d"])
+
+    def test_evict_never_current_items(self):
+        self.seen.add("0", ["a", "b", "c", "d", "e"])
+        self.assertEquals(self.seen.get_item_ids("0"), ["a", "b", "c", "d", "e"])
+        self.seen.add("0", ["f"])
+        self.assertEquals(self.seen.get_item_ids("0"), ["d", "e", "f"])
+
+    def test_evict_max_age(self):
+        self.seen.add("0", ["a", "b"])
+        self.now += 101
+        self.seen.add("0", ["b"])
+        self.assertEquals(self.seen.get_item_ids("0"), ["b"])
+
+    def test_high_water_mark(self):
+        self.assertEquals(self.seen.get_high_water_mark("0"), None)
+        self.seen.update_high_water_mark("0", None)
+        self.assertEquals(self.seen.get_high_water_mark("0"), u"")
+        self.seen.update_high_water_mark("0", "2019-10-14T03:10:26+00:00")
+        self.seen.update_high_water_mark("0", "2019-10-13T03:10:26+00:00")
+        self.seen.update_high_water_mark("0", None)
+        self.assertEquals(self.seen.get_high_water_mark("0"), "2019-10-14T03:10:26+00:00")
+        self.seen.clear_high_water_mark("0")
+        self.assertEquals(self.seen.get_high_water_mark("0"), None)
+
+    def test_reset(self):
+        self.seen.add("0", ["a"])
+        self.seen.add("1", ["a"])
+        self.seen.update_high_water_mark("0", None)
+        self.seen.reset("0")
+        self.seen.reset("2")
+        self.assertFalse(self.seen.is_seen("0", "a"))
+        self.assertTrue(self.seen.is_seen("1", "a"))
+        self.assertEquals(self.seen.get_high_water_mark("0"), None)
+
+    def test_save(self):
+        self.seen.add("0", ["a", "b"])
+        self.seen.save()
+        config = deluge.config.Config(seen_items.SEEN_ITEMS_FILENAME, seen_items.default_prefs(),
+                                      config_dir=os.path.dirname(self.seen.config.config_file))
+        self.assertEquals(list(config["rssfeeds"]["0"].keys()), ["a", "b"])
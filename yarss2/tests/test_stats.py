@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+from twisted.trial import unittest
+
+from yarss2.util.stats import PipelineStats, RollingHistogram, timed
+
+
+class StatsTestCase(unittest.TestCase):
+
+    def test_rolling_histogram(self):
+        histogram = RollingHistogram(max_samples=10)
+        self.assertEquals(histogram.get_summary(), {"count": 0, "total": 0.0, "last": None})
+        for value in range(1, 21):
+            histogram.add(value)
+        summary = histogram.get_summary()
+        self.assertEquals(summary["count"], 20)
+        self.assertEquals(summary["total"], 210)
+        self.assertEquals(summary["last"], 20)
+        # Only the last 10 values are used for the mean, max and percentiles
+        self.assertEquals(summary["mean"], 15.5)
+        self.assertEquals(summary["max"], 20)
+        self.assertEquals(summary["p50"], 16)
+        self.assertEquals(summary["p90"], 20)
+        self.assertEquals(summary["p99"], 20)
+
+    def test_pipeline_stats(self):
+        stats = PipelineStats()
+        stats.add_rssfeed_timings("0", {"download": 1.0, "parse": 0.5})
+        stats.add_rssfeed_timings("0", {"download": 3.0})
+        stats.add_rssfeed_timings("1", {"download": 2.0})
+        stats.add_subscription_timings("0", {"match": 0.25})
+        stats.add_rssfeed_counts("0", {"updates": 1, "bytes": 100})
+        stats.add_rssfeed_counts("0", {"updates": 1, "bytes": 50})
+        result = stats.get_stats()
+        self.assertEquals(result["rssfeeds"]["0"]["download"]["count"], 2)
+        self.assertEquals(result["rssfeeds"]["0"]["download"]["mean"], 2.0)
+        self.assertEquals(result["rssfeeds"]["0"]["parse"]["last"], 0.5)
+        self.assertEquals(result["subscriptions"]["0"]["match"]["max"], 0.25)
+        self.assertEquals(result["rssfeed_counts"]["0"], {"updates": 2, "bytes": 150})
+
+        stats.reset(rssfeed_key="0")
+        self.assertEquals(sorted(stats.get_stats()["rssfeeds"].keys()), ["1"])
+        self.assertEquals(stats.get_stats()["rssfeed_counts"], {})
+        stats.reset()
+        self.assertEquals(stats.get_stats(), {"rssfeeds": {}, "subscriptions": {},
+                                              "rssfeed_counts": {}, "subscription_counts": {}})
+
+    def test_timed(self):
+        timings = {}
+        with timed(timings, "parse"):
+            pass
+        first = timings["parse"]
+        self.assertTrue(first >= 0)
+        # The time is added to the earlier time of the stage
+        with self.assertRaises(ValueError):
+            with timed(timings, "parse"):
+                raise ValueError()
+        self.assertTrue(timings["parse"] >= first)
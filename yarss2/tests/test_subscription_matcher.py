@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+import re
+
+from twisted.trial import unittest
+
+import yarss2.yarss_config
+from yarss2.rssfeed_handling import RSSFeedHandler
+from yarss2.subscription_matcher import SubscriptionMatcher, TitlesText, get_required_literal
+from yarss2.util import logging
+
+from . import common as test_common
+from .utils.log_utils import plugin_tests_logger_name
+
+log = logging.getLogger(plugin_tests_logger_name)
+
+
+class SubscriptionMatcherTestCase(unittest.TestCase):
+
+    def test_get_required_literal(self):
+        self.assertEquals(get_required_literal(b"FreeBSD.*amd64"), b"FreeBSD")
+        self.assertEquals(get_required_literal(b"FreeBSD.*amd64", re.IGNORECASE), b"freebsd")
+        self.assertEquals(get_required_literal(b"(?i)FreeBSD"), b"freebsd")
+        self.assertEquals(get_required_literal(b"i386|amd64"), None)
+        self.assertEquals(get_required_literal(b"ab*cd"), b"cd")
+        self.assertEquals(get_required_literal(b"9\\.0-RELEASE"), b"9.0-RELEASE")
+        self.assertEquals(get_required_literal(b"[a-z]+"), None)
+        self.assertEquals(get_required_literal(b"("), None)
+
+    def test_titles_text_find(self):
+        titles_text = TitlesText([b"abc", b"bcd", b"ABC", b"cab"])
+        self.assertEquals(titles_text.find(b"ab"), [0, 3])
+        self.assertEquals(titles_text.find(b"ab", ignorecase=True), [0, 2, 3])
+        # Must not match across the titles
+        self.assertEquals(titles_text.find(b"c\nb"), [0])
+        self.assertEquals(list(titles_text.find(None)), [0, 1, 2, 3])
+        self.assertTrue(titles_text.contains(2, b"abc", ignorecase=True))
+        self.assertFalse(titles_text.contains(2, b"abc"))
+
+    def get_subscription(self, key, regex_include, regex_exclude=None,
+                         include_ignorecase=True, exclude_ignorecase=True):
+        subscription = yarss2.yarss_config.get_fresh_subscription_config(
+            key=key, rssfeed_key="0", regex_include=regex_include, regex_exclude=regex_exclude)
+        subscription["regex_include_ignorecase"] = include_ignorecase
+        subscription["regex_exclude_ignorecase"] = exclude_ignorecase
+        return subscription
+
+    def test_match_same_as_update_rssfeeds_dict_matching(self):
+        items = test_common.load_json_testdata()
+        subscriptions = [
+            self.get_subscription("0", u"FreeBSD.*amd64"),
+            self.get_subscription("1", u"freebsd", include_ignorecase=False),
+            self.get_subscription("2", u"(?i)freebsd.*i386", include_ignorecase=False),
+            self.get_subscription("3", u"RELEASE", regex_exclude=u"amd64|i386"),
+            self.get_subscription("4", u"9\\.0", regex_exclude=u"DVD", exclude_ignorecase=False),
+            self.get_subscription("5", u"sparc64|ia64"),
+            self.get_subscription("6", None),
+            self.get_subscription("7", u"[invalid"),
+        ]
+        matcher = SubscriptionMatcher(subscriptions, log)
+        matches = matcher.match(items)
+        self.assertEquals(len(matches), len(subscriptions))
+
+        handler = RSSFeedHandler(log)
+        for subscription, subscription_matches in zip(subscriptions, matches):
+            expected, message = handler.update_rssfeeds_dict_matching(test_common.load_json_testdata(),
+                                                                      options=subscription)
+            self.assertEquals(list(expected.keys()), list(subscription_matches.keys()))
+        self.assertEquals([len(m) for m in matches], [5, 0, 5, 15, 25, 7, 0, 0])
+        self.assertEquals(matcher.subscriptions[7].message, "Regex: unterminated character set at position 0")
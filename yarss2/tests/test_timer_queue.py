@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2019 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+from twisted.internet import task
+from twisted.trial import unittest
+
+from yarss2.util.timer_queue import TimerQueue
+
+
+class TimerQueueTestCase(unittest.TestCase):
+
+    def setUp(self):  # NOQA
+        self.clock = task.Clock()
+        self.runs = []
+        self.queue = TimerQueue(clock=self.clock, startup_spacing=2, jitter=0)
+
+    def run_timer(self, key):
+        self.runs.append((self.clock.seconds(), key))
+
+    def test_add_periodic(self):
+        self.queue.add("a", 10, self.run_timer)
+        self.assertEquals(self.queue.get_next_due("a"), 10)
+        self.clock.pump([5, 5, 10, 10])
+        self.assertEquals(self.runs, [(10, "a"), (20, "a"), (30, "a")])
+        # Only one delayed call for all the timers
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+
+    def test_startup_staggered(self):
+        for key in "abc":
+            self.queue.add(key, 60, self.run_timer, now=True)
+        self.clock.pump([0, 1, 1, 1, 1])
+        self.assertEquals(self.runs, [(0, "a"), (2, "b"), (4, "c")])
+        self.assertEquals([self.queue.get_next_due(key) for key in "abc"], [60, 62, 64])
+
+    def test_same_interval_spread(self):
+        for key in "abcd":
+            self.queue.add(key, 100, self.run_timer)
+        dues = sorted(self.queue.get_next_due(key) for key in "abcd")
+        # The first timer keeps the full interval, and no two timers are close
+        self.assertEquals(self.queue.get_next_due("a"), 100)
+        self.assertTrue(all(b - a > 10 for a, b in zip(dues, dues[1:])))
+        self.assertTrue(all(0 < due <= 100 for due in dues))
+
+    def test_jitter(self):
+        queue = TimerQueue(clock=self.clock, jitter=0.1, random_func=lambda: 0.5)
+        queue.add("a", 100, self.run_timer)
+        self.assertEquals(queue.get_next_due("a"), 95)
+        queue.clear()
+
+    def test_remove(self):
+        self.queue.add("a", 10, self.run_timer)
+        self.queue.add("b", 30, self.run_timer)
+        self.assertTrue(self.queue.remove("a"))
+        self.assertFalse(self.queue.remove("a"))
+        self.assertFalse("a" in self.queue)
+        self.clock.advance(10)
+        self.assertEquals(self.runs, [])
+        self.assertEquals(self.clock.getDelayedCalls()[0].getTime(), self.queue.get_next_due("b"))
+        self.queue.clear()
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_replace(self):
+        self.queue.add("a", 10, self.run_timer)
+        self.queue.add("a", 60, self.run_timer, now=True)
+        self.assertEquals(len(self.queue), 1)
+        self.clock.pump([0, 10, 50])
+        self.assertEquals(self.runs, [(0, "a"), (60, "a")])
+
+    def test_set_interval(self):
+        self.queue.add("a", 10, self.run_timer)
+        self.clock.advance(10)
+        # Counted from the last run
+        self.assertTrue(self.queue.set_interval("a", 30))
+        self.assertEquals(self.queue.get_next_due("a"), 40)
+        self.assertEquals(self.queue.get_interval("a"), 30)
+        self.assertTrue(self.queue.set_interval("a", 5))
+        self.assertEquals(self.queue.get_next_due("a"), 15)
+        self.clock.advance(3)
+        self.assertTrue(self.queue.set_interval("a", 1))
+        # The time has passed, so run as soon as possible
+        self.assertEquals(self.queue.get_next_due("a"), 13)
+        self.clock.advance(0)
+        self.assertEquals(self.runs, [(10, "a"), (13, "a")])
+        self.assertFalse(self.queue.set_interval("b", 5))
+
+    def test_missed_runs_skipped(self):
+        self.queue.add("a", 10, self.run_timer)
+        self.clock.advance(35)
+        self.assertEquals(self.runs, [(35, "a")])
+        self.assertEquals(self.queue.get_next_due("a"), 45)
+
+    def test_exception_does_not_stop_timers(self):
+        def fail(key):
+            raise Exception("Timer failed")
+        self.queue.add("a", 10, fail)
+        self.queue.add("b", 10, self.run_timer, now=True)
+        self.clock.advance(0)
+        self.queue.add("b", 10, self.run_timer)
+        self.clock.advance(10)
+        self.clock.advance(10)
+        self.assertEquals(self.runs, [(0, "b"), (10, "b"), (20, "b")])
+        self.assertTrue("a" in self.queue)
@@ -9,21 +9,27 @@
 
 import datetime
 import os.path
+import threading
+import time
 from unittest import mock
 
-import requests
 from twisted.trial import unittest
 
 from deluge.error import AddTorrentError
 
 import yarss2.torrent_handling
 import yarss2.util.common
-from yarss2.torrent_handling import TorrentDownload, TorrentHandler
+import yarss2.util.http
+import yarss2.util.torrentinfo
+from yarss2.torrent_handling import SessionInfohashes, TorrentDownload, TorrentDownloadCache, TorrentHandler
 from yarss2.util import logging
+from yarss2.util.async_http import AsyncHTTPClient
 from yarss2.util.common import GeneralSubsConf, read_file
+from yarss2.util.torrentinfo import ParsedTorrent
 
 from . import common as test_common
 from . import test_torrent_handling
+from .utils.helpers import HTTPTestServer
 from .utils.log_utils import plugin_tests_logger_name
 
 test_component = None
@@ -71,6 +77,15 @@ class TestComponent(object):
     def get_enabled_plugins(self):
         return []
 
+    def get_torrent_list(self):
+        return [download.torrent_id for download in self.added if download.torrent_id]
+
+    def register_event_handler(self, event, handler):
+        pass
+
+    def deregister_event_handler(self, event, handler):
+        pass
+
 # When replacing component with test_component in modules,
 # This is called e.g. when this is executed: component.get("TorrentManager")
 # we ignore the key, and return the test component
@@ -88,7 +103,8 @@ yarss2.torrent_handling.component = test_torrent_handling
 def get_file(url, cookies={}, headers={}, verify=True):
 
     class Request(object):
-        pass
+        status_code = 200
+        headers = {}
     r = Request
     try:
         r.content = read_file(url)
@@ -97,7 +113,14 @@ def get_file(url, cookies={}, headers={}, verify=True):
     return r
 
 
-requests.get = get_file
+class FileSessionPool(object):
+    """Replaces the HTTPSessionPool used by TorrentHandler to read the torrent files from disk"""
+
+    def get(self, url, **kwargs):
+        return get_file(url, **kwargs)
+
+
+yarss2.util.http._session_pool = FileSessionPool()
 
 
 class TorrentHandlingTestCase(unittest.TestCase):
@@ -165,7 +188,8 @@ class TorrentHandlingTestCase(unittest.TestCase):
         subscription_data["download_location"] = "download/path"
         subscription_data["add_torrents_in_paused_state"] = GeneralSubsConf.DEFAULT
 
-        download = TorrentDownload()
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        download = TorrentDownload({"filedump": read_file(filename)})
         torrent_info = {"link": "http://url.com/file.torrent",
                         "site_cookies_dict": {},
                         "subscription_data": subscription_data,
@@ -193,12 +217,261 @@ class TorrentHandlingTestCase(unittest.TestCase):
         self.assertEquals(download.cookies, {'cookiekey': 'cookievalue'})
         self.assertFalse(download.is_magnet)
 
+    def test_download_torrent_file_too_many_requests(self):
+        limiter = yarss2.util.http.HostRateLimiter()
+        handler = TorrentHandler(self.log, session_pool=yarss2.util.http.HTTPSessionPool(), rate_limiter=limiter)
+        with HTTPTestServer(routes={"/file.torrent": (429, {}, b"Too many requests")}) as server:
+            download = handler.download_torrent_file(server.url("/file.torrent"))
+            self.assertFalse(download.success)
+            self.assertEquals(limiter.get_state()["127.0.0.1"]["throttled"], 1)
+            # Not requested again during the backoff
+            download = handler.download_torrent_file(server.url("/file.torrent"))
+            self.assertFalse(download.success)
+            self.assertTrue("Too many requests" in download.error_msg)
+            self.assertEquals(1, len(server.requests))
+        handler.session_pool.close()
+
+    def test_get_torrent_parsed_torrent(self):
+        handler = TorrentHandler(self.log)
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        download = handler.get_torrent({"link": filename})
+        parsed_torrent = download.parsed_torrent
+        self.assertEquals(parsed_torrent.name, "FreeBSD-9.0-RELEASE-amd64-dvd1")
+        self.assertEquals(parsed_torrent.size, 2388531200)
+        self.assertEquals(parsed_torrent.files, [("FreeBSD-9.0-RELEASE-amd64-dvd1/FreeBSD-9.0-RELEASE-amd64-dvd1.iso",
+                                                  2388531200)])
+        self.assertEquals(download.infohash, parsed_torrent.infohash)
+        # Not sent over RPC
+        download_dict = download.to_dict()
+        self.assertEquals(download_dict["parsed_torrent"], None)
+
+        # The torrent file is not decoded again when adding the torrent
+        with mock.patch.object(yarss2.util.torrentinfo, "ParsedTorrent") as parsed_torrent_mock:
+            handler.add_torrent({"link": filename, "torrent_download": download})
+            self.assertFalse(parsed_torrent_mock.called)
+        self.assertEquals(test_component.added.pop().filedump, download.filedump)
+
+        # Downloads sent over RPC are decoded again
+        download = TorrentDownload(download_dict)
+        self.assertTrue(handler.add_torrent({"link": filename, "torrent_download": download}).success)
+        self.assertEquals(download.parsed_torrent.infohash, parsed_torrent.infohash)
+
     def test_get_torrent_magnet(self):
         handler = TorrentHandler(self.log)
         torrent_info = {"link": "magnet:hash"}
         download = handler.get_torrent(torrent_info)
         self.assertTrue(download.is_magnet)
 
+    def test_get_torrents(self):
+        handler = TorrentHandler(self.log)
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def get_torrent(torrent_info):
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            # The first torrents finish last
+            time.sleep(0.01 * (10 - torrent_info["index"]))
+            with lock:
+                running["current"] -= 1
+            return torrent_info["index"]
+
+        handler.get_torrent = get_torrent
+        torrent_list = [{"index": i} for i in range(10)]
+        downloads = handler.get_torrents(torrent_list, max_workers=3)
+        self.assertEquals(downloads, list(range(10)))
+        self.assertEquals(running["max"], 3)
+        self.assertEquals(handler.get_torrents([], max_workers=3), [])
+
+    def test_torrent_download_cache(self):
+        now = [0]
+        cache = TorrentDownloadCache(ttl=60, clock=lambda: now[0])
+        download = TorrentDownload({"url": "http://url.com/file 1.torrent", "infohash": "abc"})
+        self.assertTrue(cache.add(download) is download)
+        # The URLs are normalized
+        self.assertTrue(cache.get("http://url.com/file%201.torrent") is download)
+        # The download of the same torrent from another URL is replaced by the cached download
+        other = TorrentDownload({"url": "http://mirror.com/file.torrent", "infohash": "abc"})
+        self.assertTrue(cache.add(other) is download)
+        self.assertTrue(cache.get("http://mirror.com/file.torrent") is download)
+        # Failed downloads are not cached
+        failed = TorrentDownload({"url": "http://url.com/failed.torrent"})
+        failed.set_error("Failed")
+        self.assertTrue(cache.add(failed) is failed)
+        self.assertEquals(cache.get("http://url.com/failed.torrent"), None)
+
+        now[0] = 60
+        self.assertEquals(cache.get("http://url.com/file 1.torrent"), None)
+        self.assertEquals(len(cache), 0)
+        self.assertTrue(cache.add(other) is other)
+
+    def get_cache_test_handler(self):
+        session_infohashes = SessionInfohashes()
+        session_infohashes.enable()
+        handler = TorrentHandler(self.log, session_infohashes=session_infohashes)
+        handler.download_torrent_file = test_component.download_torrent_file
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        test_component.use_filedump = read_file(filename)
+        return handler
+
+    def test_get_torrents_cache(self):
+        handler = self.get_cache_test_handler()
+        cache = TorrentDownloadCache()
+        torrent_list = [{"link": "http://url.com/file.torrent"}, {"link": "http://url.com/file.torrent"},
+                        {"link": "magnet:?xt=urn:btih:ABC"}]
+        downloads = handler.get_torrents(torrent_list, max_workers=2, cache=cache)
+        self.assertEquals(len(test_component.downloads), 1)
+        # Each match has its own copy of the download
+        self.assertFalse(downloads[0] is downloads[1])
+        self.assertEquals(downloads[0].filedump, downloads[1].filedump)
+        self.assertEquals(downloads[2].infohash, "abc")
+
+        # Matched again, e.g. in another RSS Feed
+        downloads += handler.get_torrents(torrent_list[:1], cache=cache)
+        self.assertEquals(len(test_component.downloads), 1)
+
+        # The torrent is added only once
+        results = []
+        for torrent_info, download in zip(torrent_list[:2] + torrent_list[:1], downloads[:2] + downloads[3:]):
+            results.append(handler.add_torrent({"link": torrent_info["link"], "torrent_download": download}))
+        self.assertEquals(len(test_component.added), 1)
+        self.assertTrue(results[0].success)
+        self.assertEquals([result.duplicate for result in results], [False, True, True])
+        # The cached download is not changed
+        download = cache.get("http://url.com/file.torrent")
+        self.assertTrue(download.success)
+        self.assertEquals(download.torrent_id, None)
+
+    def test_get_torrents_cache_removed_torrent(self):
+        handler = self.get_cache_test_handler()
+        cache = TorrentDownloadCache()
+        torrent_info = {"link": "http://url.com/file.torrent"}
+        download = handler.get_torrents([torrent_info], cache=cache)[0]
+        self.assertTrue(handler.add_torrent({"link": torrent_info["link"], "torrent_download": download}).success)
+
+        # The user removed the torrent, and a later update matches it again
+        handler.session_infohashes.on_torrent_removed_event(download.infohash)
+        download = handler.get_torrents([torrent_info], cache=cache)[0]
+        self.assertEquals(cache.hits, 1)
+        result = handler.add_torrent({"link": torrent_info["link"], "torrent_download": download})
+        self.assertTrue(result.success)
+        self.assertFalse(result.duplicate)
+        self.assertEquals(len(test_component.added), 2)
+
+    def test_get_torrents_cache_add_failed(self):
+        handler = self.get_cache_test_handler()
+        cache = TorrentDownloadCache()
+        torrent_info = {"link": "http://url.com/file.torrent"}
+        download = handler.get_torrents([torrent_info], cache=cache)[0]
+        with mock.patch.object(TestComponent, "add") as test_component_add:
+            test_component_add.side_effect = AddTorrentError("Failed")
+            result = handler.add_torrent({"link": torrent_info["link"], "torrent_download": download})
+            self.assertFalse(result.success)
+
+        # Tried again on the next update
+        download = handler.get_torrents([torrent_info], cache=cache)[0]
+        self.assertEquals(cache.hits, 1)
+        self.assertTrue(download.success)
+        result = handler.add_torrent({"link": torrent_info["link"], "torrent_download": download})
+        self.assertTrue(result.success)
+        self.assertEquals(len(test_component.added), 1)
+
+    def test_get_torrents_cache_percent_encoded_link(self):
+        handler = TorrentHandler(self.log)
+        handler.download_torrent_file = test_component.download_torrent_file
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        test_component.use_filedump = read_file(filename)
+        cache = TorrentDownloadCache()
+        link = "http://url.com/download.php?id=1%2B2&name=a%20b+c.torrent"
+        # Matched in two updates of the RSS Feed
+        first = handler.get_torrents([{"link": link}], cache=cache)
+        second = handler.get_torrents([{"link": link}], cache=cache)
+        self.assertEquals(len(test_component.downloads), 1)
+        self.assertEquals(first[0].filedump, second[0].filedump)
+        self.assertEquals(cache.hits, 1)
+
+    def test_session_infohashes(self):
+        session_infohashes = SessionInfohashes()
+        session_infohashes.add("ABC")
+        # Not in the session before enabled
+        self.assertFalse("abc" in session_infohashes)
+        session_infohashes.enable()
+        session_infohashes.on_torrent_added_event("ABC")
+        self.assertTrue("abc" in session_infohashes)
+        session_infohashes.on_torrent_removed_event("abc")
+        self.assertFalse("ABC" in session_infohashes)
+        self.assertFalse(None in session_infohashes)
+
+    def test_get_torrent_in_session(self):
+        session_infohashes = SessionInfohashes()
+        session_infohashes.enable()
+        handler = TorrentHandler(self.log, session_infohashes=session_infohashes)
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        infohash = ParsedTorrent(read_file(filename)).infohash
+        session_infohashes.on_torrent_added_event(infohash)
+
+        # The infohash of the item in the RSS Feed, or of the magnet link, is in the session
+        for torrent_info in ({"link": "http://url.com/file.torrent", "infohash": infohash.upper()},
+                             {"link": "magnet:?xt=urn:btih:%s" % infohash}):
+            download = handler.get_torrent(torrent_info)
+            self.assertEquals(download.torrent_id, infohash)
+            self.assertEquals(download.filedump, None)
+            torrent_info["torrent_download"] = download
+            self.assertTrue(handler.add_torrent(torrent_info).duplicate)
+
+        # The infohash of the downloaded torrent file is in the session
+        download = handler.add_torrent({"link": filename})
+        self.assertFalse(download.success)
+        self.assertTrue(download.duplicate)
+        self.assertTrue(download.filedump is not None)
+        self.assertEquals(download.torrent_id, infohash)
+        self.assertEquals(test_component.added, [])
+
+    def test_get_torrents_async(self):
+        limiter = yarss2.util.http.HostRateLimiter(rate=100, burst=100)
+        client = AsyncHTTPClient(rate_limiter=limiter)
+        handler = TorrentHandler(self.log, rate_limiter=limiter)
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        routes = {"/file.torrent": (200, {}, read_file(filename)),
+                  "/invalid.torrent": (200, {}, b"Not a torrent"),
+                  "/throttled.torrent": (429, {}, b"Too many requests")}
+        server = HTTPTestServer(routes=routes).start()
+        self.addCleanup(server.stop)
+        self.addCleanup(client.close)
+        torrent_list = [{"link": server.url("/file.torrent"), "site_cookies_dict": {"cookiekey": "cookievalue"},
+                         "user_agent": "test"},
+                        {"link": server.url("/invalid.torrent")},
+                        {"link": server.url("/throttled.torrent")},
+                        {"link": "magnet:hash"}]
+
+        def verify(downloads):
+            self.assertEquals([download.success for download in downloads], [True, False, False, True])
+            self.assertEquals(downloads[0].filedump, read_file(filename))
+            self.assertEquals(server.requests[0][1]["Cookie"], "cookiekey=cookievalue")
+            self.assertEquals(server.requests[0][1]["User-Agent"], "test")
+            self.assertTrue("Unable to decode torrent file" in downloads[1].error_msg)
+            self.assertTrue("HTTP status 429" in downloads[2].error_msg)
+            self.assertTrue(downloads[3].is_magnet)
+        return handler.get_torrents_async(torrent_list, client).addCallback(verify)
+
+    def test_get_torrent_async_url_fixed_once(self):
+        limiter = yarss2.util.http.HostRateLimiter(rate=100, burst=100)
+        client = AsyncHTTPClient(rate_limiter=limiter)
+        handler = TorrentHandler(self.log, rate_limiter=limiter)
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        server = HTTPTestServer().start()
+        self.addCleanup(server.stop)
+        self.addCleanup(client.close)
+        # Fixed once with url_fix, like the torrent files downloaded in a thread (see get_torrent)
+        server.routes["/file%20name.torrent?name=a%2Bb"] = (200, {}, read_file(filename))
+
+        def verify(download):
+            self.assertTrue(download.success)
+            self.assertEquals([path for path, headers in server.requests], ["/file%20name.torrent?name=a%2Bb"])
+        return handler.get_torrent_async({"link": server.url("/file%20name.torrent?name=a+b")},
+                                         client).addCallback(verify)
+
     def get_test_rssfeeds_match_dict(self):
         match_option_dict = {}
         match_option_dict["regex_include"] = ""
@@ -235,6 +508,33 @@ class TorrentHandlingTestCase(unittest.TestCase):
         self.assertEquals(len(saved_subscriptions), 3)
         handler.use_filedump = None
 
+    def test_add_torrents_duplicate(self):
+        session_infohashes = SessionInfohashes()
+        session_infohashes.enable()
+        handler = TorrentHandler(self.log, session_infohashes=session_infohashes)
+        filename = yarss2.util.common.get_resource("FreeBSD-9.0-RELEASE-amd64-dvd1.torrent", path="tests/data/")
+        session_infohashes.on_torrent_added_event(ParsedTorrent(read_file(filename)).infohash)
+
+        config = self.config.get_config()
+        config["email_configurations"]["send_email_on_torrent_events"] = True
+        config["email_messages"]["0"] = {"active": True}
+        subscription_data = yarss2.yarss_config.get_fresh_subscription_config()
+        subscription_data["email_notifications"] = {"0": {"on_torrent_added": True}}
+        last_match = subscription_data["last_match"]
+        torrent_match = {"title": "FreeBSD", "link": filename, "subscription_data": subscription_data,
+                         "updated_datetime": datetime.datetime.now(datetime.timezone.utc)}
+        saved_subscriptions = []
+
+        def save_subscription_func(subscription_data):
+            saved_subscriptions.append(subscription_data)
+
+        with mock.patch.object(yarss2.torrent_handling, "send_torrent_email") as send_torrent_email:
+            handler.add_torrents(save_subscription_func, [torrent_match], config)
+            self.assertFalse(send_torrent_email.called)
+        self.assertEquals(test_component.added, [])
+        self.assertEquals(saved_subscriptions, [])
+        self.assertEquals(subscription_data["last_match"], last_match)
+
 ####################################
 # Helper methods for test data
 ####################################
@@ -7,11 +7,13 @@
 # See LICENSE for more details.
 #
 import shutil
+from unittest import mock
 
 from twisted.trial import unittest
 
 import yarss2.util.common
 import yarss2.yarss_config
+from yarss2.util import http
 from yarss2.util.common import GeneralSubsConf
 
 from . import common as test_common
@@ -216,6 +218,77 @@ class ConfigTestCase(unittest.TestCase):
         self.assertTrue(yarss2.yarss_config.DUMMY_RSSFEED_KEY in test_feeds)
         self.assertTrue("default_email_to_address" in self.config.config["email_configurations"])
 
+    def test_verify_config_general(self):
+        self.config.config["general"] = {"show_log_in_gui": False}
+        self.config._verify_config()
+        general = self.config.config["general"]
+        # Existing value is kept
+        self.assertFalse(general["show_log_in_gui"])
+        self.assertEquals(general["max_concurrent_feed_updates"],
+                          yarss2.yarss_config.DEFAULT_MAX_CONCURRENT_FEED_UPDATES)
+        self.assertEquals(general["max_concurrent_feed_updates_per_host"],
+                          yarss2.yarss_config.DEFAULT_MAX_CONCURRENT_FEED_UPDATES_PER_HOST)
+
+    def test_get_config_changes(self):
+        self.config.config["rssfeeds"] = test_common.get_default_rssfeeds(2)
+        version = self.config.version
+        self.assertTrue("config" in self.config.get_config_changes())
+
+        rssfeed = yarss2.yarss_config.get_fresh_rssfeed_config(key="2")
+        self.config.generic_save_config("rssfeeds", data_dict=rssfeed)
+        self.config.generic_save_config("rssfeeds", dict_key="0", delete=True)
+        self.config.set_config({"general": {"show_log_in_gui": False}})
+        changes = self.config.get_config_changes(version)
+        self.assertEquals(changes["version"], version + 3)
+        self.assertFalse("config" in changes)
+        # Only the changed elements and sections
+        self.assertEquals(changes["changes"], {"rssfeeds": {"2": rssfeed, "0": None}})
+        self.assertEquals(changes["sections"], {"general": {"show_log_in_gui": False}})
+        self.assertEquals(self.config.get_config_changes(changes["version"])["changes"], {})
+
+        # The changes after an unknown version are not known
+        self.assertTrue("config" in self.config.get_config_changes(changes["version"] + 1))
+        for i in range(yarss2.yarss_config.CONFIG_CHANGES_MAX):
+            self.config.mark_changed("rssfeeds", "2")
+        self.assertTrue("config" in self.config.get_config_changes(version))
+
+    def test_get_config_changes_before_start(self):
+        version = self.config.version
+        self.config.mark_changed("rssfeeds", "0")
+        # A client connected to an earlier daemon process, the changes made by it are not known
+        changes = self.config.get_config_changes(version - 1)
+        self.assertTrue("config" in changes)
+        self.assertEquals(changes["version"], version + 1)
+        self.assertFalse("config" in self.config.get_config_changes(version))
+
+    def test_save_cookie_invalidates_cookie_index(self):
+        cookie = yarss2.yarss_config.get_fresh_cookie_config()
+        cookie["site"] = "example.com"
+        cookie["value"] = {"key": "value"}
+        cookies = self.config.get_config()["cookies"]
+        self.assertEquals(http.get_cookie_index(cookies).get_cookies_dict("example.com"), {})
+        self.config.generic_save_config("cookies", data_dict=cookie)
+        self.assertEquals(http.get_cookie_index(cookies).get_cookies_dict("example.com"), {"key": "value"})
+
+    def test_emit_config_changes(self):
+        events = []
+        event_manager = mock.Mock()
+        event_manager.emit.side_effect = events.append
+        with mock.patch("deluge.component.get", return_value=event_manager):
+            # Nothing to send
+            self.assertFalse(self.config.emit_config_changes())
+            self.config.mark_changed("rssfeeds", "0", notify=False)
+            self.assertFalse(self.config.emit_config_changes())
+            self.config.set_config({"general": {"show_log_in_gui": False}})
+            self.assertTrue(self.config.emit_config_changes())
+            self.assertFalse(self.config.emit_config_changes())
+        self.assertEquals(len(events), 1)
+        changes = events[0]._args[0]
+        self.assertEquals(changes["version"], self.config.version)
+        # The change that did not notify is sent with the next event
+        self.assertEquals(changes["changes"], {"rssfeeds": {"0": None}})
+        self.assertEquals(changes["sections"], {"general": {"show_log_in_gui": False}})
+
     def test_update_config_to_version4(self):
         # default_subscription = yarss2.yarss_config.get_fresh_subscription_config()
         # Create 2 feeds
@@ -274,6 +347,28 @@ class ConfigTestCase(unittest.TestCase):
         self.assertTrue("pass" in values)
         self.assertEquals(values["pass"], "3421d1a00b48397a874454626decec04")
 
+    def test_update_config_to_version10(self):
+        test_feeds = test_common.get_default_rssfeeds(2)
+        for rssfeed in test_feeds.values():
+            for key in ("etag", "modified", "adaptive_update_interval",
+                        "adaptive_update_interval_min", "adaptive_update_interval_max"):
+                del rssfeed[key]
+        config = {"general": {"show_log_in_gui": True}, "rssfeeds": test_feeds}
+
+        self.config.update_config_to_version10(config)
+
+        general = config["general"]
+        self.assertTrue(general["show_log_in_gui"])
+        self.assertEquals(general["max_concurrent_feed_updates"],
+                          yarss2.yarss_config.DEFAULT_MAX_CONCURRENT_FEED_UPDATES)
+        self.assertEquals(general["max_concurrent_feed_updates_per_host"],
+                          yarss2.yarss_config.DEFAULT_MAX_CONCURRENT_FEED_UPDATES_PER_HOST)
+        self.assertEquals(general["max_concurrent_torrent_downloads"],
+                          yarss2.yarss_config.DEFAULT_MAX_CONCURRENT_TORRENT_DOWNLOADS)
+        for rssfeed in test_feeds.values():
+            self.assertEquals(rssfeed["etag"], "")
+            self.assertFalse(rssfeed["adaptive_update_interval"])
+
     def test_update_config_file_to_version2(self):
         config_file = "yarss2_v1.conf"
         filename = yarss2.util.common.get_resource(config_file, path="tests/data/")
@@ -2,7 +2,16 @@ from __future__ import print_function
 
 import os
 import shutil
+import socket
 import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 
 from yarss2.util import logging
 
@@ -101,3 +110,72 @@ class TempDir(object):
             return "temporary directory at: %s%s" % (self.name, " (id: %s)" % self.id)
         else:
             return "dissolved temporary directory"
+
+
+class HTTPTestServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server running in a separate thread, used for testing HTTP requests.
+
+    Responses are looked up by the request path in the dict 'routes', where each value is a
+    tuple (status, headers, body) or a callable taking the request handler and returning such a tuple.
+    All the received requests are stored in 'requests' as tuples (path, headers), and
+    'connection_count' holds the number of TCP connections that have been opened.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, routes=None):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), HTTPTestRequestHandler)
+        self.routes = routes if routes is not None else {}
+        self.requests = []
+        self.connection_count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def url(self, path="/"):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *errstuff):
+        self.stop()
+
+
+class HTTPTestRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately, so avoid the delayed ACK on kept alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_GET(self):  # noqa: N802
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers.items())))
+        response = self.server.routes.get(self.path, (404, {}, b"Not found"))
+        if callable(response):
+            response = response(self)
+        status, headers, body = response
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("HTTPTestServer: " + format % args, gtkui=False)
@@ -8,23 +8,182 @@
 #
 
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+from twisted.internet import defer
 
 import deluge.component as component
-from deluge._libtorrent import lt
 from deluge.core.torrent import TorrentOptions
 from deluge.error import AddTorrentError
 
+from yarss2.error import RateLimitError
+from yarss2.rssfeed_handling import get_magnet_infohash
 from yarss2.util import common, http, torrentinfo
 from yarss2.util.common import GeneralSubsConf, TorrentDownload
 from yarss2.util.yarss_email import send_torrent_email
 
 
+_session_infohashes = None
+
+
+def get_torrent_cache_key(url):
+    """Returns the key of the torrent URL in the TorrentDownloadCache"""
+    if url.startswith("magnet:"):
+        return url
+    return http.url_fix(url)
+
+
+class TorrentDownloadCache(object):
+    """
+    The successful torrent downloads, keyed by the torrent URL and by the infohash.
+
+    When several subscriptions match the same item, or the same torrent is found in
+    several RSS Feeds, the torrent file is downloaded once, and each match gets a copy
+    of the TorrentDownload (see TorrentHandler.get_torrents), so adding the torrent does
+    not change the cached download. Whether the torrent has already been added is found
+    with the SessionInfohashes, so a torrent removed from the session is added again.
+
+    ttl: Seconds the downloads are kept. If None, they are kept as long as the cache,
+    e.g. for one update of an RSS Feed.
+    """
+
+    def __init__(self, ttl=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (TorrentDownload, expire time), in the order they were added
+        self._downloads = OrderedDict()
+        # infohash -> TorrentDownload
+        self._infohashes = {}
+        self.hits = 0
+
+    def get(self, url):
+        """Returns the TorrentDownload of the URL, or None if not in the cache"""
+        with self._lock:
+            self._expire()
+            entry = self._downloads.get(get_torrent_cache_key(url), None)
+            if entry is None:
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def add(self, download, url=None):
+        """Add the download of url (default download.url) to the cache, unless it failed.
+        Returns the TorrentDownload to use for the URL, which is the cached download of the
+        same infohash if the torrent has already been downloaded from another URL"""
+        if not download.success:
+            return download
+        key = get_torrent_cache_key(url or download.url)
+        with self._lock:
+            self._expire()
+            infohash = download.get("infohash", None)
+            if infohash and infohash in self._infohashes:
+                self.hits += 1
+                download = self._infohashes[infohash]
+            elif infohash:
+                self._infohashes[infohash] = download
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._downloads.pop(key, None)
+            self._downloads[key] = (download, expires)
+            return download
+
+    def __len__(self):
+        return len(self._downloads)
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        now = self.clock()
+        while self._downloads:
+            key, (download, expires) = next(iter(self._downloads.items()))
+            if expires > now:
+                break
+            del self._downloads[key]
+            infohash = download.get("infohash", None)
+            if self._infohashes.get(infohash, None) is download:
+                del self._infohashes[infohash]
+
+
+class SessionInfohashes(object):
+    """
+    The infohashes of the torrents in the Deluge session, kept up to date with the
+    TorrentAddedEvent and TorrentRemovedEvent. Used to skip downloading and adding
+    the torrents that are already in the session.
+
+    The infohashes are loaded and the events handled after enable() has been
+    called on the main thread, until then no torrent is in the session.
+    The infohashes may be looked up from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._infohashes = set()
+        self.enabled = False
+
+    def enable(self):
+        infohashes = set(str(torrent_id).lower() for torrent_id in
+                         component.get("TorrentManager").get_torrent_list())
+        with self._lock:
+            self._infohashes = infohashes
+        event_manager = component.get("EventManager")
+        event_manager.register_event_handler("TorrentAddedEvent", self.on_torrent_added_event)
+        event_manager.register_event_handler("TorrentRemovedEvent", self.on_torrent_removed_event)
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        event_manager = component.get("EventManager")
+        event_manager.deregister_event_handler("TorrentAddedEvent", self.on_torrent_added_event)
+        event_manager.deregister_event_handler("TorrentRemovedEvent", self.on_torrent_removed_event)
+        with self._lock:
+            self._infohashes = set()
+        self.enabled = False
+
+    def add(self, infohash):
+        if infohash and self.enabled:
+            with self._lock:
+                self._infohashes.add(infohash.lower())
+
+    def on_torrent_added_event(self, torrent_id, from_state=False):
+        self.add(torrent_id)
+
+    def on_torrent_removed_event(self, torrent_id):
+        with self._lock:
+            self._infohashes.discard(torrent_id.lower())
+
+    def __contains__(self, infohash):
+        if not infohash:
+            return False
+        with self._lock:
+            return infohash.lower() in self._infohashes
+
+    def __len__(self):
+        return len(self._infohashes)
+
+
+def get_session_infohashes():
+    """Returns the SessionInfohashes of the Deluge session"""
+    global _session_infohashes
+    if _session_infohashes is None:
+        _session_infohashes = SessionInfohashes()
+    return _session_infohashes
+
+
 class TorrentHandler(object):
 
-    def __init__(self, logger):
+    def __init__(self, logger, session_pool=None, rate_limiter=None, session_infohashes=None):
         self.log = logger
+        # The HTTP sessions used to download torrent files
+        self.session_pool = session_pool if session_pool is not None else http.get_session_pool()
+        # Limits the requests to each host, shared with the RSS Feed fetches
+        self.rate_limiter = rate_limiter if rate_limiter is not None else http.get_rate_limiter()
+        # The torrents already in the session are not downloaded or added
+        self.session_infohashes = session_infohashes if session_infohashes is not None \
+            else get_session_infohashes()
 
     def listen_on_torrent_finished(self, enable=True):
         component.get("EventManager").register_event_handler("TorrentFinishedEvent", self.on_torrent_finished_event)
@@ -40,14 +199,22 @@ class TorrentHandler(object):
             args["headers"] = headers
         download.headers = headers
         try:
-            r = requests.get(torrent_url, **args)
+            self.rate_limiter.acquire(torrent_url)
+            start = time.perf_counter()
+            r = self.session_pool.get(torrent_url, **args)
+            download.download_time = time.perf_counter() - start
+            self.rate_limiter.update(torrent_url, r.status_code, r.headers)
+            if r.status_code in http.THROTTLED_STATUS_CODES:
+                raise RateLimitError("Server responded with HTTP status %d" % r.status_code)
             download.filedump = r.content
         except Exception as e:
             error_msg = "Failed to download torrent url: '%s'. Exception: %s" % (torrent_url, str(e))
             self.log.error(error_msg)
             download.set_error(error_msg)
             return download
+        return self._verify_torrent_file(download)
 
+    def _verify_torrent_file(self, download):
         if download.filedump is None:
             error_msg = "Filedump is None"
             download.set_error(error_msg)
@@ -55,44 +222,152 @@ class TorrentHandler(object):
             return download
 
         try:
-            # Get the info to see if any exceptions are raised
-            lt.torrent_info(lt.bdecode(download.filedump))
-        except Exception as e:
-            error_msg = "Unable to decode torrent file! (%s) URL: '%s'" % (str(e), torrent_url)
+            # Decoded only here, the ParsedTorrent is reused when adding the torrent
+            download.parsed_torrent = torrentinfo.ParsedTorrent(download.filedump)
+            download.infohash = download.parsed_torrent.infohash
+        except ValueError as e:
+            error_msg = "Unable to decode torrent file! (%s) URL: '%s'" % (str(e), download.url)
             download.set_error(error_msg)
             self.log.error(error_msg)
         return download
 
-    def get_torrent(self, torrent_info):
-        url = torrent_info["link"]
-        site_cookies_dict = torrent_info.get("site_cookies_dict", None)
-        download = None
+    def _get_request_headers(self, torrent_info):
         headers = {}
         user_agent = torrent_info.get("user_agent", None)
-
         if user_agent:
             headers["User-Agent"] = user_agent
+        return headers
+
+    def _get_session_torrent(self, torrent_info):
+        """Returns a TorrentDownload with the torrent_id of the torrent if the infohash
+        of the item in the RSS Feed, or of the magnet link, is already in the session"""
+        url = torrent_info["link"]
+        infohash = torrent_info.get("infohash", None)
+        if not infohash and url.startswith("magnet:"):
+            infohash = get_magnet_infohash(url)
+        if infohash not in self.session_infohashes:
+            return None
+        self.log.info("Not downloading '%s', the torrent is already in the session.", url, gtkui=False)
+        return TorrentDownload({"url": url, "is_magnet": url.startswith("magnet:"),
+                                "infohash": infohash.lower(), "torrent_id": infohash.lower()})
+
+    def get_torrent(self, torrent_info):
+        url = torrent_info["link"]
+        site_cookies_dict = torrent_info.get("site_cookies_dict", None)
+        download = self._get_session_torrent(torrent_info)
+        if download is not None:
+            return download
+        headers = self._get_request_headers(torrent_info)
 
         if url.startswith("magnet:"):
-            self.log.info("Fetching magnet: '%s'" % url, gtkui=False)
-            download = TorrentDownload({"is_magnet": True, "url": url})
+            self.log.info("Fetching magnet: '%s'", url, gtkui=False)
+            download = TorrentDownload({"is_magnet": True, "url": url, "infohash": get_magnet_infohash(url)})
         else:
             # Fix unicode URLs
             url = http.url_fix(url)
-            self.log.info("Downloading torrent: '%s' using cookies: '%s', headers: '%s'" %
-                          (url, str(site_cookies_dict), str(headers)), gtkui=True)
+            self.log.info("Downloading torrent: '%s' using cookies: '%s', headers: '%s'",
+                          url, site_cookies_dict, headers, gtkui=True)
             download = self.download_torrent_file(url, cookies=site_cookies_dict, headers=headers)
-            # Error occured
-            if not download.success:
-                return download
-            # Get the torrent data from the torrent file
-            try:
-                torrentinfo.TorrentInfo(filedump=download.filedump)
-            except Exception as e:
-                download.set_error("Unable to open torrent file: %s. Error: %s" % (url, str(e)))
-                self.log.warning(download.error_msg)
         return download
 
+    def get_torrents(self, torrent_list, max_workers=1, cache=None):
+        """Fetch the torrents in torrent_list using at most max_workers threads.
+        Returns the downloads in the same order as torrent_list.
+        cache: A TorrentDownloadCache. The torrents in the cache are not downloaded,
+               and each URL is downloaded only once"""
+        if cache is not None:
+            cached, pending = self._get_cached_torrents(torrent_list, cache)
+            downloads = self.get_torrents(pending, max_workers=max_workers)
+            return self._add_cached_torrents(torrent_list, cached, pending, downloads, cache)
+        max_workers = max(1, min(int(max_workers), len(torrent_list)))
+        if max_workers == 1:
+            return [self.get_torrent(torrent_info) for torrent_info in torrent_list]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.get_torrent, torrent_list))
+
+    def _get_cached_torrents(self, torrent_list, cache):
+        """Returns a dictionary with the cached downloads by cache key,
+        and the torrents to download, one for each URL not in the cache"""
+        cached = {}
+        pending = OrderedDict()
+        for torrent_info in torrent_list:
+            key = get_torrent_cache_key(torrent_info["link"])
+            if key in cached or key in pending:
+                continue
+            # get() computes the key of the URL, url_fix is not idempotent
+            download = cache.get(torrent_info["link"])
+            if download is None:
+                pending[key] = torrent_info
+            else:
+                self.log.info("Using the earlier download of torrent: '%s'", torrent_info["link"], gtkui=False)
+                cached[key] = download
+        return cached, list(pending.values())
+
+    def _add_cached_torrents(self, torrent_list, cached, pending, downloads, cache):
+        """Add the new downloads to the cache, and returns a copy of the download for each torrent
+        in torrent_list, as add_torrent changes the download (e.g. the torrent_id and success)"""
+        for torrent_info, download in zip(pending, downloads):
+            cached[get_torrent_cache_key(torrent_info["link"])] = cache.add(download, url=torrent_info["link"])
+        return [TorrentDownload(cached[get_torrent_cache_key(torrent_info["link"])]) for torrent_info in torrent_list]
+
+    def get_torrent_async(self, torrent_info, http_client):
+        """Like get_torrent, but the torrent file is downloaded from the reactor
+        by http_client (yarss2.util.async_http.AsyncHTTPClient).
+        Returns a Deferred firing with the TorrentDownload, which never fails"""
+        url = torrent_info["link"]
+        if url.startswith("magnet:") or not http.is_http_url(url) or \
+           torrent_info.get("infohash", None) in self.session_infohashes:
+            return defer.succeed(self.get_torrent(torrent_info))
+
+        site_cookies_dict = torrent_info.get("site_cookies_dict", None)
+        headers = self._get_request_headers(torrent_info)
+        # Fix unicode URLs
+        url = http.url_fix(url)
+        self.log.info("Downloading torrent: '%s' using cookies: '%s', headers: '%s'",
+                      url, site_cookies_dict, headers, gtkui=True)
+        download = TorrentDownload()
+        download.url = url
+        download.cookies = site_cookies_dict
+        download.headers = headers
+        request_headers = dict(headers)
+        if site_cookies_dict:
+            request_headers.update(http.get_cookie_header(site_cookies_dict))
+        start = time.perf_counter()
+
+        def downloaded(result):
+            # Includes the time waiting for the rate limiter
+            download.download_time = time.perf_counter() - start
+            if result["status"] in http.THROTTLED_STATUS_CODES:
+                raise RateLimitError("Server responded with HTTP status %d" % result["status"])
+            download.filedump = result["content"]
+            return self._verify_torrent_file(download)
+
+        def failed(failure):
+            error_msg = "Failed to download torrent url: '%s'. Exception: %s" % (url, failure.getErrorMessage())
+            self.log.error(error_msg)
+            download.set_error(error_msg)
+            return download
+
+        # The certificates are not verified, like in download_torrent_file
+        d = http_client.get(url, headers=request_headers, verify=False)
+        d.addCallback(downloaded)
+        d.addErrback(failed)
+        return d
+
+    def get_torrents_async(self, torrent_list, http_client, max_concurrent=1, cache=None):
+        """Fetch the torrents in torrent_list with at most max_concurrent downloads at the same time.
+        Returns a Deferred firing with the downloads in the same order as torrent_list.
+        cache: A TorrentDownloadCache, see get_torrents"""
+        if cache is not None:
+            cached, pending = self._get_cached_torrents(torrent_list, cache)
+            d = self.get_torrents_async(pending, http_client, max_concurrent=max_concurrent)
+            d.addCallback(lambda downloads: self._add_cached_torrents(torrent_list, cached, pending,
+                                                                      downloads, cache))
+            return d
+        semaphore = defer.DeferredSemaphore(max(1, int(max_concurrent)))
+        return defer.gatherResults([semaphore.run(self.get_torrent_async, torrent_info, http_client)
+                                    for torrent_info in torrent_list])
+
     def add_torrent(self, torrent_info):
         # Initialize options with default configurations
         options = TorrentOptions()
@@ -131,25 +406,38 @@ class TorrentHandler(object):
             if subscription_data["max_upload_slots"] != -2:
                 options["max_upload_slots"] = subscription_data["max_upload_slots"]
 
+        # Downloads from the GUI have been sent over RPC without the ParsedTorrent
+        if not download.is_magnet and download.success and download.torrent_id is None and \
+           download.parsed_torrent is None:
+            self._verify_torrent_file(download)
+        if download.success and download.torrent_id is None and download.infohash in self.session_infohashes:
+            download.torrent_id = download.infohash
+        if download.success and download.torrent_id is not None:
+            # The torrent is in the session, e.g. added for another subscription
+            # or RSS Feed matching the same torrent (see TorrentDownloadCache)
+            self.log.info("Torrent '%s' has already been added.", torrent_url)
+            # The download given by the caller is not changed
+            duplicate = TorrentDownload(download)
+            duplicate.duplicate = True
+            duplicate.set_error("Torrent '%s' has already been added." % torrent_url)
+            return duplicate
+
         if download.is_magnet:
-            self.log.info("Adding magnet: '%s'" % torrent_url)
+            self.log.info("Adding magnet: '%s'", torrent_url)
             download.torrent_id = component.get("TorrentManager").add(options=options,
                                                                       magnet=download.url)
+            self.session_infohashes.add(download.infohash)
         else:
             # Error occured
             if not download.success:
-                self.log.warning("Failed to add '%s'." % (torrent_url))
+                self.log.warning("Failed to add '%s'.", torrent_url)
                 return download
 
-            self.log.info("Adding torrent: '%s'." % (torrent_url))
-            # Get the torrent data from the torrent file
-            try:
-                torrentinfo.TorrentInfo(filedump=download.filedump)
-            except Exception as e:
-                download.set_error("Unable to open torrent file: %s. Error: %s" % (torrent_url, str(e)))
-                self.log.warning(download.error_msg)
-
+            self.log.info("Adding torrent: '%s' (%s, %d files, %d bytes).", torrent_url,
+                          download.parsed_torrent.name, download.parsed_torrent.num_files,
+                          download.parsed_torrent.size)
             try:
+                # The filedump is passed to Deluge as it saves the torrent file in the state directory
                 download.torrent_id = component.get("TorrentManager").add(filedump=download.filedump,
                                                                           filename=os.path.basename(torrent_url),
                                                                           options=options)
@@ -158,6 +446,7 @@ class TorrentHandler(object):
                 download.set_error("Failed to add torrent to Deluge: %s" % (str(err)))
                 self.log.warning(download.error_msg)
             else:
+                self.session_infohashes.add(download.infohash)
                 if ("Label" in component.get("Core").get_enabled_plugins()
                         and subscription_data and subscription_data.get("label", "")):
                     component.get("CorePlugin.Label").set_torrent(download.torrent_id, subscription_data["label"])
@@ -169,11 +458,14 @@ class TorrentHandler(object):
         for torrent_match in torrent_list:
             torrent_download = self.add_torrent(torrent_match)
 
+            if torrent_download.duplicate:
+                # Not a new torrent, so the subscription is not updated and no email is sent
+                continue
             if not torrent_download.success:
-                self.log.warning("Failed to add torrent '%s' from url '%s'" %
-                                 (torrent_match["title"], torrent_match["link"]))
+                self.log.warning("Failed to add torrent '%s' from url '%s'",
+                                 torrent_match["title"], torrent_match["link"])
             else:
-                self.log.info("Succesfully added torrent '%s'." % torrent_match["title"])
+                self.log.info("Succesfully added torrent '%s'.", torrent_match["title"])
                 # Update subscription with date
                 torrent_time = torrent_match["updated_datetime"]
 
@@ -11,12 +11,18 @@ from __future__ import print_function
 import datetime
 import os
 import sys
+from functools import lru_cache
 
 import pkg_resources
 
 PY2 = sys.version_info.major == 2
 PY3 = sys.version_info.major == 3
 
+# Number of strings cached by isodate_to_datetime
+ISODATE_CACHE_SIZE = 4096
+
+_tzutc = None
+
 
 def get_version():
     """
@@ -63,15 +69,26 @@ def datetime_ensure_timezone(dt):
     return dt
 
 
+def get_tzutc():
+    """Returns the UTC tzinfo instance shared by all the datetimes"""
+    global _tzutc
+    if _tzutc is None:
+        from dateutil.tz import tzutc
+        _tzutc = tzutc()
+    return _tzutc
+
+
 def datetime_add_timezone(dt, tzinfo=None):
-    from dateutil.tz import tzutc
     if tzinfo is None:
-        tzinfo = tzutc()
+        tzinfo = get_tzutc()
     return dt.replace(tzinfo=tzinfo)
 
 
+@lru_cache(maxsize=ISODATE_CACHE_SIZE)
 def isodate_to_datetime(date_in_isoformat):
     """
+    The conversions are cached, as the same timestamps are converted on every update.
+
     Args:
         date_in_isoformat (str): The date in iso format
 
@@ -79,6 +96,12 @@ def isodate_to_datetime(date_in_isoformat):
         datetime.datetime: The datetime object converted from date_in_isoformat
 
     """
+    # Fast path for the dates created with datetime.isoformat()
+    try:
+        return datetime_add_timezone(datetime.datetime.fromisoformat(date_in_isoformat))
+    except (AttributeError, TypeError, ValueError):
+        pass
+
     from dateutil import parser as dateutil_parser
     try:
         dt = dateutil_parser.parse(date_in_isoformat)
@@ -86,7 +109,7 @@ def isodate_to_datetime(date_in_isoformat):
     except ValueError as err:
         from yarss2.util import logging
         log = logging.getLogger(__name__)
-        log.warning("isodate_to_datetime error:", err)
+        log.warning("isodate_to_datetime error: %s", err)
         return get_default_date()
 
 
@@ -286,6 +309,14 @@ class TorrentDownload(dict):
         self["url"] = None
         self["is_magnet"] = False
         self["cookies_dict"] = None
+        # Seconds spent downloading the torrent file
+        self["download_time"] = None
+        # Hex infohash, when known from the magnet link or the torrent file
+        self["infohash"] = None
+        # The ParsedTorrent of the filedump, decoded once when the torrent file is verified
+        self["parsed_torrent"] = None
+        # The torrent was not added as it is already in the session, or has already been added
+        self["duplicate"] = False
         self.update(d)
 
     def __getattr__(self, attr):
@@ -299,4 +330,7 @@ class TorrentDownload(dict):
         self["success"] = False
 
     def to_dict(self):
-        return self.copy()
+        # The ParsedTorrent cannot be sent over RPC, it is decoded again from the filedump if needed
+        d = self.copy()
+        d["parsed_torrent"] = None
+        return d
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import json
+import os
+import tempfile
+
+from deluge.common import JSON_FORMAT
+
+from yarss2.util import logging
+
+log = logging.getLogger(__name__)
+
+# Seconds from the first change until the config is written
+DEFAULT_SAVE_DELAY = 5
+
+
+class ConfigSaver(object):
+    """
+    Write-behind saving of a deluge config.
+
+    save_later() marks the config as changed, and the config is written delay seconds
+    after the first change. Many changes in a short time, like the last match of the
+    subscriptions updated for each added torrent, are written to the file only once.
+    flush() writes the pending changes immediately, and must be called before exiting.
+    With delay 0, save_later() writes the config immediately.
+
+    Must only be used from the main thread.
+    """
+
+    def __init__(self, config, delay=DEFAULT_SAVE_DELAY, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.config = config
+        self.delay = delay
+        self.clock = clock
+        self.dirty = False
+        # Number of times the config has been written
+        self.saves = 0
+        self._delayed_call = None
+
+    def save_later(self):
+        """Mark the config as changed, and schedule writing it"""
+        self.dirty = True
+        cancel_config_save_timer(self.config)
+        if self.delay <= 0:
+            self.flush()
+        elif self._delayed_call is None:
+            self._delayed_call = self.clock.callLater(self.delay, self.flush)
+
+    def save(self):
+        """Write the config now, also if it has not been marked as changed"""
+        self.dirty = True
+        return self.flush()
+
+    def flush(self):
+        """Write the config now if it has been changed. Returns False if writing failed,
+        in which case the config is still marked as changed"""
+        if self._delayed_call is not None:
+            if self._delayed_call.active():
+                self._delayed_call.cancel()
+            self._delayed_call = None
+        if not self.dirty:
+            return True
+        if not save_config_atomic(self.config):
+            return False
+        self.dirty = False
+        self.saves += 1
+        return True
+
+
+def save_config_atomic(config, filename=None):
+    """Write the deluge config to a temporary file in the same directory, and rename it to
+    the config file. The config file is replaced in one step, so it is never incomplete,
+    even if the process is killed while saving. Returns True if the config was written"""
+    filename = os.path.realpath(filename or config.config_file)
+    directory = os.path.dirname(filename)
+    # The file version is only available in the private attribute of deluge.config.Config
+    version = getattr(config, "_Config__version", None)
+    if not isinstance(version, dict):
+        log.warning("Unable to read the version of config file '%s', saving it with deluge", filename)
+        return bool(config.save(filename))
+    filename_tmp = None
+    try:
+        fd, filename_tmp = tempfile.mkstemp(prefix=os.path.basename(filename) + ".", suffix=".tmp",
+                                            dir=directory)
+        with os.fdopen(fd, "w", encoding="utf8") as _file:
+            json.dump(version, _file, **JSON_FORMAT)
+            json.dump(config.config, _file, **JSON_FORMAT)
+            _file.flush()
+            os.fsync(_file.fileno())
+        os.replace(filename_tmp, filename)
+        cancel_config_save_timer(config)
+    except (OSError, TypeError, ValueError) as ex:
+        log.error("Failed to save config file '%s': %s" % (filename, ex))
+        if filename_tmp is not None and os.path.exists(filename_tmp):
+            os.remove(filename_tmp)
+        return False
+    return True
+
+
+def cancel_config_save_timer(config):
+    """deluge.config.Config schedules saving itself when a top level key is set,
+    which is not needed when the config is saved by the ConfigSaver"""
+    save_timer = getattr(config, "_save_timer", None)
+    if save_timer is not None and save_timer.active():
+        save_timer.cancel()
@@ -7,37 +7,147 @@
 # See LICENSE for more details.
 #
 
+import logging
+import threading
+
+from OpenSSL.SSL import Error as SSLError
+
+import deluge.component as component
 from deluge.event import DelugeEvent
 
 from yarss2.util.common import get_current_date_in_isoformat
 
+# Seconds between the events with the log messages sent to the GUI
+DEFAULT_FLUSH_INTERVAL = 1
+# Max number of messages in one event. Further messages until the event is sent are dropped
+DEFAULT_MAX_MESSAGES = 200
+# Max number of lines in the log message pane
+DEFAULT_MAX_LINES = 1000
+
+log = logging.getLogger(__name__)
+
+_gtkui_log_buffer = None
+
 
 class GTKUILogger(object):
-    """This class handles messages going to the GTKUI log message pane"""
+    """This class handles messages going to the GTKUI log message pane.
+    Only the last max_lines lines are kept in the pane"""
 
-    def __init__(self, textview):
+    def __init__(self, textview, max_lines=DEFAULT_MAX_LINES):
         self.textview = textview
+        self.max_lines = max_lines
         self.show_log_in_gui = True
 
     def gtkui_log_message(self, message):
+        self.gtkui_log_messages([(get_current_date_in_isoformat(), message)])
+
+    def gtkui_log_messages(self, messages):
+        """messages is a list of (time, message)"""
         if self.show_log_in_gui is False:
             return
+        text = "".join("(%s): %s\n" % (time, message) for time, message in messages)
 
         def add_msg():
             buf = self.textview.get_buffer()
-            time = get_current_date_in_isoformat()
-            msg_to_append = "(%s): %s" % (time, message)
-            buf.insert(buf.get_end_iter(), msg_to_append + "\n")
+            buf.insert(buf.get_end_iter(), text)
+            # The last line is the empty line after the last message
+            excess_lines = buf.get_line_count() - 1 - self.max_lines
+            if excess_lines > 0:
+                buf.delete(buf.get_start_iter(), buf.get_iter_at_line(excess_lines))
         from gi.repository import GLib  # Do not import on top as only the client needs to have this package
         GLib.idle_add(add_msg)
 
 
-class GtkUILogMessageEvent(DelugeEvent):
+class GtkUILogBuffer(object):
     """
-    Emitted when a message has been written to the log.
+    Collects the log messages for the GTKUI log message pane on the deluge daemon,
+    and sends them in one GtkUILogMessagesEvent flush_interval seconds after the first message.
+
+    At most max_messages messages are sent in one event. The messages logged after that,
+    until the event is sent, are dropped, and replaced by a message with the number of
+    dropped messages. The messages may be added from any thread.
     """
-    def __init__(self, message):
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, max_messages=DEFAULT_MAX_MESSAGES, clock=None):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.max_messages = max_messages
+        # Number of messages dropped since the daemon was started
+        self.dropped_total = 0
+        self._lock = threading.Lock()
+        self._messages = []
+        self._dropped = 0
+        self._delayed_call = None
+        self._flush_pending = False
+
+    def add(self, message, args=()):
+        """Add the message, formatted with args, to the next event. The message is only
+        formatted if it is not dropped. Returns False if there is no event manager to
+        send the event, e.g. when running the tests"""
+        try:
+            component.get("EventManager")
+        except KeyError:
+            return False
+        with self._lock:
+            if len(self._messages) < self.max_messages:
+                self._messages.append((get_current_date_in_isoformat(), message % args if args else message))
+            else:
+                self._dropped += 1
+                self.dropped_total += 1
+            if self._flush_pending:
+                return True
+            self._flush_pending = True
+        if threading.current_thread() is threading.main_thread():
+            self._schedule_flush()
+        else:
+            self.clock.callFromThread(self._schedule_flush)
+        return True
+
+    def flush(self):
+        """Send the collected messages now. Returns the messages sent"""
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+        with self._lock:
+            messages, self._messages = self._messages, []
+            dropped, self._dropped = self._dropped, 0
+            self._flush_pending = False
+        if dropped:
+            messages.append((get_current_date_in_isoformat(),
+                             "%d log messages were not shown, see the deluge log for all the messages" % dropped))
+        if not messages:
+            return messages
+        try:
+            # Tests throws KeyError for EventManager when running this method, so wrap this in try/except
+            component.get("EventManager").emit(GtkUILogMessagesEvent(messages))
+        except KeyError:
+            pass
+        except SSLError:
+            log.info("Caught OpenSSL.SSL.Error when sending log messages to the GUI")
+        return messages
+
+    def _schedule_flush(self):
+        if self._delayed_call is None:
+            self._delayed_call = self.clock.callLater(self.flush_interval, self.flush)
+
+
+class GtkUILogMessagesEvent(DelugeEvent):
+    """
+    Emitted with the messages that have been written to the log.
+    """
+    def __init__(self, messages):
         """
-        :param message: the message to be logged
+        :param messages: list of (time, message) to be logged
         """
-        self._args = [message]
+        self._args = [messages]
+
+
+def get_gtkui_log_buffer():
+    """Returns the GtkUILogBuffer collecting the log messages sent to the GUI"""
+    global _gtkui_log_buffer
+    if _gtkui_log_buffer is None:
+        _gtkui_log_buffer = GtkUILogBuffer()
+    return _gtkui_log_buffer
@@ -8,61 +8,78 @@
 #
 import logging
 
-from OpenSSL.SSL import Error as SSLError
-
-import deluge.component as component
-
 from yarss2.util import common
-from yarss2.util.gtkui_log import GtkUILogMessageEvent
+from yarss2.util.gtkui_log import get_gtkui_log_buffer
 
 log = logging.getLogger(__name__)
 
 
 class Logger(object):
+    """
+    Logs to the python logger and to the GTKUI log message pane.
+
+    The arguments are formatted into the message (message % args) only when the message
+    is logged, like with the python logger, so the call sites should pass the arguments
+    instead of formatting the message:
+
+        log.info("Downloading torrent: '%s'", url)
+
+    The file name and line number of the caller are only looked up when the python logger
+    has enabled the level. Messages with gtkui=True are also sent to the GUI, which may
+    drop them before they are formatted (see GtkUILogBuffer).
+    """
 
     def __init__(self, gtkui_logger=None, logger=log):
         self.gtkui_logger = gtkui_logger
         self.log = logger
 
-    def handle_gtkui_log(self, message, gtkui):
+    def is_enabled_for(self, level, gtkui=False):
+        """Returns True if a message with level (e.g. logging.DEBUG) would be logged.
+        Used to avoid computing the arguments of messages that are not logged"""
+        return gtkui or self.log.isEnabledFor(level)
+
+    def handle_gtkui_log(self, message, gtkui, args=()):
         if not gtkui:
             return
         # On gtkui client
         if self.gtkui_logger:
-            self.gtkui_logger.gtkui_log_message(message)
+            self.gtkui_logger.gtkui_log_message(format_message(message, args))
         else:  # On deluge daemon
-            self.gtkui_log_message_event(message)
-
-    def debug(self, message, gtkui=True):
-        self.log.debug(self._msg(message))
-        self.handle_gtkui_log(message, gtkui)
-
-    def info(self, message, gtkui=True):
-        self.log.info(self._msg(message))
-        self.handle_gtkui_log(message, gtkui)
-
-    def warn(self, message, gtkui=True):
-        self.warning(message, gtkui=gtkui)
-
-    def warning(self, message, gtkui=True):
-        self.log.warning(self._msg(message))
-        self.handle_gtkui_log(message, gtkui)
-
-    def error(self, message, gtkui=True):
-        self.log.error(self._msg(message))
-        self.handle_gtkui_log(message, gtkui)
-
-    def _msg(self, msg):
-        return "%s.%s:%s: %s" % ("YaRSS2", common.filename(), common.linenumber(), msg)
-
-    def gtkui_log_message_event(self, message):
-        try:
-            # Tests throws KeyError for EventManager when running this method, so wrap this in try/except
-            component.get("EventManager").emit(GtkUILogMessageEvent(message))
-        except KeyError:
-            pass
-        except SSLError:
-            self.log.info("Caught OpenSSL.SSL.Error in gtkui_log_message_event")
+            self.gtkui_log_message_event(message, args)
+
+    def debug(self, message, *args, gtkui=True):
+        self._log(logging.DEBUG, message, args, gtkui)
+
+    def info(self, message, *args, gtkui=True):
+        self._log(logging.INFO, message, args, gtkui)
+
+    def warn(self, message, *args, gtkui=True):
+        self._log(logging.WARNING, message, args, gtkui)
+
+    def warning(self, message, *args, gtkui=True):
+        self._log(logging.WARNING, message, args, gtkui)
+
+    def error(self, message, *args, gtkui=True):
+        self._log(logging.ERROR, message, args, gtkui)
+
+    def _log(self, level, message, args, gtkui):
+        if self.log.isEnabledFor(level):
+            message = format_message(message, args)
+            args = ()
+            # The caller of debug/info/warning/error is 3 frames up
+            self.log.log(level, self._msg(message, level=4))
+        self.handle_gtkui_log(message, gtkui, args)
+
+    def _msg(self, msg, level=3):
+        return "%s.%s:%s: %s" % ("YaRSS2", common.filename(level), common.linenumber(level), msg)
+
+    def gtkui_log_message_event(self, message, args=()):
+        # The messages are sent to the GUI in batches
+        get_gtkui_log_buffer().add(message, args)
+
+
+def format_message(message, args):
+    return message % args if args else message
 
 
 def getLogger(name, gtkui_logger=None):  # noqa: N802
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import os
+import tempfile
+
+from twisted.internet import task
+
+from yarss2.util import logging
+
+log = logging.getLogger(__name__)
+
+# Seconds between the writes of the metrics file
+DEFAULT_METRICS_INTERVAL = 60
+
+# (counter in PipelineStats, metric name, help text)
+RSSFEED_COUNTERS = (
+    ("updates", "yarss2_rssfeed_updates_total", "Number of updates of the RSS Feed"),
+    ("not_modified", "yarss2_rssfeed_not_modified_total", "Number of updates where the server responded 304"),
+    ("unchanged", "yarss2_rssfeed_unchanged_total", "Number of updates where the content was unchanged"),
+    ("bytes", "yarss2_rssfeed_downloaded_bytes_total", "Number of bytes of the RSS Feed downloaded"),
+    ("items_parsed", "yarss2_rssfeed_items_parsed_total", "Number of items parsed from the RSS Feed"),
+    ("torrent_downloads", "yarss2_rssfeed_torrent_downloads_total", "Number of torrents downloaded"),
+    ("torrent_download_failures", "yarss2_rssfeed_torrent_download_failures_total",
+     "Number of torrents that failed to download or add"),
+)
+SUBSCRIPTION_COUNTERS = (
+    ("runs", "yarss2_subscription_runs_total", "Number of times the subscription was matched"),
+    ("matches", "yarss2_subscription_matches_total", "Number of items matching the subscription"),
+)
+QUANTILES = (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"))
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsFormatter(object):
+    """Writes the metrics in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lines = []
+        self._described = set()
+
+    def describe(self, name, metric_type, help_text):
+        if name in self._described:
+            return
+        self._described.add(name)
+        self.lines.append("# HELP %s %s" % (name, help_text))
+        self.lines.append("# TYPE %s %s" % (name, metric_type))
+
+    def add(self, name, value, labels=None):
+        if value is None:
+            return
+        label_text = ""
+        if labels:
+            label_text = "{%s}" % ",".join('%s="%s"' % (key, escape_label_value(labels[key])) for key in labels)
+        self.lines.append("%s%s %s" % (name, label_text, repr(value)))
+
+    def add_summary(self, name, summary, labels=None):
+        """Add a summary with the quantiles, sum and count of a RollingHistogram summary"""
+        labels = labels or {}
+        for quantile, key in QUANTILES:
+            quantile_labels = dict(labels)
+            quantile_labels["quantile"] = quantile
+            self.add(name, summary.get(key, None), quantile_labels)
+        self.add(name + "_sum", summary["total"], labels)
+        self.add(name + "_count", summary["count"], labels)
+
+    def get_text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def format_metrics(stats, config=None):
+    """Returns the stats returned by Core.get_stats in the Prometheus text exposition format.
+    config: The YaRSS2 config, used to label the RSS Feeds and subscriptions with their names"""
+    config = config or {}
+    rssfeeds = config.get("rssfeeds", {})
+    subscriptions = config.get("subscriptions", {})
+    formatter = MetricsFormatter()
+
+    def rssfeed_labels(key):
+        return {"rssfeed": key, "name": rssfeeds.get(key, {}).get("name", "")}
+
+    def subscription_labels(key):
+        subscription = subscriptions.get(key, {})
+        return {"subscription": key, "name": subscription.get("name", ""),
+                "rssfeed": subscription.get("rssfeed_key", "")}
+
+    for counter, name, help_text in RSSFEED_COUNTERS:
+        formatter.describe(name, "counter", help_text)
+        for key, counts in sorted(stats.get("rssfeed_counts", {}).items()):
+            formatter.add(name, counts.get(counter, 0), rssfeed_labels(key))
+
+    formatter.describe("yarss2_rssfeed_stage_seconds", "summary", "Seconds spent in each stage of the RSS Feed updates")
+    for key, stages in sorted(stats.get("rssfeeds", {}).items()):
+        for stage, summary in sorted(stages.items()):
+            labels = rssfeed_labels(key)
+            labels["stage"] = stage
+            formatter.add_summary("yarss2_rssfeed_stage_seconds", summary, labels)
+
+    for counter, name, help_text in SUBSCRIPTION_COUNTERS:
+        formatter.describe(name, "counter", help_text)
+        for key, counts in sorted(stats.get("subscription_counts", {}).items()):
+            formatter.add(name, counts.get(counter, 0), subscription_labels(key))
+
+    formatter.describe("yarss2_subscription_match_seconds", "summary", "Seconds spent matching the subscription")
+    for key, stages in sorted(stats.get("subscriptions", {}).items()):
+        if "match" in stages:
+            formatter.add_summary("yarss2_subscription_match_seconds", stages["match"], subscription_labels(key))
+
+    run_queue = stats.get("run_queue", None)
+    if run_queue is not None:
+        formatter.describe("yarss2_run_queue_running", "gauge", "Number of RSS Feed updates running")
+        formatter.add("yarss2_run_queue_running", run_queue["running"])
+        formatter.describe("yarss2_run_queue_queued", "gauge", "Number of RSS Feed updates waiting in the queue")
+        formatter.add("yarss2_run_queue_queued", run_queue["queued"])
+        formatter.describe("yarss2_run_queue_wait_seconds", "summary",
+                           "Seconds the RSS Feed updates waited in the queue")
+        formatter.add_summary("yarss2_run_queue_wait_seconds", run_queue["wait"])
+
+    rate_limiter = sorted(stats.get("rate_limiter", {}).items())
+    for key, name, help_text in (("requests", "yarss2_host_requests_total", "Number of requests to the host"),
+                                 ("throttled", "yarss2_host_throttled_total",
+                                  "Number of HTTP 429 and 503 responses from the host")):
+        # The samples of a metric must follow its HELP and TYPE lines
+        for host, state in rate_limiter:
+            formatter.describe(name, "counter", help_text)
+            formatter.add(name, state[key], {"host": host})
+
+    regex_cache = stats.get("regex_cache", None)
+    if regex_cache is not None:
+        formatter.describe("yarss2_regex_cache_hits_total", "counter", "Number of regex cache hits")
+        formatter.add("yarss2_regex_cache_hits_total", regex_cache["hits"])
+        formatter.describe("yarss2_regex_cache_misses_total", "counter", "Number of regex cache misses")
+        formatter.add("yarss2_regex_cache_misses_total", regex_cache["misses"])
+
+    download_cache = stats.get("torrent_download_cache", None)
+    if download_cache is not None:
+        formatter.describe("yarss2_torrent_download_cache_hits_total", "counter",
+                           "Number of torrent downloads reused from the cache")
+        formatter.add("yarss2_torrent_download_cache_hits_total", download_cache["hits"])
+        formatter.describe("yarss2_torrent_download_cache_size", "gauge", "Number of torrent downloads in the cache")
+        formatter.add("yarss2_torrent_download_cache_size", download_cache["size"])
+
+    for key, name, help_text in (("config_saves", "yarss2_config_saves_total", "Number of times the config was saved"),
+                                 ("gtkui_log_dropped", "yarss2_gtkui_log_dropped_total",
+                                  "Number of log messages not sent to the GUI")):
+        if key in stats:
+            formatter.describe(name, "counter", help_text)
+            formatter.add(name, stats[key])
+    return formatter.get_text()
+
+
+def write_file_atomic(filename, text):
+    """Write text to a temporary file in the same directory, and rename it to filename,
+    so the file is never read while incomplete. Returns True if the file was written"""
+    filename = os.path.realpath(filename)
+    filename_tmp = None
+    try:
+        fd, filename_tmp = tempfile.mkstemp(prefix=os.path.basename(filename) + ".", suffix=".tmp",
+                                            dir=os.path.dirname(filename))
+        with os.fdopen(fd, "w", encoding="utf8") as _file:
+            _file.write(text)
+        os.replace(filename_tmp, filename)
+    except OSError as ex:
+        log.error("Failed to write metrics file '%s': %s", filename, ex)
+        if filename_tmp is not None and os.path.exists(filename_tmp):
+            os.remove(filename_tmp)
+        return False
+    return True
+
+
+class MetricsFileWriter(object):
+    """
+    Writes the metrics to a file every interval seconds, e.g. in the directory
+    of the textfile collector of the Prometheus node exporter.
+
+    get_metrics_func: Function returning the metrics text, e.g. Core.get_metrics
+    """
+
+    def __init__(self, get_metrics_func, filename, interval=DEFAULT_METRICS_INTERVAL, clock=None):
+        self.get_metrics_func = get_metrics_func
+        self.filename = filename
+        self.interval = interval
+        self.looping_call = task.LoopingCall(self.write)
+        if clock is not None:
+            self.looping_call.clock = clock
+
+    def start(self):
+        if not self.looping_call.running:
+            self.looping_call.start(max(1, self.interval), now=True)
+
+    def stop(self):
+        if self.looping_call.running:
+            self.looping_call.stop()
+
+    def write(self):
+        return write_file_atomic(self.filename, self.get_metrics_func())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import re
+import threading
+from collections import OrderedDict
+
+# Max number of compiled patterns in the RegexCache
+DEFAULT_REGEX_CACHE_MAX_SIZE = 2048
+
+_regex_cache = None
+
+
+class RegexCache(object):
+    """
+    Cache of compiled regular expressions keyed by pattern and flags.
+
+    The subscription patterns are matched against every RSS Feed update, and
+    on every change in the subscription dialog, so they are compiled only once.
+    The least recently used pattern is removed when the cache holds max_size patterns.
+    """
+
+    def __init__(self, max_size=DEFAULT_REGEX_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._patterns = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, pattern, flags=0):
+        """Returns the compiled pattern. Raises re.error if the pattern is invalid,
+        in which case nothing is cached"""
+        key = (pattern, flags)
+        with self._lock:
+            compiled = self._patterns.pop(key, None)
+            if compiled is not None:
+                self.hits += 1
+                self._patterns[key] = compiled
+                return compiled
+            self.misses += 1
+        compiled = re.compile(pattern, flags)
+        with self._lock:
+            self._patterns[key] = compiled
+            while len(self._patterns) > self.max_size:
+                self._patterns.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._patterns.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._patterns), "max_size": self.max_size}
+
+    def __len__(self):
+        return len(self._patterns)
+
+
+def get_regex_cache():
+    """Returns the RegexCache shared by the process"""
+    global _regex_cache
+    if _regex_cache is None:
+        _regex_cache = RegexCache()
+    return _regex_cache
+
+
+def compile_regex(pattern, flags=0):
+    """Compile pattern using the shared RegexCache"""
+    return get_regex_cache().compile(pattern, flags)
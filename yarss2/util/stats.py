@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Number of samples kept for each stage, the percentiles are computed from these
+DEFAULT_MAX_SAMPLES = 100
+
+_pipeline_stats = None
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the seconds spent in the with block to timings[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+class RollingHistogram(object):
+    """Keeps the last max_samples values, and the count and sum of all the values"""
+
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def get_summary(self):
+        """Returns the count and total of all the values, and the mean,
+        max and percentiles of the last max_samples values"""
+        samples = sorted(self.samples)
+        summary = {"count": self.count, "total": self.total, "last": self.samples[-1] if self.samples else None}
+        if samples:
+            summary["mean"] = sum(samples) / len(samples)
+            summary["max"] = samples[-1]
+            for percentile in (50, 90, 99):
+                summary["p%d" % percentile] = samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+        return summary
+
+
+class PipelineStats(object):
+    """
+    Timings of the stages of the RSS Feed updates, like downloading, parsing and matching
+    the RSS Feed, and downloading and adding the torrents. A RollingHistogram is kept for
+    each stage of each RSS Feed, and for matching each subscription, so the slow RSS Feeds
+    and the expensive subscription patterns can be found. Counters, like the number of
+    updates and bytes downloaded, are kept for each RSS Feed and subscription.
+
+    The timings may be added from any thread.
+    """
+
+    def __init__(self, max_samples=DEFAULT_MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        # rssfeed_key -> {stage: RollingHistogram}
+        self._rssfeeds = {}
+        # subscription_key -> {stage: RollingHistogram}
+        self._subscriptions = {}
+        # rssfeed_key -> {name: count}
+        self._rssfeed_counts = {}
+        # subscription_key -> {name: count}
+        self._subscription_counts = {}
+
+    def add_rssfeed_timings(self, rssfeed_key, timings):
+        """timings: A dictionary with the seconds spent in each stage"""
+        self._add(self._rssfeeds, rssfeed_key, timings)
+
+    def add_subscription_timings(self, subscription_key, timings):
+        self._add(self._subscriptions, subscription_key, timings)
+
+    def add_rssfeed_counts(self, rssfeed_key, counts):
+        """counts: A dictionary with the numbers to add to the counters"""
+        self._count(self._rssfeed_counts, rssfeed_key, counts)
+
+    def add_subscription_counts(self, subscription_key, counts):
+        self._count(self._subscription_counts, subscription_key, counts)
+
+    def reset(self, rssfeed_key=None, subscription_key=None):
+        """Forget the timings of the RSS Feed or subscription, or all timings if both are None"""
+        with self._lock:
+            if rssfeed_key is None and subscription_key is None:
+                for values in (self._rssfeeds, self._subscriptions, self._rssfeed_counts, self._subscription_counts):
+                    values.clear()
+            for values in (self._rssfeeds, self._rssfeed_counts):
+                values.pop(rssfeed_key, None)
+            for values in (self._subscriptions, self._subscription_counts):
+                values.pop(subscription_key, None)
+
+    def get_stats(self):
+        """Returns {"rssfeeds": {rssfeed_key: {stage: summary}}, "subscriptions": {subscription_key: ...}}
+        with the summary returned by RollingHistogram.get_summary, and the counters in
+        {"rssfeed_counts": {rssfeed_key: {name: count}}, "subscription_counts": {subscription_key: ...}}"""
+        with self._lock:
+            stats = {name: dict((key, dict((stage, histogram.get_summary()) for stage, histogram in stages.items()))
+                                for key, stages in histograms.items())
+                     for name, histograms in (("rssfeeds", self._rssfeeds), ("subscriptions", self._subscriptions))}
+            stats["rssfeed_counts"] = dict((key, dict(counts)) for key, counts in self._rssfeed_counts.items())
+            stats["subscription_counts"] = dict((key, dict(counts))
+                                                for key, counts in self._subscription_counts.items())
+            return stats
+
+    def _add(self, histograms, key, timings):
+        with self._lock:
+            stages = histograms.setdefault(key, {})
+            for stage, seconds in timings.items():
+                if stage not in stages:
+                    stages[stage] = RollingHistogram(self.max_samples)
+                stages[stage].add(seconds)
+
+    def _count(self, counters, key, counts):
+        with self._lock:
+            values = counters.setdefault(key, {})
+            for name, count in counts.items():
+                values[name] = values.get(name, 0) + count
+
+
+def get_pipeline_stats():
+    """Returns the PipelineStats with the timings of the RSS Feed updates"""
+    global _pipeline_stats
+    if _pipeline_stats is None:
+        _pipeline_stats = PipelineStats()
+    return _pipeline_stats
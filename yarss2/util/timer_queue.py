@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012-2015 bendikro bro.devel+yarss2@gmail.com
+#
+# This file is part of YaRSS2 and is licensed under GNU General Public License 3.0, or later, with
+# the additional special exception to link portions of this program with the OpenSSL library.
+# See LICENSE for more details.
+#
+
+import heapq
+import random
+import traceback
+
+# Seconds between the runs of the timers that are started immediately
+DEFAULT_STARTUP_SPACING = 2
+# The first run of a timer is moved up to this fraction of the interval earlier
+DEFAULT_JITTER = 0.1
+
+# Used to spread the timers with the same interval evenly over the interval
+_GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+
+class TimerQueue(object):
+    """Runs periodic timers from a single reactor delayed call.
+
+    The timers are kept in a heap ordered by the time they are due, and only
+    the first timer in the heap has a delayed call in the reactor.
+
+    Timers started immediately (like RSS Feeds with update on startup) are run
+    startup_spacing seconds apart, and not all at the same time. The first run
+    of the other timers is spread over the interval, so timers sharing an interval
+    are not run at the same time, with a random jitter of up to jitter * interval.
+    """
+
+    def __init__(self, clock=None, startup_spacing=DEFAULT_STARTUP_SPACING, jitter=DEFAULT_JITTER,
+                 random_func=random.random):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        self.clock = clock
+        self.startup_spacing = startup_spacing
+        self.jitter = jitter
+        self.random_func = random_func
+        # key: [due, sequence, key, interval, func] The heap holds the same lists,
+        # and a removed timer is marked by setting func to None
+        self._timers = {}
+        self._heap = []
+        self._sequence = 0
+        self._next_startup = 0
+        self._delayed_call = None
+
+    def add(self, key, interval, func, now=False):
+        """Run func(key) every interval seconds. An existing timer with the same key is replaced.
+        If now is True, the first run is as soon as possible, otherwise within the interval"""
+        self.remove(key)
+        current = self.clock.seconds()
+        if now:
+            due = max(current, self._next_startup)
+            self._next_startup = due + self.startup_spacing
+        else:
+            index = len([t for t in self._timers.values() if t[3] == interval])
+            phase = (index * _GOLDEN_RATIO_FRACTION) % 1.0
+            due = current + interval * max(0, 1.0 - phase - self.jitter * self.random_func())
+        self._push(key, due, interval, func)
+
+    def set_interval(self, key, interval):
+        """Change the interval of the timer. The next run is interval seconds
+        after the last run, or as soon as possible if that time has passed"""
+        timer = self._timers.get(key)
+        if timer is None:
+            return False
+        due = max(self.clock.seconds(), timer[0] - timer[3] + interval)
+        func = timer[4]
+        self.remove(key)
+        self._push(key, due, interval, func)
+        return True
+
+    def remove(self, key):
+        """Remove the timer. Returns False if there is no timer with key"""
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer[4] = None
+        self._reschedule()
+        return True
+
+    def clear(self):
+        for key in list(self._timers.keys()):
+            self.remove(key)
+        self._heap = []
+        self._next_startup = 0
+
+    def get_interval(self, key):
+        """Returns the interval of the timer in seconds, or None"""
+        timer = self._timers.get(key)
+        return timer[3] if timer else None
+
+    def get_next_due(self, key):
+        """Returns when the timer will run next, in clock seconds, or None"""
+        timer = self._timers.get(key)
+        return timer[0] if timer else None
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _push(self, key, due, interval, func):
+        self._sequence += 1
+        timer = [due, self._sequence, key, interval, func]
+        self._timers[key] = timer
+        heapq.heappush(self._heap, timer)
+        self._reschedule()
+
+    def _reschedule(self):
+        """Make sure the delayed call is due when the first timer in the heap is due"""
+        while self._heap and self._heap[0][4] is None:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            if self._delayed_call is not None:
+                self._delayed_call.cancel()
+                self._delayed_call = None
+            return
+        delay = max(0, self._heap[0][0] - self.clock.seconds())
+        if self._delayed_call is None:
+            self._delayed_call = self.clock.callLater(delay, self._run_due)
+        elif self._delayed_call.getTime() != self.clock.seconds() + delay:
+            self._delayed_call.reset(delay)
+
+    def _run_due(self):
+        self._delayed_call = None
+        current = self.clock.seconds()
+        due_timers = []
+        while self._heap and self._heap[0][0] <= current:
+            timer = heapq.heappop(self._heap)
+            if timer[4] is not None:
+                due_timers.append(timer)
+        for due, sequence, key, interval, func in due_timers:
+            # Skip the runs that were missed if the reactor was blocked
+            next_due = due + interval
+            if next_due <= current:
+                next_due = current + interval
+            self._push(key, next_due, interval, func)
+        self._reschedule()
+        for due, sequence, key, interval, func in due_timers:
+            # The timer may have been removed by a timer run before it
+            if key not in self._timers:
+                continue
+            try:
+                func(key)
+            except Exception:
+                # Must not prevent running the other timers
+                traceback.print_exc()
@@ -15,6 +15,7 @@ all the interfaces.
 import os
 
 from deluge import bencode
+from deluge._libtorrent import lt
 from deluge.common import decode_string
 from deluge.ui.common import FileTree, FileTree2
 
@@ -28,6 +29,36 @@ except ImportError:
 log = logging.getLogger(__name__)
 
 
+class ParsedTorrent(object):
+    """
+    The metadata of a torrent file, decoded once when the torrent file has been downloaded.
+    Attached to the TorrentDownload, and used when checking the torrent and when adding it,
+    instead of decoding the torrent file at each step.
+
+    :param filedump: The content of the torrent file
+    :raises ValueError: If the torrent file cannot be decoded
+    """
+    def __init__(self, filedump):
+        self.filedump = filedump
+        try:
+            self.torrent_info = lt.torrent_info(lt.bdecode(filedump))
+        except Exception as e:
+            raise ValueError(str(e))
+        self.infohash = str(self.torrent_info.info_hash())
+        self.name = self.torrent_info.name()
+        self.size = self.torrent_info.total_size()
+        self.num_files = self.torrent_info.num_files()
+        self._files = None
+
+    @property
+    def files(self):
+        """A list of (path, size) of the files in the torrent"""
+        if self._files is None:
+            storage = self.torrent_info.files()
+            self._files = [(storage.file_path(index), storage.file_size(index)) for index in range(self.num_files)]
+        return self._files
+
+
 class TorrentInfo(object):
     """
     Collects information about a torrent file.
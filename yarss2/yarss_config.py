@@ -9,13 +9,17 @@
 
 import copy
 import platform
+import time
+from collections import deque
 
 import deluge.component as component
 import deluge.configmanager
 from deluge.event import DelugeEvent
 
-from yarss2.util import common
+from yarss2.util import common, http
 from yarss2.util.common import GeneralSubsConf
+from yarss2.util.config_saver import DEFAULT_SAVE_DELAY, ConfigSaver
+from yarss2.util.metrics import DEFAULT_METRICS_INTERVAL
 
 try:
     # Does not exist in python3
@@ -24,8 +28,19 @@ except NameError:
     unicode = str
 
 
-LATEST_CONFIG_VERSION = 9
+LATEST_CONFIG_VERSION = 10
 DEFAULT_UPDATE_INTERVAL = 120
+DEFAULT_MAX_CONCURRENT_FEED_UPDATES = 4
+DEFAULT_MAX_CONCURRENT_FEED_UPDATES_PER_HOST = 1
+DEFAULT_MAX_CONCURRENT_TORRENT_DOWNLOADS = 4
+# Seconds the torrent downloads are reused for matches in other RSS Feeds
+DEFAULT_TORRENT_DOWNLOAD_CACHE_TTL = 600
+# Limits of the update interval (minutes) learned with adaptive update interval
+DEFAULT_ADAPTIVE_UPDATE_INTERVAL_MIN = 10
+DEFAULT_ADAPTIVE_UPDATE_INTERVAL_MAX = 360
+
+# Number of changes remembered for the clients asking for the changes since their version
+CONFIG_CHANGES_MAX = 1000
 
 DUMMY_RSSFEED_KEY = "9999"
 CONFIG_FILENAME = "yarss2.conf"
@@ -36,7 +51,7 @@ __DEFAULT_PREFS = {
     "subscriptions": {},
     "cookies": {},
     "email_messages": {},
-    "general": {"show_log_in_gui": True},
+    "general": {},
 }
 
 
@@ -55,23 +70,25 @@ def get_user_agent(rssfeed_data=None):
 
 
 def default_prefs():
-    return copy.deepcopy(__DEFAULT_PREFS)
+    prefs = copy.deepcopy(__DEFAULT_PREFS)
+    prefs["general"] = get_fresh_general_config()
+    return prefs
 
 
-class YARSSConfigChangedEvent(DelugeEvent):
+class YARSSConfigChangesEvent(DelugeEvent):
     """
-    Emitted when the config has been changed.
+    Emitted when the config has been changed, with only the changes.
     """
-    def __init__(self, config):
+    def __init__(self, changes):
         """
-        :param config: the new config
+        :param changes: the changes as returned by YARSSConfig.get_config_changes
         """
-        self._args = [config]
+        self._args = [changes]
 
 
 class YARSSConfig(object):
 
-    def __init__(self, logger, config=None, core_config=None, verify_config=True):
+    def __init__(self, logger, config=None, core_config=None, verify_config=True, save_delay=DEFAULT_SAVE_DELAY):
         self.log = logger
         self.core_config = core_config
         self.config = config
@@ -80,6 +97,17 @@ class YARSSConfig(object):
         if config is None:
             self.config = deluge.configmanager.ConfigManager(CONFIG_FILENAME, default_prefs(),
                                                              file_version=LATEST_CONFIG_VERSION)
+        # The changes are written to the file save_delay seconds after the first change
+        self.saver = ConfigSaver(self.config, delay=save_delay)
+        # Incremented for each change. Starts at the current time in milliseconds, so the versions
+        # are newer than the versions seen by clients connected to an earlier daemon process.
+        self.version = int(time.time() * 1000)
+        # The changes before this version, e.g. made by an earlier daemon process, are not known
+        self._start_version = self.version
+        # The latest changes as (version, section, key). key is None if the whole section changed
+        self._changes = deque(maxlen=CONFIG_CHANGES_MAX)
+        self._emitted_version = self.version
+        self._notify = False
         if verify_config:
             self._verify_config()
 
@@ -87,7 +115,8 @@ class YARSSConfig(object):
             self.core_config = component.get("Core").get_config()
 
     def save(self):
-        self.config.save()
+        """Write the config to the file now"""
+        self.saver.save()
 
     def get_config(self):
         "returns the config dictionary"
@@ -113,7 +142,61 @@ class YARSSConfig(object):
         """Replaces the config data in self.config with the available keys in config"""
         for key in config.keys():
             self.config[key] = config[key]
-        self.config.save()
+            self.mark_changed(key)
+        self.saver.save_later()
+
+    def mark_changed(self, section, key=None, notify=True):
+        """Record that the element with key in the config section has changed, or
+        the whole section if key is None. The changes with notify False (like the
+        last update time of an RSS Feed) are sent to the clients with the next
+        YARSSConfigChangesEvent, but do not cause one. Must be called on the main thread"""
+        if section == "cookies":
+            http.invalidate_cookie_index()
+        self.version += 1
+        self._changes.append((self.version, section, key))
+        if notify:
+            self._notify = True
+
+    def get_config_changes(self, since_version=None):
+        """Returns the changes of the config after since_version, as a dictionary with:
+        * "version": The current version of the config
+        * "since": since_version
+        * "changes": {section: {key: element}} with the changed elements, where element is None if deleted
+        * "sections": {section: value} with the sections that have been replaced
+        If the changes after since_version are not known, e.g. since_version is None,
+        "config" holds the complete config (as returned by get_config) instead"""
+        result = {"version": self.version, "since": since_version, "changes": {}, "sections": {}}
+        # The oldest version the changes can be returned for
+        oldest_known = self._start_version
+        if len(self._changes) == self._changes.maxlen:
+            oldest_known = self._changes[0][0] - 1
+        if since_version is None or since_version > self.version or since_version < oldest_known:
+            result["config"] = self.get_config()
+            return result
+        for version, section, key in self._changes:
+            if version <= since_version:
+                continue
+            if key is None:
+                result["sections"][section] = self.config[section]
+                result["changes"].pop(section, None)
+            elif section not in result["sections"]:
+                result["changes"].setdefault(section, {})[key] = self.config[section].get(key, None)
+        return result
+
+    def emit_config_changes(self):
+        """Send the changes since the last event to the clients with YARSSConfigChangesEvent,
+        if any of them should notify the clients. Returns True if an event was emitted"""
+        if not self._notify:
+            return False
+        changes = self.get_config_changes(self._emitted_version)
+        self._emitted_version = self.version
+        self._notify = False
+        try:
+            # Tests throws KeyError for EventManager when running this method, so wrap this in try/except
+            component.get("EventManager").emit(YARSSConfigChangesEvent(changes))
+        except KeyError:
+            pass
+        return True
 
     def generic_save_config(self, config_name, dict_key=None, data_dict=None, delete=False):
         """Save email message to config.
@@ -141,8 +224,9 @@ class YARSSConfig(object):
             # Value is None, means delete entry with key dict_key
             if dict_key in config:
                 del config[dict_key]
+                self.mark_changed(config_name, dict_key)
                 # Save main config to file
-                self.config.save()
+                self.saver.save_later()
                 return self.config.config
             else:
                 raise ValueError("generic_save_config: Invalid key - "
@@ -156,9 +240,20 @@ class YARSSConfig(object):
                 dict_key = data_dict["key"]
 
         config[dict_key] = data_dict
-        self.config.save()
+        self.mark_changed(config_name, dict_key)
+        self.saver.save_later()
         return self.config.config
 
+    def reset_rssfeed_validators(self, rssfeed_key):
+        """Clear the conditional GET values of the rssfeed, which makes
+        the next update fetch and match the complete RSS Feed"""
+        rssfeed = self.config["rssfeeds"].get(rssfeed_key, None)
+        if rssfeed is None:
+            return
+        rssfeed["etag"] = u""
+        rssfeed["modified"] = u""
+        self.mark_changed("rssfeeds", rssfeed_key, notify=False)
+
     def _verify_config(self):
         """Adding missing keys, in case a new version adds more config fields"""
         changed = False
@@ -172,6 +267,7 @@ class YARSSConfig(object):
         self.config.run_converter((6, 6), 7, self.update_config_to_version7)
         self.config.run_converter((7, 7), 8, self.update_config_to_version8)
         self.config.run_converter((8, 8), 9, self.update_config_to_version9)
+        self.config.run_converter((9, 9), 10, self.update_config_to_version10)
 
         default_config = get_fresh_subscription_config(key="")
         if self._insert_missing_dict_values(self.config["subscriptions"], default_config):
@@ -203,8 +299,14 @@ class YARSSConfig(object):
         if self._verify_types(None, self.config["email_configurations"], default_config):
             changed = True
 
+        default_config = get_fresh_general_config()
+        if self._insert_missing_dict_values(self.config["general"], default_config, level=1):
+            changed = True
+        if self._verify_types(None, self.config["general"], default_config):
+            changed = True
+
         if changed:
-            self.config.save()
+            self.saver.save_later()
 
     def _verify_types_config_elements(self, config_dict, default_config):
         """Takes a dictinoary and calls _verify_types with each element
@@ -500,6 +602,28 @@ class YARSSConfig(object):
         self.run_for_each_dict_element(config["rssfeeds"], update_rssfeed)
         return config
 
+    def update_config_to_version10(self, config):
+        """Updates the config values to config file version (YaRSS2 v2.2.0)"""
+        self.log.info("Updating config file to version 10")
+        default_general_config = get_fresh_general_config()
+        general = config.setdefault("general", {})
+
+        # Adding new fields
+        for key in ("max_concurrent_feed_updates", "max_concurrent_feed_updates_per_host",
+                    "max_concurrent_torrent_downloads"):
+            general[key] = default_general_config[key]
+
+        default_rssfeed_config = get_fresh_rssfeed_config()
+
+        def update_rssfeed(rssfeed):
+            # Adding new fields
+            for key in ("etag", "modified", "adaptive_update_interval",
+                        "adaptive_update_interval_min", "adaptive_update_interval_max"):
+                rssfeed[key] = default_rssfeed_config[key]
+
+        self.run_for_each_dict_element(config["rssfeeds"], update_rssfeed)
+        return config
+
     def run_for_each_dict_element(self, conf_dict, update_func):
         for key in conf_dict.keys():
             update_func(conf_dict[key])
@@ -525,6 +649,25 @@ def get_fresh_email_config():
     return config_dict
 
 
+def get_fresh_general_config():
+    """Return the default general dictionary"""
+    config_dict = {}
+    config_dict["show_log_in_gui"] = True
+    # Number of RSS Feeds that are fetched at the same time, in total and per host
+    config_dict["max_concurrent_feed_updates"] = DEFAULT_MAX_CONCURRENT_FEED_UPDATES
+    config_dict["max_concurrent_feed_updates_per_host"] = DEFAULT_MAX_CONCURRENT_FEED_UPDATES_PER_HOST
+    # Number of torrent files downloaded at the same time for each RSS Feed update
+    config_dict["max_concurrent_torrent_downloads"] = DEFAULT_MAX_CONCURRENT_TORRENT_DOWNLOADS
+    # Seconds a downloaded torrent is reused when matched again, also in other RSS Feeds.
+    # With 0, the downloads are only reused within one update of an RSS Feed
+    config_dict["torrent_download_cache_ttl"] = DEFAULT_TORRENT_DOWNLOAD_CACHE_TTL
+    # File the metrics are written to in the Prometheus text format. Empty disables writing the metrics
+    config_dict["metrics_file"] = u""
+    # Seconds between the writes of the metrics file
+    config_dict["metrics_interval"] = DEFAULT_METRICS_INTERVAL
+    return config_dict
+
+
 def get_fresh_rssfeed_config(name=u"", url=u"", site=u"", active=True, last_update=u"",
                              update_interval=DEFAULT_UPDATE_INTERVAL, update_on_startup=False,
                              obey_ttl=False, user_agent=u"", key=None):
@@ -541,6 +684,13 @@ def get_fresh_rssfeed_config(name=u"", url=u"", site=u"", active=True, last_upda
     config_dict["user_agent"] = user_agent
     config_dict["prefer_magnet"] = False
     config_dict["use_cookies"] = True
+    # The ETag and Last-Modified values from the last response, used for conditional GET
+    config_dict["etag"] = u""
+    config_dict["modified"] = u""
+    # Learn the update interval from the arrival rate of new items, instead of using update_interval
+    config_dict["adaptive_update_interval"] = False
+    config_dict["adaptive_update_interval_min"] = DEFAULT_ADAPTIVE_UPDATE_INTERVAL_MIN
+    config_dict["adaptive_update_interval_max"] = DEFAULT_ADAPTIVE_UPDATE_INTERVAL_MAX
     if key:
         config_dict["key"] = key
     return config_dict